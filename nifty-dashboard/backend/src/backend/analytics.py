@@ -1,20 +1,35 @@
 # analytics.py
 import numpy as np
 import pandas as pd
+from backend.metrics import timed_fn
 
 STRIKE_STEP = 50
+# strike spacing per underlying (STRIKE_STEP for anything not listed)
+STRIKE_STEPS = {'NIFTY': 50, 'BANKNIFTY': 100, 'FINNIFTY': 50, 'MIDCPNIFTY': 25}
+# contract (lot) sizes; NSE's option-chain OI is in contracts. NSE revises these periodically
+LOT_SIZES = {'NIFTY': 65, 'BANKNIFTY': 30, 'FINNIFTY': 60, 'MIDCPNIFTY': 120}
+# FIXED window: this many strikes below / above the ATM strike (-500/+550 on NIFTY)
+FIXED_BELOW, FIXED_ABOVE = 10, 11
+
+def strike_step(symbol):
+    return STRIKE_STEPS.get(symbol, STRIKE_STEP)
+
+def lot_size(symbol):
+    return LOT_SIZES.get(symbol, 1)
 
 def round_to_nearest_strike(spot, step=STRIKE_STEP):
     return int(round(spot / step) * step) if spot is not None else None
 
+@timed_fn('compute_vwap')
 def compute_vwap(df):
     if df.empty: return {}
     df = df.copy()
     df['pv'] = df['lastPrice'] * df['volume']
-    g = df.groupby('optionType').agg({'pv':'sum','volume':'sum'})
+    g = df.groupby('optionType', observed=True).agg({'pv':'sum','volume':'sum'})
     g['VWAP'] = g['pv'] / g['volume'].replace(0, np.nan)
     return g['VWAP'].to_dict()
 
+@timed_fn('compute_pcr')
 def compute_pcr(df, mode='OI', exclude_zero=False, strike_min=None, strike_max=None):
     """
     Compute PCR from DataFrame df.
@@ -66,7 +81,7 @@ def compute_pcr(df, mode='OI', exclude_zero=False, strike_min=None, strike_max=N
     # per-strike aggregation + exclusion when exclude_zero == True
     # build pivot: index=strike, columns=optionType, values=OI or volume
     val_col = 'volume' if mode == 'VOLUME' else 'OI'
-    pivot = d.pivot_table(index='strike', columns='optionType', values=val_col, aggfunc='sum').fillna(0)
+    pivot = d.pivot_table(index='strike', columns='optionType', values=val_col, aggfunc='sum', observed=True).fillna(0)
 
     # ensure columns exist
     if 'CE' not in pivot.columns:
@@ -88,31 +103,69 @@ def compute_window_bounds_from_spot(spot, fixed=True, atm_window_strikes=3, step
     atm = round_to_nearest_strike(spot, step)
     if atm is None: return None, None, None
     if fixed:
-        low = atm - 500
-        high = atm + 550
+        low = atm - FIXED_BELOW * step
+        high = atm + FIXED_ABOVE * step
     else:
         low = atm - atm_window_strikes * step
         high = atm + atm_window_strikes * step
     return atm, low, high
 
-def compute_max_pain(df):
-    strikes = sorted(df['strike'].unique())
-    if not strikes: return None
-    pivot = df.pivot_table(index='strike', columns='optionType', values='OI', aggfunc='sum').fillna(0)
-    pain_map = {}
-    for s0 in strikes:
-        total = 0
-        for s in strikes:
-            ce = pivot.loc[s,'CE'] if 'CE' in pivot.columns else 0
-            pe = pivot.loc[s,'PE'] if 'PE' in pivot.columns else 0
-            total += max(0, s0 - s) * ce + max(0, s - s0) * pe
-        pain_map[s0] = total
-    mp = min(pain_map, key=pain_map.get)
-    return {'max_pain_strike': int(mp), 'pain_map': pain_map}
+def pain_curve(strikes, ce_oi, pe_oi):
+    """
+    Writers' total payout if expiry settles at each strike, for all strikes at once.
 
+    `strikes` must be sorted ascending with `ce_oi`/`pe_oi` aligned to it.
+    pain(s0) = sum_s ce(s)*max(0, s0-s) + pe(s)*max(0, s-s0), evaluated with
+    prefix sums so the whole curve costs O(n) after the sort.
+    """
+    k = np.asarray(strikes, dtype=float)
+    ce = np.asarray(ce_oi, dtype=float)
+    pe = np.asarray(pe_oi, dtype=float)
+    ce_cum = np.cumsum(ce)
+    ce_k_cum = np.cumsum(ce * k)
+    # puts strictly above each strike (the strike itself contributes zero)
+    pe_above = pe.sum() - np.cumsum(pe)
+    pe_k_above = (pe * k).sum() - np.cumsum(pe * k)
+    return (k * ce_cum - ce_k_cum) + (pe_k_above - k * pe_above)
+
+def _strike_oi(df):
+    strikes, idx = np.unique(df['strike'].to_numpy(dtype=float), return_inverse=True)
+    oi = df['OI'].to_numpy(dtype=float)
+    is_ce = (df['optionType'] == 'CE').to_numpy()
+    is_pe = (df['optionType'] == 'PE').to_numpy()
+    ce = np.bincount(idx, weights=np.where(is_ce, oi, 0.0), minlength=len(strikes))
+    pe = np.bincount(idx, weights=np.where(is_pe, oi, 0.0), minlength=len(strikes))
+    return strikes, ce, pe
+
+def max_pain_from_curve(strikes, pain):
+    if len(strikes) == 0: return None
+    mp = strikes[int(np.argmin(pain))]
+    return {'max_pain_strike': int(mp), 'pain_map': dict(zip(strikes.tolist(), pain.tolist()))}
+
+@timed_fn('compute_max_pain')
+def compute_max_pain(df, by_expiry=False):
+    """
+    Max pain strike and the full pain curve {strike: payout} for df.
+
+    OI is summed per strike across whatever expiries df holds. With
+    by_expiry=True returns {'YYYY-MM-DD': <same result>} computed per expiry.
+    """
+    if df is None or df.empty: return None
+    if by_expiry:
+        out = {}
+        for exp, g in df.groupby('expiry', observed=True, sort=True):
+            out[pd.Timestamp(exp).strftime('%Y-%m-%d')] = _max_pain(g)
+        return out
+    return _max_pain(df)
+
+def _max_pain(df):
+    strikes, ce, pe = _strike_oi(df)
+    return max_pain_from_curve(strikes, pain_curve(strikes, ce, pe))
+
+@timed_fn('compute_skew')
 def compute_skew(df):
     if df.empty: return None
-    med_iv = df.groupby('optionType')['impliedVolatility'].median().to_dict()
-    ce_iv = med_iv.get('CE', np.nan)
-    pe_iv = med_iv.get('PE', np.nan)
+    med_iv = df.groupby('optionType', observed=True)['impliedVolatility'].median().to_dict()
+    ce_iv = float(med_iv.get('CE', np.nan))
+    pe_iv = float(med_iv.get('PE', np.nan))
     return (pe_iv/ce_iv) if (ce_iv and not np.isnan(ce_iv)) else None
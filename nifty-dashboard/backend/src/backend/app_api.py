@@ -1,192 +1,439 @@
 # app_api.py
-import pandas as pd, os, json, requests
+import pandas as pd, numpy as np, os, time
+from functools import partial
 from flask import jsonify, request, current_app as app
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, g, abort, make_response
 from flask_cors import CORS
-from backend.fetcher import fetch_nse_json, normalize_nse_json
-from backend.analytics import compute_vwap, compute_pcr, compute_max_pain, compute_skew, compute_window_bounds_from_spot
-from backend.candles import append_snapshot, build_candles_from_snapshots
-from datetime import datetime
+from werkzeug.exceptions import HTTPException
+from backend.fetcher import normalize_nse_json, chain_records, NSE_INDEX_URL, NSE_MARKET_URL, SYMBOLS, INDEX_NAMES
+from backend.nse_client import get_client
+from backend.analytics import strike_step, lot_size, compute_window_bounds_from_spot
+from backend.chainframe import compute_chain_stats
+from backend.candles import latest_candle, candle_files, aggregator, read_candles
+from backend.snapshot import SnapshotGroup, diff_chain
+from backend.shared import SharedSnapshots
+from backend.ingest import subscribe_recorders
+from backend.stream import StreamHub
+from backend.payloads import ChainPayloads, FORMATS
+from backend.history import HistoryStore, history_root
+from backend.intraday import ChainRing
+from backend.volsurface import SurfaceCache
+from backend.gex import GexCache
+from backend.pivots import PivotTables
+from backend.scenarios import resolve_legs, scenario_grid, GREEKS
+from backend.jsonpath import PathResolver
+from backend.ttlcache import TTLCache
+from backend import metrics
 
 app = Flask(__name__)
 CORS(app)
 
+@app.before_request
+def _start_timing():
+    g.t0 = time.perf_counter()
+    # ?profile=1: collect this request's stage timings (stages run on other threads are not included)
+    g.profile = request.args.get('profile') == '1'
+    if g.profile:
+        metrics.start_profile()
+
+@app.after_request
+def _finish_timing(resp):
+    elapsed = time.perf_counter() - g.t0
+    metrics.REQUEST_SECONDS.observe(elapsed, request.endpoint or 'unknown', resp.status_code)
+    if g.profile:
+        stages = metrics.stop_profile()
+        resp.headers['Server-Timing'] = ", ".join(
+            ['%s;dur=%.3f' % (s.replace(':', '_'), sec * 1e3) for s, sec in stages] + ['total;dur=%.3f' % (elapsed * 1e3)])
+        if resp.is_json and not resp.headers.get('Content-Encoding'):
+            body = resp.get_json(silent=True)
+            if isinstance(body, dict):
+                body['profile'] = {'total_ms': round(elapsed * 1e3, 3),
+                                   'stages': [{'stage': s, 'ms': round(sec * 1e3, 3)} for s, sec in stages]}
+                resp.set_data(app.json.dumps(body))
+    return resp
+
+# NSE_SHARED_SNAPSHOTS=1: this is one of several WSGI workers; `python -m backend.ingest`
+# fetches and records, and the workers map its snapshots from shared memory
+SHARED = os.environ.get("NSE_SHARED_SNAPSHOTS", "0") == "1"
+
+if SHARED:
+    snapshots = SharedSnapshots(SYMBOLS)
+else:
+    # every underlying in NSE_SYMBOLS gets its own snapshot service, polled together by
+    # one scheduler on a bounded worker pool; endpoints serve from the in-memory snapshots
+    snapshots = SnapshotGroup(SYMBOLS, normalize=normalize_nse_json)
+
+# per-underlying state (snapshot service, history, ring, payload cache, streams), wired at the bottom
+feeds = {}
+
+def _bad_request(message, **extra):
+    abort(make_response(jsonify(dict({"error": "bad_request", "message": message}, **extra)), 400))
+
+def _feed():
+    """Feed for ?symbol= (default: the first of NSE_SYMBOLS); 400 for an unconfigured underlying."""
+    symbol = (request.args.get('symbol') or SYMBOLS[0]).upper()
+    feed = feeds.get(symbol)
+    if feed is None:
+        _bad_request("symbol must be one of %s" % ", ".join(SYMBOLS))
+    return feed
+
+def _expiry_arg():
+    """?expiry= as the 'YYYY-MM-DD' key snapshots are partitioned by (any parseable date), or None."""
+    e = request.args.get('expiry')
+    if not e:
+        return None
+    try:
+        return pd.Timestamp(e).strftime('%Y-%m-%d')
+    except ValueError:
+        _bad_request("expiry must be a date, e.g. 2025-09-23")
+
+def _check_expiry(snap, expiry):
+    if expiry is not None and expiry not in snap['expiries']:
+        _bad_request("no %s expiry %s" % (snap['symbol'], expiry), expiries=list(snap['expiries']))
+
 @app.route("/api/nifty/optionchain")
 def optionchain():
+    # ?since=<version> -> only legs changed after that version; ?format=columnar -> arrays per field;
+    # ?expiry=YYYY-MM-DD -> that expiry's legs only
+    feed = _feed()
+    expiry = _expiry_arg()
+    since = request.args.get('since', type=int)
+    fmt = request.args.get('format', 'records')
+    if fmt not in FORMATS:
+        return jsonify({"error": "bad_request", "message": "format must be one of %s" % ", ".join(FORMATS)}), 400
+    snapshots, payloads = feed['snapshots'], feed['payloads']
     try:
-        j = fetch_nse_json()
-        df = normalize_nse_json(j)
-        return jsonify(df.to_dict(orient='records'))
+        snap = snapshots.get()
+        _check_expiry(snap, expiry)
+        meta = snapshots.meta(snap)
+        gzip_ok = 'gzip' in request.headers.get('Accept-Encoding', '')
+        # every `since` no kept snapshot has maps onto one full body and ETag
+        since = payloads.since_key(since)
+        # the client's copy is current: answer 304 without building a body
+        etag = next((t for t in {ChainPayloads.etag(snap['version'], since, fmt, g, expiry) for g in (gzip_ok, False)}
+                     if t in request.if_none_match), None)
+        if request.if_none_match:
+            metrics.cache('optionchain_etag', etag is not None)
+        if etag is not None:
+            resp = Response(status=304)
+        else:
+            body, gzipped = payloads.body(snap, since, fmt, gzip_ok, expiry)
+            etag = ChainPayloads.etag(snap['version'], since, fmt, gzipped, expiry)
+            resp = Response(body, mimetype='application/json')
+            if gzipped:
+                resp.headers['Content-Encoding'] = 'gzip'
+        resp.set_etag(etag)
+        resp.headers['Vary'] = 'Accept-Encoding'
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.headers['X-Snapshot-Version'] = str(meta['version'])
+        resp.headers['X-Snapshot-Age'] = str(meta['age'])
+        resp.headers['X-Snapshot-Stale'] = 'true' if meta['stale'] else 'false'
+        return resp
+    except HTTPException:
+        raise
     except Exception as e:
+        metrics.error('optionchain')
         app.logger.exception("Failed to fetch/normalize optionchain")
         return jsonify({"error":"fetch_failed","message":str(e)}), 500
 
+def compute_window_stats(snap, mode='FIXED', atm_window=3, expiry=None):
+    # expiry=None -> every expiry of the snapshot; otherwise its pre-partitioned ChainFrame
+    symbol = snap['symbol']
+    chain = snap['chain'] if expiry is None else snap['chain'].by_expiry[expiry]
+    with metrics.timed('window_stats_compute'):
+        stats = compute_chain_stats(chain, mode, atm_window, strike_step(symbol))
+    stats['symbol'] = symbol
+    stats['expiry'] = expiry
+    prev_close = stats['prev_close']
+
+    # compute Avg (H-L, H-Pc, Pc-L) from the current candle, held in memory
+    # (shared snapshots carry the ingest process's candle)
+    avg_val = None
+    last = snap['candle'] if 'candle' in snap else latest_candle(symbol)
+    if last:
+        H = last.get('high')
+        L = last.get('low')
+        if prev_close is not None and H is not None and L is not None:
+            avg_val = max(H - L, abs(H - prev_close), abs(L - prev_close))
+
+    stats['avg_val'] = avg_val
+    return stats
+
 @app.route("/api/nifty/window_stats")
 def window_stats():
+    feed = _feed()
+    expiry = _expiry_arg()
     mode = request.args.get('mode','FIXED')
     atm_window = int(request.args.get('atm_window', 3))
+    snapshots = feed['snapshots']
     try:
-        j = fetch_nse_json()
-        df = normalize_nse_json(j)
+        snap = snapshots.get()
+        _check_expiry(snap, expiry)
+        stats = compute_window_stats(snap, mode, atm_window, expiry)
+        # return JSON including pcr_window_details for verification
+        stats['snapshot'] = snapshots.meta(snap)
+        return jsonify(stats)
 
-        # compute spot/atm/window bounds
-        spot = float(df['underlyingPrice'].median()) if (df is not None and not df.empty) else None
-        atm, low, high = compute_window_bounds_from_spot(spot, fixed=(mode == 'FIXED'), atm_window_strikes=atm_window)
+    except HTTPException:
+        raise
+    except Exception as e:
+        metrics.error('window_stats')
+        app.logger.exception("window_stats failed")
+        safe = {'atm': None, 'low': None, 'high': None, 'pcr_window': None, 'pcr_window_details': {"CE_OI":0,"PE_OI":0,"CE_vol":0,"PE_vol":0}, 'pcr_overall': None, 'vwap': {}, 'max_pain': None, 'max_pain_by_expiry': None, 'skew': None, 'prev_close': None, 'avg_val': None, 'error': str(e)}
+        return jsonify(safe), 200
 
-        # build window_df safely (if low/high None -> full df)
-        if low is None or high is None:
-            window_df = df.copy() if (df is not None) else pd.DataFrame()
-        else:
-            window_df = df[(df['strike'] >= low) & (df['strike'] <= high)].copy()
+# endpoint: IV smile per expiry, ATM IV / 25-delta RR and BF term structure and a surface grid,
+# fitted once per snapshot version (?expiry= picks the smile returned, default nearest)
+@app.route("/api/nifty/vol_surface")
+def vol_surface():
+    feed = _feed()
+    expiry = _expiry_arg()
+    snapshots = feed['snapshots']
+    try:
+        snap = snapshots.get()
+        _check_expiry(snap, expiry)
+        out = feed['surfaces'].get(snap).to_dict(expiry)
+        out['snapshot'] = snapshots.meta(snap)
+        return jsonify(out)
+    except HTTPException:
+        raise
+    except Exception as e:
+        metrics.error('vol_surface')
+        app.logger.exception("vol_surface failed")
+        return jsonify({"error": "vol_surface_failed", "message": str(e)}), 500
 
-        # compute pcr_window with per-strike exclusion so it matches frontend behavior
-        try:
-            pcr_window = compute_pcr(window_df, mode='OI', exclude_zero=True, strike_min=low, strike_max=high)
-        except Exception:
-            app.logger.exception("compute_pcr(window) failed")
-            pcr_window = None
-
-        # compute detailed CE/PE totals for the same window (for verification/debug)
-        def _compute_window_totals(df_window):
-            if df_window is None or df_window.empty:
-                return {"CE_OI": 0, "PE_OI": 0, "CE_vol": 0, "PE_vol": 0}
-            pivot_oi = df_window.pivot_table(index='strike', columns='optionType', values='OI', aggfunc='sum').fillna(0)
-            pivot_vol = df_window.pivot_table(index='strike', columns='optionType', values='volume', aggfunc='sum').fillna(0)
-            if 'CE' not in pivot_oi.columns:
-                pivot_oi['CE'] = 0
-            if 'PE' not in pivot_oi.columns:
-                pivot_oi['PE'] = 0
-            if 'CE' not in pivot_vol.columns:
-                pivot_vol['CE'] = 0
-            if 'PE' not in pivot_vol.columns:
-                pivot_vol['PE'] = 0
-
-            # apply same exclusion rule used by compute_pcr(exclude_zero=True): keep strikes where both CE>0 and PE>0
-            keep = (pivot_oi['CE'] > 0) & (pivot_oi['PE'] > 0)
-            pivot_oi_kept = pivot_oi[keep]
-            pivot_vol_kept = pivot_vol[keep]
-
-            ce_oi_total = int(pivot_oi_kept['CE'].sum())
-            pe_oi_total = int(pivot_oi_kept['PE'].sum())
-            ce_vol_total = int(pivot_vol_kept['CE'].sum())
-            pe_vol_total = int(pivot_vol_kept['PE'].sum())
-
-            return {
-                "CE_OI": ce_oi_total,
-                "PE_OI": pe_oi_total,
-                "CE_vol": ce_vol_total,
-                "PE_vol": pe_vol_total
-            }
-
-        pcr_window_details = _compute_window_totals(window_df)
-
-        # compute overall PCR as before (legacy/global-sum)
-        try:
-            pcr_overall = compute_pcr(df, mode='OI', exclude_zero=False)
-        except Exception:
-            app.logger.exception("compute_pcr(overall) failed")
-            pcr_overall = None
-
-        # VWAP, Max Pain, Skew, Prev Close & avg_val calculation (unchanged)
-        vwap = compute_vwap(window_df)
-        mp = compute_max_pain(window_df)
-        skew = compute_skew(window_df)
-        prev_close = float(df['underlyingPrice'].iloc[0]) if (df is not None and not df.empty) else None
-
-        # compute Avg (H-L, H-Pc, Pc-L) using latest candles/fallback
-        avg_val = None
-        try:
-            import json, os
-            cf = "data/candles_1m.json"
-            if os.path.exists(cf):
-                with open(cf) as fh:
-                    candles = json.load(fh)
-                    if candles:
-                        last = candles[-1]
-                        H = last.get('high')
-                        L = last.get('low')
-                        if prev_close is not None and H is not None and L is not None:
-                            avg_val = max(H - L, abs(H - prev_close), abs(L - prev_close))
-        except Exception:
-            avg_val = None
-
-        snap = {'ts': datetime.utcnow().isoformat(), 'underlyingPrice': spot, 'volume_sum': int(df['volume'].sum()) if (df is not None and not df.empty) else 0}
-        try:
-            append_snapshot(snap)
-            build_candles_from_snapshots()
-        except Exception:
-            app.logger.exception("snapshot append failed")
+# endpoint: dealer gamma exposure by strike and over a spot grid (+-10%), with the zero-gamma level;
+# computed when each snapshot version arrives (?expiry= restricts it to one expiry)
+@app.route("/api/nifty/gex")
+def gex():
+    feed = _feed()
+    expiry = _expiry_arg()
+    snapshots = feed['snapshots']
+    try:
+        snap = snapshots.get()
+        _check_expiry(snap, expiry)
+        out = feed['gex'].get(snap).to_dict(expiry)
+        out['snapshot'] = snapshots.meta(snap)
+        return jsonify(out)
+    except HTTPException:
+        raise
+    except Exception as e:
+        metrics.error('gex')
+        app.logger.exception("gex failed")
+        return jsonify({"error": "gex_failed", "message": str(e)}), 500
 
-        # return JSON including pcr_window_details for verification
-        return jsonify({
-            'atm': atm, 'low': low, 'high': high,
-            'pcr_window': pcr_window, 'pcr_window_details': pcr_window_details, 'pcr_overall': pcr_overall,
-            'vwap': vwap, 'max_pain': mp, 'skew': skew, 'prev_close': prev_close,
-            'avg_val': avg_val
-        })
+# endpoint: the strike and PCR tables of one expiry (default nearest), precomputed per snapshot
+# version: per-strike CE/PE rows with PCR, running sums and heat ranks, plus ITM/ATM/OTM/TOTAL buckets.
+# Window as window_stats (?mode=FIXED|ATM, ?atm_window=) or explicit ?strike_min=&strike_max=
+@app.route("/api/nifty/pivot_tables")
+def pivot_tables():
+    feed = _feed()
+    expiry = _expiry_arg()
+    mode = request.args.get('mode', 'FIXED')
+    atm_window = request.args.get('atm_window', 3, type=int)
+    low = request.args.get('strike_min', type=float)
+    high = request.args.get('strike_max', type=float)
+    snapshots = feed['snapshots']
+    try:
+        snap = snapshots.get()
+        _check_expiry(snap, expiry)
+        if not snap['expiries']:
+            _bad_request("no %s expiries in the snapshot" % snap['symbol'])
+        expiry = expiry or next(iter(snap['expiries']))
+        if low is None and high is None:
+            _, low, high = compute_window_bounds_from_spot(snap['chain'].spot, mode == 'FIXED', atm_window, feed['step'])
+        # cache key and ETag use the window snapped onto listed strikes, not the raw bounds
+        low, high = feed['pivots'].window(snap, low, high)
+        meta = snapshots.meta(snap)
+        etag = PivotTables.etag(snap['version'], expiry, low, high)
+        if etag in request.if_none_match:
+            resp = Response(status=304)
+        else:
+            resp = Response(feed['pivots'].body(snap, expiry, low, high), mimetype='application/json')
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.headers['X-Snapshot-Version'] = str(meta['version'])
+        resp.headers['X-Snapshot-Age'] = str(meta['age'])
+        resp.headers['X-Snapshot-Stale'] = 'true' if meta['stale'] else 'false'
+        return resp
+    except HTTPException:
+        raise
+    except Exception as e:
+        metrics.error('pivot_tables')
+        app.logger.exception("pivot_tables failed")
+        return jsonify({"error": "pivot_tables_failed", "message": str(e)}), 500
 
+def _rounded(a, digits):
+    return np.round(a, digits).tolist()
+
+# endpoint: P&L and aggregate greeks of a multi-leg position over days elapsed x IV shift x spot move.
+# POST {"legs": [{"strike", "type": "CE"|"PE", "expiry", "qty" (lots, <0 short), "price"?, "iv"?}, ...],
+#       "spot_moves"?, "iv_shifts"?, "days"? (lists or {min, max, points}), "greeks"?}
+@app.route("/api/nifty/scenarios", methods=["POST"])
+def scenarios():
+    feed = _feed()
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        _bad_request("expected a JSON object body with legs")
+    greeks = body.get('greeks', list(GREEKS))
+    if not isinstance(greeks, list) or not all(isinstance(name, str) for name in greeks):
+        _bad_request("greeks must be a list, e.g. %s" % list(GREEKS))
+    snapshots = feed['snapshots']
+    try:
+        snap = snapshots.get()
+        try:
+            legs = resolve_legs(body.get('legs'), snap)
+            grid = scenario_grid(legs, snap['chain'].spot, body.get('spot_moves'), body.get('iv_shifts'),
+                                 body.get('days'), lot_size(feed['symbol']), greeks=greeks)
+        except ValueError as e:
+            _bad_request(str(e))
+        out = {
+            'spot': snap['chain'].spot,
+            'lot_size': lot_size(feed['symbol']),
+            'legs': [{'strike': float(k), 'type': 'CE' if c else 'PE', 'expiry': e, 'qty': float(q),
+                      'price': round(float(p), 2), 'iv': round(float(v), 4), 'days': round(float(t) * 365.0, 3)}
+                     for k, c, e, q, p, v, t in zip(legs['strike'], legs['call'], legs['expiry'], legs['qty'],
+                                                    legs['price'], legs['iv'], legs['t'])],
+            'axes': {'days': grid['days'].tolist(), 'iv_shifts': grid['iv_shifts'].tolist(),
+                     'spot_moves': grid['spot_moves'].tolist(), 'spot': _rounded(grid['spot'], 2)},
+            # [days][iv_shifts][spot_moves]
+            'pnl': _rounded(grid['pnl'], 2),
+            'greeks': {name: _rounded(grid[name], 6) for name in greeks},
+            'snapshot': snapshots.meta(snap),
+        }
+        return jsonify(out)
+    except HTTPException:
+        raise
     except Exception as e:
-        app.logger.exception("window_stats failed")
-        safe = {'atm': None, 'low': None, 'high': None, 'pcr_window': None, 'pcr_window_details': {"CE_OI":0,"PE_OI":0,"CE_vol":0,"PE_vol":0}, 'pcr_overall': None, 'vwap': {}, 'max_pain': None, 'skew': None, 'prev_close': None, 'avg_val': None, 'error': str(e)}
-        return jsonify(safe), 200
+        metrics.error('scenarios')
+        app.logger.exception("scenarios failed")
+        return jsonify({"error": "scenarios_failed", "message": str(e)}), 500
 
 @app.route("/api/nifty/candles")
 def get_candles():
-    f = "data/candles_1m.json"
-    if not os.path.exists(f): return jsonify([])
-    with open(f) as fh: return jsonify(json.load(fh))
+    symbol = _feed()['symbol']
+    if not SHARED:
+        # this process builds the candles: serve them from memory
+        return jsonify(aggregator(symbol).candles())
+    # workers read the ingest process's file (replaced atomically), parsed once per version
+    return jsonify(read_candles(candle_files(symbol)[1]))
 
-# helper: simple requests get with browser headers
-session = requests.Session()
+# endpoint: recorded chain history (one IST trading day, optional time/expiry/strike filters)
+@app.route("/api/nifty/history")
+def chain_history():
+    history = _feed()['history']
+    days = history.days()
+    day = request.args.get('day') or (days[-1] if days else None)
+    if day is None or day not in days:
+        return jsonify({"error": "no_history", "days": days}), 200
+    strike_min = request.args.get('strike_min', type=float)
+    strike_max = request.args.get('strike_max', type=float)
+    expiry = _expiry_arg()
+    try:
+        if request.args.get('at') is not None or request.args.get('latest'):
+            df = history.snapshot_at(day, request.args.get('at'), expiry, strike_min, strike_max)
+        else:
+            df = history.read(day, request.args.get('start'), request.args.get('end'), expiry, strike_min, strike_max)
+    except ValueError as e:
+        return jsonify({"error": "bad_request", "message": str(e)}), 400
+    out = {}
+    for c in df.columns:
+        col = df[c]
+        if c in ('ts', 'expiry', 'optionType'):
+            out[c] = col.astype(str).tolist()
+        elif col.dtype.kind == 'f':
+            out[c] = col.astype(float).round(2).tolist()
+        else:
+            out[c] = col.tolist()
+    return jsonify({"day": day, "rows": len(df), "columns": out})
+
+def _ring_args():
+    # the rings sum every expiry; per-expiry series are not kept
+    if request.args.get('expiry'):
+        _bad_request("intraday history covers all expiries; per-expiry series are not recorded")
+    last = request.args.get('last', type=int)
+    return request.args.get('start'), request.args.get('end'), last
 
-headers = {
-    #"User-Agent": "Mozilla/5.0", "Accept-Language": "en-US,en;q=0.9"
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                    "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-    "Accept": "application/json, text/javascript, */*; q=0.01",
-    "Accept-Language": "en-US,en;q=0.9"
-}
+def _ts_list(ts):
+    return np.datetime_as_string(ts.astype('datetime64[ns]'), unit='ms').tolist()
+
+def _float_list(a):
+    return [None if np.isnan(x) else x for x in np.asarray(a, dtype=float).tolist()]
+
+# endpoint: PCR (window and overall), spot and max pain per sample from the in-memory ring
+# (this worker's ring: under NSE_SHARED_SNAPSHOTS workers can return different samples)
+@app.route("/api/nifty/pcr_history")
+def pcr_history():
+    feed = _feed()
+    mode = request.args.get('mode', 'FIXED')
+    atm_window = int(request.args.get('atm_window', 3))
+    start, end, last = _ring_args()
+    try:
+        h = feed['ring'].pcr(fixed=(mode == 'FIXED'), atm_window_strikes=atm_window, step=feed['step'],
+                             start=start, end=end, last=last)
+    except ValueError as e:
+        return jsonify({"error": "bad_request", "message": str(e)}), 400
+    out = {k: _float_list(v) for k, v in h.items() if k != 'ts'}
+    out['ts'] = _ts_list(h['ts'])
+    return jsonify(out)
+
+# endpoint: per-strike CE/PE OI series from the in-memory ring (?strike=25000,25050 or strike_min/strike_max)
+@app.route("/api/nifty/oi_history")
+def oi_history():
+    ring = _feed()['ring']
+    strike = request.args.get('strike')
+    start, end, last = _ring_args()
+    try:
+        strikes = [float(k) for k in strike.split(',')] if strike else None
+        ts, values, oi, vol = ring.strike_history(strikes, request.args.get('strike_min', type=float),
+                                                  request.args.get('strike_max', type=float), start, end, last)
+    except ValueError as e:
+        return jsonify({"error": "bad_request", "message": str(e)}), 400
+    # OI change is relative to the first sample returned
+    change = oi - oi[:1] if len(oi) else oi
+    series = {}
+    for j, k in enumerate(values.tolist()):
+        series[('%g' % k)] = {
+            'CE_OI': oi[:, j, 0].tolist(), 'PE_OI': oi[:, j, 1].tolist(),
+            'CE_OI_change': change[:, j, 0].tolist(), 'PE_OI_change': change[:, j, 1].tolist(),
+            'CE_vol': vol[:, j, 0].tolist(), 'PE_vol': vol[:, j, 1].tolist(),
+        }
+    return jsonify({'ts': _ts_list(ts), 'strikes': values.tolist(), 'series': series})
 
 def nse_fetch_json(url, params=None):
     try:
-        # load homepage once to set cookies if not already
-        if not session.cookies:
-            session.get("https://www.nseindia.com", headers=headers, timeout=10)
-        resp = session.get(url, params=params, headers=headers, timeout=10)
-        resp.raise_for_status()
-        return resp.json()
+        return get_client().get_json(url, params=params)
     except Exception as e:
+        metrics.error('nse_fetch_json')
         app.logger.exception("nse_fetch_json failed for %s", url)
         return None
 
-# endpoint: index OHLC for NIFTY 50
-@app.route("/api/nifty/index_ohlc")
-def index_ohlc():
-    url = "https://www.nseindia.com/api/NextApi/apiClient?functionName=getIndexData"
-    params = {"functionName": "getIndexData"}
-    j = nse_fetch_json(url, params=None)
-    if not j:
-        return jsonify({"error": "no_data"}), 200
-
-    # same parsing logic as before...
-    def find_index_entries(obj):
-        if isinstance(obj, list):
-            for it in obj:
-                if isinstance(it, dict) and it.get("indexName") == "NIFTY 50":
-                    return it
-                res = find_index_entries(it)
-                if res: return res
-        elif isinstance(obj, dict):
-            if obj.get("indexName") == "NIFTY 50":
-                return obj
-            for v in obj.values():
-                res = find_index_entries(v)
-                if res: return res
-        return None
+def _snapshot_extra(name, url):
+    # index/market data polled alongside the first underlying's chain; fetch directly only if
+    # the poll missed it (never from a shared-snapshot worker: only the ingest process calls NSE)
+    try:
+        j = snapshots[SYMBOLS[0]].get()['extras'].get(name)
+    except Exception:
+        metrics.error('snapshot_extra')
+        app.logger.exception("snapshot unavailable for %s", name)
+        j = None
+    return j if j is not None or SHARED else nse_fetch_json(url)
+
+# learned locations of the index / advance-decline fields in NSE's payloads (see backend.jsonpath)
+_index_paths = {}
 
-    found = find_index_entries(j)
+def _index_resolver(index_name):
+    r = _index_paths.get(index_name)
+    if r is None:
+        r = _index_paths[index_name] = PathResolver(
+            'index:' + index_name, lambda obj: isinstance(obj, dict) and obj.get("indexName") == index_name)
+    return r
+
+def parse_index_ohlc(j, index_name="NIFTY 50"):
+    """`index_name` OHLC fields from a getIndexData payload, or None if absent."""
+    _, found = _index_resolver(index_name).resolve(j)
     if not found:
-        return jsonify({"error": "nifty_not_found", "raw": j}), 200
+        return None
 
     last = float(found.get("last") or 0)
     open_ = float(found.get("open") or 0)
@@ -195,12 +442,13 @@ def index_ohlc():
     prev_close = float(found.get("previousClose") or found.get("prevClose") or 0)
 
     avg_val = None
+    momentum = None
     if prev_close and high and low:
         momentum = max(high - low, abs(high - prev_close), abs(low - prev_close))
         avg_val = momentum/2
 
-    return jsonify({
-        "indexName": "NIFTY 50",
+    return {
+        "indexName": index_name,
         "last": last,
         "open": open_,
         "high": high,
@@ -208,76 +456,185 @@ def index_ohlc():
         "prev_close": prev_close,
         "momentum": momentum,
         "avg_val": avg_val
-    })
-
-# endpoint: market statistics (advance/decline)
-@app.route("/api/nifty/market_stats")
-def market_stats():
-    src = "https://www.nseindia.com/api/NextApi/apiClient?"
-    params = {
-        "functionName": "getMarketStatistics"
     }
-    j = nse_fetch_json(src, params=params)
+
+# response bodies of index_ohlc / market_stats, shared by all requests (NSE_STATS_TTL, NSE_STATS_STALE)
+# (body, raw) pairs; "no_data" (nothing polled yet, or the NSE call failed) is not cached, so the next request retries
+stats_cache = TTLCache('stats', cacheable=lambda v: v[0].get('error') != 'no_data')
+
+def _with_raw(body, raw):
+    # the NSE payload is only sent back on request (?raw=1)
+    if request.args.get('raw') == '1':
+        body = dict(body, raw=raw)
+    return jsonify(body)
+
+def _index_ohlc_body(symbol):
+    j = _snapshot_extra('index', NSE_INDEX_URL)
     if not j:
-        return jsonify({"error": "no_data"}), 200
-
-    # Search for advance/decline metrics
-    # The structure of response may vary; try to get advance/decline counts, e.g. "advance" or "advances" keys
-    def find_adv_dec(obj):
-        if isinstance(obj, dict):
-            if "advance" in obj or "advances" in obj or "decline" in obj or "declines" in obj:
-                return obj
-            for v in obj.values():
-                res = find_adv_dec(v)
-                if res:
-                    return res
-        elif isinstance(obj, list):
-            for it in obj:
-                res = find_adv_dec(it)
-                if res:
-                    return res
-        return None
+        return {"error": "no_data"}, None
+    found = parse_index_ohlc(j, INDEX_NAMES.get(symbol, symbol))
+    if not found:
+        return {"error": "nifty_not_found"}, j
+    return found, j
 
-    found = find_adv_dec(j)
-    # Build safe response:
+# endpoint: index OHLC for the underlying's index (NIFTY 50 by default); ?raw=1 adds the NSE payload
+@app.route("/api/nifty/index_ohlc")
+def index_ohlc():
+    symbol = _feed()['symbol']
+    body, raw = stats_cache.get(('index_ohlc', symbol), partial(_index_ohlc_body, symbol))
+    return _with_raw(body, raw)
+
+_ADV_DEC_KEYS = ("advance", "advances", "decline", "declines")
+_adv_dec = PathResolver('adv_dec', lambda obj: isinstance(obj, dict) and any(k in obj for k in _ADV_DEC_KEYS))
+
+def _adv_dec_key_path(obj, path=()):
+    # path to the first key naming advances or declines: every key of a dict before its values
+    if isinstance(obj, dict):
+        for k in obj:
+            if "adv" in k.lower() or "dec" in k.lower():
+                return path + (k,)
+        for k, v in obj.items():
+            res = _adv_dec_key_path(v, path + (k,))
+            if res:
+                return res
+    elif isinstance(obj, list):
+        for i, it in enumerate(obj):
+            res = _adv_dec_key_path(it, path + (i,))
+            if res:
+                return res
+    return None
+
+_adv_dec_key = PathResolver('adv_dec_key', lambda node: True, scan=_adv_dec_key_path)
+
+def parse_market_stats(j):
+    """(advance, decline) counts from a getMarketStatistics payload; either may be None."""
+    # The structure of the response may vary: look for an object with advance/decline keys
+    # ("advance" or "advances", ...), else for any key naming one of them
     adv = None
     dec = None
     try:
+        _, found = _adv_dec.resolve(j)
         if isinstance(found, dict):
             # try common fields
             adv = found.get("advances") or found.get("advance") or found.get("adv")
             dec = found.get("declines") or found.get("decline") or found.get("dec")
-        # fallback search for numeric fields anywhere
         if adv is None or dec is None:
-            # do simple scan
-            def scan_for_nums(obj):
-                if isinstance(obj, dict):
-                    for k,v in obj.items():
-                        if k.lower().find("advance")>=0 or k.lower().find("adv")>=0:
-                            return ("adv", v)
-                        if k.lower().find("decline")>=0 or k.lower().find("dec")>=0:
-                            return ("dec", v)
-                    for v in obj.values():
-                        res = scan_for_nums(v)
-                        if res:
-                            return res
-                elif isinstance(obj, list):
-                    for it in obj:
-                        res = scan_for_nums(it)
-                        if res:
-                            return res
-                return None
-            res = scan_for_nums(j)
-            if res:
-                if res[0]=="adv":
-                    adv = res[1]
-                elif res[0]=="dec":
-                    dec = res[1]
+            path, value = _adv_dec_key.resolve(j)
+            if path:
+                if "adv" in path[-1].lower():
+                    adv = value
+                else:
+                    dec = value
     except Exception:
         pass
 
-    return jsonify({"advance": adv, "decline": dec, "raw": j}), 200
-    
+    return adv, dec
+
+def _market_stats_body():
+    j = _snapshot_extra('market', NSE_MARKET_URL)
+    if not j:
+        return {"error": "no_data"}, None
+    adv, dec = parse_market_stats(j)
+    return {"advance": adv, "decline": dec}, j
+
+# endpoint: market statistics (advance/decline; market-wide, whatever the symbol); ?raw=1 adds the NSE payload
+@app.route("/api/nifty/market_stats")
+def market_stats():
+    _feed()
+    body, raw = stats_cache.get('market_stats', _market_stats_body)
+    return _with_raw(body, raw)
+
+def _stream_build(symbol, key):
+    mode, atm_window, expiry = key
+    index_name = INDEX_NAMES.get(symbol, symbol)
+    def build(snap, prev):
+        # one message per snapshot version: everything the dashboard polls for,
+        # with only the chain rows that changed since `prev` (all rows when None);
+        # `expiry` narrows the window stats, the chain rows always cover every expiry
+        df = snap['df']
+        mask = diff_chain(prev['df'], df) if prev is not None else None
+        primary = snapshots[SYMBOLS[0]].latest()
+        extras = primary['extras'] if primary is not None else {}
+        adv, dec = parse_market_stats(extras['market']) if extras.get('market') else (None, None)
+        stats = None
+        if expiry is None or expiry in snap['expiries']:
+            stats = compute_window_stats(snap, mode, atm_window, expiry)
+        return {
+            'version': snap['version'],
+            'ts': snap['ts'],
+            'symbol': symbol,
+            'window_stats': stats,
+            'index_ohlc': parse_index_ohlc(extras['index'], index_name) if extras.get('index') else None,
+            'market_stats': {'advance': adv, 'decline': dec},
+            # shared snapshots carry the ingest process's candle
+            'candle': snap['candle'] if 'candle' in snap else latest_candle(symbol),
+            'chain': {'full': mask is None, 'rows': chain_records(df if mask is None else df[mask])},
+        }
+    return build
+
+# stream channels are keyed by their parameters, so only a few values are accepted
+STREAM_MODES = ('FIXED', 'ATM')
+STREAM_MAX_ATM_WINDOW = 10
+
+# endpoint: Server-Sent Events, one shared message per new snapshot version
+@app.route("/api/nifty/stream")
+def stream():
+    feed = _feed()
+    expiry = _expiry_arg()
+    mode = request.args.get('mode', 'FIXED')
+    if mode not in STREAM_MODES:
+        _bad_request("mode must be one of %s" % ", ".join(STREAM_MODES))
+    atm_window = request.args.get('atm_window', 3, type=int)
+    # FIXED ignores the ATM window: every FIXED stream shares one channel
+    atm_window = 3 if mode == 'FIXED' else min(max(atm_window, 1), STREAM_MAX_ATM_WINDOW)
+    if snapshots.interval > 0:
+        snapshots.start()
+    # also the snapshot `expiry` is checked against; in on-demand mode the stream
+    # then pushes whatever other requests refresh
+    try: snap = feed['snapshots'].get()
+    except Exception:
+        app.logger.exception("snapshot unavailable for stream")
+        snap = None
+    if expiry is not None:
+        if snap is None:
+            # nothing to check the expiry against yet
+            return jsonify({"error": "snapshot_unavailable"}), 503
+        _check_expiry(snap, expiry)
+    return Response(feed['streams'].messages((mode, atm_window, expiry)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# endpoint: Prometheus text-format metrics (stage histograms, request latency, errors, cache hits)
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+if not SHARED:
+    # history, snapshot log and candles are written by whichever process fetches
+    subscribe_recorders(snapshots)
+for symbol in SYMBOLS:
+    service = snapshots[symbol]
+    feeds[symbol] = feed = {
+        'symbol': symbol,
+        'step': strike_step(symbol),
+        'snapshots': service,
+        'history': HistoryStore(history_root(symbol)),
+        # serialized optionchain bodies, cached per snapshot version
+        'payloads': ChainPayloads(encode=lambda o: app.json.dumps(o, separators=(',', ':'))),
+        # intraday per-strike OI / PCR series, kept in memory (NSE_RING_SAMPLES samples)
+        # (per process: with NSE_SHARED_SNAPSHOTS each worker keeps its own, from the versions it saw)
+        'ring': ChainRing(),
+        'surfaces': SurfaceCache(),
+        'gex': GexCache(lot_size(symbol)),
+        # strike / PCR table bodies, cached per snapshot version and window
+        'pivots': PivotTables(encode=lambda o: app.json.dumps(o, separators=(',', ':')), step=strike_step(symbol)),
+        'streams': StreamHub(partial(_stream_build, symbol), encode=app.json.dumps),
+    }
+    service.subscribe(feed['payloads'].publish)
+    service.subscribe(feed['ring'].append)
+    service.subscribe(feed['gex'].publish)
+    service.subscribe(feed['pivots'].publish)
+    service.subscribe(feed['streams'].publish)
+
 if __name__ == "__main__":
     os.makedirs('data', exist_ok=True)
     app.run(host='0.0.0.0', port=8000, debug=True)
@@ -0,0 +1,250 @@
+# bench.py
+"""
+Benchmarks for the option-chain pipeline over synthetic NSE payloads.
+
+    python -m backend.bench                                        # default sizes, print timings
+    python -m backend.bench --strikes 200 --expiries 6 --zero-oi 0.3 --snapshots 20000 --out bench.json
+    python -m backend.bench --baseline bench_main.json --threshold 0.25   # exit 1 on regression
+
+Each stage is timed with timeit (auto-ranged loop count, median of
+`--repeat` runs). Results are written as JSON so two commits can be
+compared; with --baseline any stage slower than baseline * (1 + threshold)
+is reported and the exit status is 1.
+"""
+import argparse, json, logging, os, platform, subprocess, tempfile, timeit
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# valuation time for the greeks stages, fixed so runs are comparable
+BENCH_NOW = datetime(2025, 9, 19, 12, 0)
+
+
+def _time(fn, repeat):
+    timer = timeit.Timer(fn)
+    loops, _ = timer.autorange()
+    runs = [t / loops * 1e3 for t in timer.repeat(repeat, loops)]
+    return {'median_ms': float(np.median(runs)), 'min_ms': min(runs), 'loops': loops, 'repeat': repeat}
+
+
+def _pipeline_stages(gen):
+    from backend.analytics import compute_pcr, compute_max_pain, compute_skew, compute_vwap, compute_window_bounds_from_spot
+    from backend.chainframe import ChainFrame, compute_chain_stats
+    from backend.fetcher import normalize_nse_json, chain_records
+    from backend.greeks import bs_greeks_batch, implied_vol_batch, chain_greeks, years_to_expiry, RISK_FREE_RATE
+    from backend.volsurface import VolSurface
+    from backend.gex import GexProfile
+    from backend.scenarios import position_cube
+    from backend.pivots import build_tables
+
+    payload = gen.payload()
+    df = normalize_nse_json(payload)
+    _, low, high = compute_window_bounds_from_spot(gen.spot)
+    chain = ChainFrame.from_df(df)
+    S = df['underlyingPrice'].to_numpy(dtype=float)
+    K = df['strike'].to_numpy(dtype=float)
+    call = (df['optionType'] == 'CE').to_numpy()
+    t = years_to_expiry(df['expiry'], BENCH_NOW)
+    sigma = np.maximum(df['impliedVolatility'].to_numpy(dtype=float), 1.0) / 100
+    price = df['lastPrice'].to_numpy(dtype=float)
+
+    # 4-leg book over 100 spot levels x 20 IV shifts x 50 days (1e5 scenarios)
+    book_K = np.round(gen.spot / 50) * 50 + np.array([-300.0, 0.0, 0.0, 300.0])
+    book_call = np.array([False, False, True, True])
+    book_qty = np.array([1.0, -1.0, -1.0, 1.0])
+    book_t, book_iv = np.full(4, 0.05), np.array([14.0, 13.0, 13.0, 12.5])
+    spots = gen.spot * np.linspace(0.9, 1.1, 100)
+    shifts, days = np.linspace(-10, 10, 20), np.linspace(0, 10, 50)
+
+    near = next(g for _, g in df.groupby('expiry', observed=True, sort=True))
+
+    def fresh_stats():
+        return compute_chain_stats(ChainFrame.from_df(df))
+
+    return [
+        ('normalize_nse_json', lambda: normalize_nse_json(payload)),
+        ('chain_records', lambda: chain_records(df)),
+        ('compute_pcr', lambda: compute_pcr(df, 'OI', exclude_zero=True, strike_min=low, strike_max=high)),
+        ('compute_max_pain', lambda: compute_max_pain(df)),
+        ('compute_max_pain_by_expiry', lambda: compute_max_pain(df, by_expiry=True)),
+        ('compute_skew', lambda: compute_skew(df)),
+        ('compute_vwap', lambda: compute_vwap(df)),
+        ('chainframe_from_df', lambda: ChainFrame.from_df(df)),
+        ('compute_chain_stats', fresh_stats),
+        ('compute_chain_stats_cached', lambda: compute_chain_stats(chain)),
+        ('bs_greeks_batch', lambda: bs_greeks_batch(S, K, RISK_FREE_RATE, sigma, t, call)),
+        ('implied_vol_batch', lambda: implied_vol_batch(price, S, K, RISK_FREE_RATE, t, call)),
+        ('chain_greeks', lambda: chain_greeks(df, now=BENCH_NOW)),
+        ('vol_surface_fit', lambda: VolSurface.fit(df, BENCH_NOW)),
+        ('gex_profile', lambda: GexProfile.compute(df, BENCH_NOW, lot=65)),
+        ('pivot_tables_build', lambda: build_tables(near, gen.spot, low=low, high=high)),
+        ('scenario_cube_1e5', lambda: position_cube(spots, book_K, book_call, book_qty, book_t, book_iv, shifts, days)),
+    ]
+
+
+def _candle_stages(workdir, snapshots):
+    from backend.candles import CandleAggregator
+    from backend.synth import write_snapshot_log
+
+    log_file = os.path.join(workdir, 'snapshots.jsonl')
+    candles_file = os.path.join(workdir, 'candles_1m.json')
+    write_snapshot_log(log_file, snapshots)
+    with open(log_file) as fh:
+        last = json.loads(fh.readlines()[-1])
+    live = CandleAggregator(log_file, candles_file)
+    live.load()
+    state = {'ts': datetime.fromisoformat(last['ts'])}
+
+    def rebuild():
+        # startup without a candles file: the whole log is folded once
+        if os.path.exists(candles_file):
+            os.remove(candles_file)
+        agg = CandleAggregator(log_file, candles_file)
+        agg.load()
+        return agg.dump()
+
+    def incremental():
+        # one new poll folded into the open bar and the candles file body re-encoded, as persist does
+        state['ts'] = state['ts'] + pd.Timedelta(seconds=3)
+        live.add({'ts': state['ts'].isoformat(), 'underlyingPrice': last['underlyingPrice'],
+                  'volume_sum': last['volume_sum']})
+        return live.dump()
+
+    return [
+        ('build_candles_rebuild', rebuild),
+        ('build_candles_incremental', incremental),
+    ]
+
+
+def _request_stages(gen, workdir):
+    # the real Flask app, fed synthetic payloads through SnapshotService's fetch hook
+    os.environ.setdefault('NSE_HISTORY', '0')
+    os.environ.setdefault('NSE_POLL_INTERVAL', '0')
+    os.environ.setdefault('NSE_SYMBOLS', 'NIFTY')
+    os.chdir(workdir)
+    from backend import app_api
+
+    payloads = []
+    for _ in range(8):
+        gen.step()
+        payloads.append(gen.payload())
+    state = {'i': 0}
+
+    def fetch():
+        state['i'] += 1
+        return {'optionchain': payloads[state['i'] % len(payloads)], 'index': None, 'market': None}
+
+    snaps = app_api.snapshots['NIFTY']
+    snaps.fetch, snaps.interval = fetch, 0
+    client = app_api.app.test_client()
+
+    def get(path, ttl):
+        def call():
+            snaps.ttl = ttl
+            r = client.get(path)
+            assert r.status_code == 200, r.status_code
+        return call
+
+    client.get('/api/nifty/window_stats')
+    return [
+        ('GET window_stats (cached snapshot)', get('/api/nifty/window_stats?mode=FIXED', 1e9)),
+        ('GET window_stats (new snapshot)', get('/api/nifty/window_stats?mode=FIXED', 0)),
+        ('GET optionchain (cached snapshot)', get('/api/nifty/optionchain', 1e9)),
+        ('GET vol_surface (cached fit)', get('/api/nifty/vol_surface', 1e9)),
+        ('GET gex (cached profile)', get('/api/nifty/gex', 1e9)),
+        ('GET pivot_tables (cached body)', get('/api/nifty/pivot_tables', 1e9)),
+    ]
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def run(strikes=120, expiries=4, zero_oi=0.2, snapshots=5000, repeat=5, only=None, seed=1):
+    """Time every stage; returns {'meta': {...}, 'results': {stage: timings}}."""
+    from backend.synth import ChainGenerator
+
+    params = {'strikes': strikes, 'expiries': expiries, 'zero_oi': zero_oi, 'snapshots': snapshots, 'seed': seed}
+    meta = {'params': params, 'commit': _git_commit(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'machine': platform.machine(),
+            'ts': datetime.now().isoformat(timespec='seconds')}
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='nifty-bench-') as workdir:
+        try:
+            groups = (
+                lambda: _pipeline_stages(ChainGenerator(strikes, expiries, zero_oi, seed=seed)),
+                lambda: _candle_stages(workdir, snapshots),
+                lambda: _request_stages(ChainGenerator(strikes, expiries, zero_oi, seed=seed), workdir),
+            )
+            for group in groups:
+                for name, fn in group():
+                    if only and not any(o in name for o in only):
+                        continue
+                    results[name] = _time(fn, repeat)
+                    log.info("%-36s %10.3f ms", name, results[name]['median_ms'])
+        finally:
+            os.chdir(cwd)
+    return {'meta': meta, 'results': results}
+
+
+def compare(current, baseline, threshold=0.2):
+    """
+    [(stage, baseline_ms, current_ms, ratio, regressed)] for stages in both
+    runs; a stage regressed when its median exceeds baseline * (1 + threshold).
+    """
+    out = []
+    for name, cur in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+        ratio = cur['median_ms'] / base['median_ms'] if base['median_ms'] else float('inf')
+        out.append((name, base['median_ms'], cur['median_ms'], ratio, ratio > 1 + threshold))
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the option-chain pipeline on synthetic data.")
+    ap.add_argument('--strikes', type=int, default=120, help="strikes per expiry")
+    ap.add_argument('--expiries', type=int, default=4)
+    ap.add_argument('--zero-oi', type=float, default=0.2, help="share of legs with zero OI")
+    ap.add_argument('--snapshots', type=int, default=5000, help="snapshot log length for the candle stages")
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--only', nargs='*', help="run stages whose name contains any of these")
+    ap.add_argument('--out', help="write results JSON here")
+    ap.add_argument('--baseline', help="results JSON to compare against")
+    ap.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown vs baseline (0.2 = 20%%)")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    res = run(args.strikes, args.expiries, args.zero_oi, args.snapshots, args.repeat, args.only)
+    if args.out:
+        with open(args.out, 'w') as fh:
+            json.dump(res, fh, indent=2)
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    if baseline.get('meta', {}).get('params') != res['meta']['params']:
+        log.warning("baseline was run with different parameters: %s", baseline.get('meta', {}).get('params'))
+    rows = compare(res, baseline, args.threshold)
+    log.info("\n%-36s %12s %12s %8s", "stage", "baseline ms", "current ms", "ratio")
+    for name, base, cur, ratio, bad in rows:
+        log.info("%-36s %12.3f %12.3f %7.2fx%s", name, base, cur, ratio, "  REGRESSION" if bad else "")
+    regressed = [r[0] for r in rows if r[4]]
+    if regressed:
+        log.error("%d stage(s) slower than baseline by more than %.0f%%: %s",
+                  len(regressed), args.threshold * 100, ", ".join(regressed))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,37 +1,291 @@
 # candles.py
-import json, os
+import json, os, tempfile, threading
 from datetime import datetime
+from backend import metrics
 
 SNAPSHOT_FILE = "data/snapshots.jsonl"
 CANDLES_FILE = "data/candles_1m.json"
 
-def append_snapshot(snapshot):
-    os.makedirs('data', exist_ok=True)
-    with open(SNAPSHOT_FILE, 'a') as f:
-        f.write(json.dumps(snapshot, default=str) + "\n")
-
-def build_candles_from_snapshots():
-    rows = []
-    if not os.path.exists(SNAPSHOT_FILE): return []
-    with open(SNAPSHOT_FILE) as f:
-        for line in f:
-            rows.append(json.loads(line))
-    buckets = {}
-    for r in rows:
-        ts = datetime.fromisoformat(r['ts'])
-        key = ts.replace(second=0, microsecond=0)
-        rec = buckets.setdefault(key.isoformat(), {'open':None,'high':-1e9,'low':1e9,'close':None,'volume':0})
-        price = r.get('underlyingPrice', None)
-        if price is None: continue
-        if rec['open'] is None: rec['open'] = price
-        rec['high'] = max(rec['high'], price)
-        rec['low'] = min(rec['low'], price)
-        rec['close'] = price
-        rec['volume'] += r.get('volume_sum', 0)
-    out = []
-    for k in sorted(buckets.keys()):
-        v = buckets[k]
-        out.append({'ts': k, 'open': v['open'], 'high': v['high'], 'low': v['low'], 'close': v['close'], 'volume': v['volume']})
-    with open(CANDLES_FILE, 'w') as f:
-        json.dump(out, f, default=str)
-    return out
+_TAIL_CHUNK = 64 * 1024
+
+def candle_files(symbol):
+    """(snapshot log, candles file) for `symbol`; NIFTY keeps the top-level files, others live in data/<symbol>/."""
+    if symbol == 'NIFTY':
+        return SNAPSHOT_FILE, CANDLES_FILE
+    d = os.path.join('data', symbol)
+    return os.path.join(d, os.path.basename(SNAPSHOT_FILE)), os.path.join(d, os.path.basename(CANDLES_FILE))
+
+def append_snapshot(snapshot, path=SNAPSHOT_FILE):
+    append_snapshots([snapshot], path)
+
+@metrics.timed_fn('snapshot_append')
+def append_snapshots(snapshots, path=SNAPSHOT_FILE):
+    """Append rows to the snapshot log in one write."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(''.join(json.dumps(s, default=str) + "\n" for s in snapshots))
+
+def write_atomic(path, data):
+    """Replace `path` with bytes `data` via a temp file in the same directory, so readers see the old or the new file, never part of one."""
+    d = os.path.dirname(path) or '.'
+    os.makedirs(d, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=d, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+_read_cache = {}
+
+def read_candles(path):
+    """Parsed candles file, re-read only when it has been replaced since the last call."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return []
+    key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    hit = _read_cache.get(path)
+    metrics.cache('candles_file', hit is not None and hit[0] == key)
+    if hit is not None and hit[0] == key:
+        return hit[1]
+    with open(path) as f:
+        bars = json.load(f)
+    _read_cache[path] = (key, bars)
+    return bars
+
+def _bucket_key(ts):
+    return datetime.fromisoformat(ts).replace(second=0, microsecond=0).isoformat()
+
+def _new_bar():
+    return {'open':None,'high':-1e9,'low':1e9,'close':None,'volume':0}
+
+def _fold(rec, r):
+    price = r.get('underlyingPrice', None)
+    if price is None: return
+    if rec['open'] is None: rec['open'] = price
+    rec['high'] = max(rec['high'], price)
+    rec['low'] = min(rec['low'], price)
+    rec['close'] = price
+    rec['volume'] += r.get('volume_sum', 0)
+
+def _bar_out(key, v):
+    return {'ts': key, 'open': v['open'], 'high': v['high'], 'low': v['low'], 'close': v['close'], 'volume': v['volume']}
+
+
+class CandleAggregator:
+    """
+    Incremental 1-minute candles over the snapshot log.
+
+    add() folds rows in memory as they are produced, in the process that
+    writes the log (see persist.PersistWriter); the log is only read on
+    the first load. Only the open (latest) bar changes per row, and a late
+    row is folded into its own minute.
+
+    Closed bars are JSON-encoded once and kept. dump() is that encoding
+    plus the open bar, byte-identical to a full rebuild of the log, and
+    the file is replaced whole with write_atomic.
+
+    On first use the state is recovered from the existing candles file plus
+    the tail of the log covering its last (possibly still open) minute. If
+    the candles file is missing or unreadable, or that tail is out of
+    order or does not rebuild the file's last bar (late rows can hide the
+    start of its minute), the log is rebuilt from scratch once.
+    """
+
+    def __init__(self, snapshot_file=SNAPSHOT_FILE, candles_file=CANDLES_FILE):
+        self.snapshot_file = snapshot_file
+        self.candles_file = candles_file
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._loaded = False
+        self._offset = 0        # bytes of the snapshot log already consumed
+        self._closed = []       # closed bars, in output form
+        self._key = None        # minute of the open bar
+        self._bar = None
+        self._encoded = 0       # closed bars already in _head
+        self._head = ''         # their JSON, comma separated
+
+    def candles(self):
+        with self._lock:
+            return self._candles()
+
+    def last(self):
+        with self._lock:
+            if self._key is not None:
+                return _bar_out(self._key, self._bar)
+            return self._closed[-1] if self._closed else None
+
+    def _candles(self):
+        if self._key is None:
+            return list(self._closed)
+        return self._closed + [_bar_out(self._key, self._bar)]
+
+    def load(self):
+        """Recover the bars from the candles file and the log, if not done yet."""
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        if self._loaded:
+            return
+        if os.path.exists(self.snapshot_file):
+            last = self._recover()
+            if not self._consume() or not self._covers(last):
+                self._rebuild()
+        self._loaded = True
+
+    def add(self, r):
+        """Fold one snapshot-log row ({ts, underlyingPrice, volume_sum}) into the bars, in memory."""
+        with self._lock:
+            self._load()
+            if not self._add(r):
+                self._merge(r)
+
+    def dump(self):
+        """The candles file contents (bytes) for the current bars."""
+        with self._lock:
+            return self._dump()
+
+    def _add(self, r):
+        key = _bucket_key(r['ts'])
+        if self._key is None or key > self._key:
+            if self._key is not None:
+                self._closed.append(_bar_out(self._key, self._bar))
+            self._key, self._bar = key, _new_bar()
+        elif key < self._key:
+            return False
+        _fold(self._bar, r)
+        return True
+
+    def _merge(self, r):
+        # a row older than the open bar: fold it into its minute, as _rebuild would
+        metrics.inc('candle_out_of_order')
+        key = _bucket_key(r['ts'])
+        i = len(self._closed)
+        while i and self._closed[i - 1]['ts'] > key:
+            i -= 1
+        if i and self._closed[i - 1]['ts'] == key:
+            _fold(self._closed[i - 1], r)
+        else:
+            bar = _new_bar()
+            _fold(bar, r)
+            self._closed.insert(i, _bar_out(key, bar))
+        self._encoded, self._head = 0, ''
+
+    def _consume(self):
+        # returns False when an out-of-order snapshot requires a full rebuild
+        with open(self.snapshot_file, 'rb') as f:
+            f.seek(0, 2)
+            if f.tell() < self._offset:
+                return False
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1  # leave a partially written last line for next time
+        for line in data[:end].splitlines():
+            if line.strip() and not self._add(json.loads(line)):
+                return False
+        self._offset += end
+        return True
+
+    def _rebuild(self):
+        # full pass over the log, merging rows into their minute whatever their order
+        metrics.inc('candle_rebuild')
+        self._reset()
+        self._loaded = True
+        with open(self.snapshot_file, 'rb') as f:
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        buckets = {}
+        for line in data[:end].splitlines():
+            if not line.strip(): continue
+            r = json.loads(line)
+            _fold(buckets.setdefault(_bucket_key(r['ts']), _new_bar()), r)
+        keys = sorted(buckets.keys())
+        if keys:
+            self._closed = [_bar_out(k, buckets[k]) for k in keys[:-1]]
+            self._key, self._bar = keys[-1], buckets[keys[-1]]
+        self._offset = end
+
+    def _recover(self):
+        # returns (index, bar) of the candles file's last bar, which the log tail is
+        # replayed over; None when nothing was recovered
+        self._loaded = True
+        try:
+            with open(self.candles_file) as f:
+                bars = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not bars:
+            return None
+        last_key = bars[-1]['ts']
+        self._closed = bars[:-1]
+        self._offset = self._resume_offset(last_key)
+        return len(self._closed), bars[-1]
+
+    def _covers(self, recovered):
+        # the replayed tail must rebuild at least the file's last bar. A late row
+        # can end the backwards walk before the first line of that minute; the
+        # rows skipped then show up as a missing bar, another open or less volume
+        if recovered is None:
+            return True
+        i, bar = recovered
+        bars = self._candles()
+        got = bars[i] if len(bars) > i else None
+        return (got is not None and got['ts'] == bar['ts'] and got['open'] == bar['open']
+                and got['volume'] >= bar['volume'] and got['high'] >= bar['high'] and got['low'] <= bar['low'])
+
+    def _resume_offset(self, last_key):
+        # walk the log backwards to the first line of the last candle's minute;
+        # a partially written last line is left alone, as _consume does
+        with open(self.snapshot_file, 'rb') as f:
+            f.seek(0, 2)
+            size = pos = f.tell()
+            carry = b''
+            tail = True
+            while pos > 0:
+                step = min(_TAIL_CHUNK, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step) + carry
+                lines = chunk.split(b'\n')
+                carry = lines.pop(0) if pos > 0 else b''
+                line_end = pos + len(chunk)
+                for line in reversed(lines):
+                    if tail:
+                        # whatever follows the last newline is not a complete line yet
+                        tail = False
+                    elif line.strip() and _bucket_key(json.loads(line)['ts']) < last_key:
+                        return min(line_end + 1, size)
+                    line_end -= len(line) + 1
+        return 0
+
+    def _dump(self):
+        parts = [self._head] if self._head else []
+        for i in range(self._encoded, len(self._closed)):
+            parts.append(json.dumps(self._closed[i], default=str))
+        self._head = ', '.join(parts)
+        self._encoded = len(self._closed)
+        body = [self._head] if self._head else []
+        if self._key is not None:
+            body.append(json.dumps(_bar_out(self._key, self._bar), default=str))
+        return ('[' + ', '.join(body) + ']').encode()
+
+_aggregators = {}
+_aggregators_lock = threading.Lock()
+
+def aggregator(symbol='NIFTY'):
+    """The shared CandleAggregator over `symbol`'s candle_files()."""
+    with _aggregators_lock:
+        agg = _aggregators.get(symbol)
+        if agg is None:
+            agg = _aggregators[symbol] = CandleAggregator(*candle_files(symbol))
+        return agg
+
+def latest_candle(symbol='NIFTY'):
+    """The current (open) 1-minute candle, or None."""
+    return aggregator(symbol).last()
@@ -0,0 +1,218 @@
+# chainframe.py
+from functools import partial
+import numpy as np
+import pandas as pd
+from backend.analytics import pain_curve, max_pain_from_curve, compute_window_bounds_from_spot, STRIKE_STEP
+from backend.metrics import timed
+
+CE, PE = 0, 1
+
+
+class ChainFrame:
+    """
+    One snapshot's option chain pivoted once onto a sorted strike index.
+
+    Per-strike arrays have shape (n_strikes, 2) with column 0 = CE and
+    column 1 = PE, summed across whatever expiries the source holds:
+
+        oi, volume  : int64 totals
+        pv          : sum(lastPrice * volume), for VWAP
+        rows        : number of legs at the strike
+
+    IVs are kept per leg, sorted by strike (`iv_strikes`/`iv` per side), so
+    window medians match the row-level ones. `window(low, high)` is a
+    binary-search range lookup returning views, never copies.
+
+    Built from a frame, `expiry_rows` maps each 'YYYY-MM-DD' expiry to its
+    (start, stop) row range in that frame.
+    """
+
+    def __init__(self, strikes, oi, volume, pv, rows, iv_strikes, iv, spot=None, prev_close=None, parts=None):
+        self.strikes = strikes
+        self.oi = oi
+        self.volume = volume
+        self.pv = pv
+        self.rows = rows
+        self.iv_strikes = iv_strikes
+        self.iv = iv
+        self.spot = spot
+        self.prev_close = prev_close
+        self._parts = parts
+        self._by_expiry = None
+        self.expiry_rows = {}
+
+    @staticmethod
+    def layout(strike, is_pe):
+        """Strike grid and pivot indices for from_arrays; reusable while the set of legs is unchanged."""
+        strike = np.asarray(strike, dtype=float)
+        side = np.asarray(is_pe, dtype=np.intp)
+        strikes, idx = np.unique(strike, return_inverse=True)
+        orders = []
+        for s in (CE, PE):
+            m = np.flatnonzero(side == s)
+            orders.append(m[np.argsort(strike[m], kind='stable')])
+        return strikes, idx * 2 + side, orders, [strike[o] for o in orders]
+
+    @classmethod
+    def from_arrays(cls, strike, is_pe, oi, volume, price, iv, spot=None, prev_close=None, parts=None, layout=None):
+        strikes, cell, orders, iv_strikes = layout if layout is not None else cls.layout(strike, is_pe)
+        # NSE quotes prices/IV to 2 decimals; undo any float32 storage noise once here
+        price = np.round(np.asarray(price, dtype=float), 2)
+        iv = np.round(np.asarray(iv, dtype=float), 2)
+        oi = np.asarray(oi, dtype=np.int64)
+        volume = np.asarray(volume, dtype=np.int64)
+
+        n = len(strikes)
+        def pivot(w=None, dtype=float):
+            return np.bincount(cell, weights=w, minlength=2 * n).astype(dtype).reshape(n, 2)
+
+        return cls(strikes, pivot(oi, np.int64), pivot(volume, np.int64), pivot(price * volume),
+                   pivot(None, np.int64), iv_strikes, [iv[o] for o in orders], spot, prev_close, parts)
+
+    @classmethod
+    def from_df(cls, df):
+        """Build from a normalize_nse_json frame (sorted by expiry, so expiries are contiguous)."""
+        if df is None or df.empty:
+            return cls.from_arrays([], [], [], [], [], [])
+        underlying = df['underlyingPrice'].to_numpy(dtype=float)
+        exp = df['expiry']
+        codes = exp.cat.codes.to_numpy() if isinstance(exp.dtype, pd.CategoricalDtype) else pd.factorize(exp, sort=True)[0]
+        bounds = np.flatnonzero(np.diff(codes)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(df)]))
+        parts, rows = {}, {}
+        for a, b in zip(starts, ends):
+            e = exp.iloc[a]
+            if pd.isna(e): continue
+            key = pd.Timestamp(e).strftime('%Y-%m-%d')
+            parts[key] = partial(cls._from_slice, df, a, b)
+            rows[key] = (int(a), int(b))
+        chain = cls.from_arrays(
+            df['strike'].to_numpy(), (df['optionType'] == 'PE').to_numpy(),
+            df['OI'].to_numpy(), df['volume'].to_numpy(),
+            df['lastPrice'].to_numpy(), df['impliedVolatility'].to_numpy(),
+            spot=float(np.median(underlying)), prev_close=float(underlying[0]), parts=parts)
+        chain.expiry_rows = rows
+        return chain
+
+    @classmethod
+    def _from_slice(cls, df, a, b):
+        return cls.from_df(df.iloc[a:b])
+
+    @property
+    def by_expiry(self):
+        """{'YYYY-MM-DD': ChainFrame} per expiry, built on first use (`parts` maps expiry -> builder)."""
+        if self._by_expiry is None:
+            self._by_expiry = {key: build() for key, build in (self._parts or {}).items()}
+        return self._by_expiry
+
+    def window(self, low=None, high=None):
+        a = 0 if low is None else int(np.searchsorted(self.strikes, low, 'left'))
+        b = len(self.strikes) if high is None else int(np.searchsorted(self.strikes, high, 'right'))
+        iv_strikes, iv = [], []
+        for s in (CE, PE):
+            ks = self.iv_strikes[s]
+            ia = 0 if low is None else int(np.searchsorted(ks, low, 'left'))
+            ib = len(ks) if high is None else int(np.searchsorted(ks, high, 'right'))
+            iv_strikes.append(ks[ia:ib])
+            iv.append(self.iv[s][ia:ib])
+        return ChainWindow(self.strikes[a:b], self.oi[a:b], self.volume[a:b], self.pv[a:b], self.rows[a:b], iv_strikes, iv)
+
+
+class ChainWindow:
+    """Strike range of a ChainFrame; metrics mirror the analytics.compute_* functions."""
+
+    def __init__(self, strikes, oi, volume, pv, rows, iv_strikes, iv):
+        self.strikes = strikes
+        self.oi = oi
+        self.volume = volume
+        self.pv = pv
+        self.rows = rows
+        self.iv_strikes = iv_strikes
+        self.iv = iv
+
+    @property
+    def empty(self):
+        return len(self.strikes) == 0
+
+    def _kept(self):
+        # strikes where both CE and PE OI are > 0 (compute_pcr exclude_zero rule)
+        return (self.oi[:, CE] > 0) & (self.oi[:, PE] > 0)
+
+    def pcr(self, mode='OI', exclude_zero=False):
+        if self.empty: return None
+        vals = self.volume if mode == 'VOLUME' else self.oi
+        if exclude_zero:
+            vals = vals[self._kept()]
+        ce, pe = vals[:, CE].sum(), vals[:, PE].sum()
+        return float(pe / ce) if ce > 0 else None
+
+    def totals(self):
+        keep = self._kept()
+        oi, vol = self.oi[keep], self.volume[keep]
+        return {
+            "CE_OI": int(oi[:, CE].sum()),
+            "PE_OI": int(oi[:, PE].sum()),
+            "CE_vol": int(vol[:, CE].sum()),
+            "PE_vol": int(vol[:, PE].sum())
+        }
+
+    def vwap(self):
+        out = {}
+        for name, s in (('CE', CE), ('PE', PE)):
+            if self.rows[:, s].sum() == 0: continue
+            v = self.volume[:, s].sum()
+            out[name] = float(self.pv[:, s].sum() / v) if v > 0 else np.nan
+        return out
+
+    def max_pain(self):
+        if self.empty: return None
+        return max_pain_from_curve(self.strikes, pain_curve(self.strikes, self.oi[:, CE], self.oi[:, PE]))
+
+    def skew(self):
+        if self.empty or len(self.iv[CE]) == 0: return None
+        ce_iv = float(np.median(self.iv[CE]))
+        pe_iv = float(np.median(self.iv[PE])) if len(self.iv[PE]) else np.nan
+        return (pe_iv/ce_iv) if ce_iv else None
+
+
+def compute_chain_stats(chain, mode='FIXED', atm_window=3, step=STRIKE_STEP):
+    """
+    The /api/nifty/window_stats metrics for one ChainFrame (everything but avg_val).
+
+    Shared by the endpoint, the stream and the replay engine so they all
+    compute the same numbers.
+    """
+    # compute spot/atm/window bounds
+    spot = chain.spot
+    atm, low, high = compute_window_bounds_from_spot(spot, fixed=(mode == 'FIXED'), atm_window_strikes=atm_window, step=step)
+
+    # zero-copy strike range of the snapshot's ChainFrame (None bounds -> full chain)
+    window = chain.window(low, high)
+
+    # pcr_window with per-strike exclusion so it matches frontend behavior,
+    # plus the CE/PE totals behind it (for verification/debug)
+    pcr_window = window.pcr('OI', exclude_zero=True)
+    pcr_window_details = window.totals()
+
+    # overall PCR as before (legacy/global-sum)
+    pcr_overall = chain.window().pcr('OI')
+
+    # VWAP, Max Pain, Skew & Prev Close
+    vwap = window.vwap()
+    with timed('expiry_pivot'):
+        parts = chain.by_expiry
+    with timed('max_pain'):
+        mp = window.max_pain()
+        mp_by_expiry = {}
+        for exp, part in parts.items():
+            w = part.window(low, high)
+            if not w.empty:
+                mp_by_expiry[exp] = w.max_pain()
+    skew = window.skew()
+
+    return {
+        'atm': atm, 'low': low, 'high': high,
+        'pcr_window': pcr_window, 'pcr_window_details': pcr_window_details, 'pcr_overall': pcr_overall,
+        'vwap': vwap, 'max_pain': mp, 'max_pain_by_expiry': mp_by_expiry, 'skew': skew, 'prev_close': chain.prev_close,
+    }
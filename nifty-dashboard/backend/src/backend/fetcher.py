@@ -1,54 +1,127 @@
 # fetcher.py
-import requests, time
+import operator, os
+import numpy as np
 import pandas as pd
+from backend.nse_client import get_client
+from backend.metrics import timed_fn
 
-NSE_OPTC_URL = "https://www.nseindia.com/api/option-chain-indices?symbol=NIFTY"
-HEADERS = {
-    "User-Agent": "Mozilla/5.0",
-    "Accept": "application/json, text/plain, */*",
-    "Referer": "https://www.nseindia.com/option-chain"
+# paths relative to NSEClient.base_url
+NSE_OPTC_URL = "/api/option-chain-indices?symbol={symbol}"
+NSE_INDEX_URL = "/api/NextApi/apiClient?functionName=getIndexData"
+NSE_MARKET_URL = "/api/NextApi/apiClient?functionName=getMarketStatistics"
+
+# underlyings ingested side by side; the first is the default for every endpoint
+SYMBOLS = tuple(s.strip().upper() for s in os.environ.get("NSE_SYMBOLS", "NIFTY,BANKNIFTY,FINNIFTY,MIDCPNIFTY").split(",")
+                if s.strip())
+# getIndexData `indexName` of each underlying
+INDEX_NAMES = {
+    'NIFTY': "NIFTY 50",
+    'BANKNIFTY': "NIFTY BANK",
+    'FINNIFTY': "NIFTY FINANCIAL SERVICES",
+    'MIDCPNIFTY': "NIFTY MIDCAP SELECT",
 }
 
-def fetch_nse_json(session=None, retries=3, pause=0.5):
-    s = session or requests.Session()
-    last = None
-    for i in range(retries):
-        try:
-            s.get("https://www.nseindia.com", headers=HEADERS, timeout=5)
-            r = s.get(NSE_OPTC_URL, headers=HEADERS, timeout=6)
-            r.raise_for_status()
-            return r.json()
-        except Exception as e:
-            last = e
-            time.sleep(pause*(i+1))
-    raise RuntimeError(f"Failed to fetch NSE option chain: {last}")
+def fetch_nse_json(client=None, symbol='NIFTY'):
+    return (client or get_client()).get_json(NSE_OPTC_URL.format(symbol=symbol))
+
+@timed_fn('fetch_bundle')
+def fetch_nse_bundle(client=None, symbol='NIFTY', extras=True):
+    """
+    Option chain for `symbol` plus (with `extras`) index data and market
+    statistics, fetched concurrently.
+
+    Returns {'optionchain': json, 'index': json or None, 'market': json or None};
+    only a failed option-chain fetch raises.
+    """
+    urls = {'optionchain': NSE_OPTC_URL.format(symbol=symbol)}
+    if extras:
+        urls.update(index=NSE_INDEX_URL, market=NSE_MARKET_URL)
+    res = (client or get_client()).fetch_many(urls)
+    if isinstance(res['optionchain'], Exception):
+        raise res['optionchain']
+    return {k: (None if isinstance(v, Exception) else v) for k, v in res.items()}
 
+# (column, NSE key, dtype) for the numeric leg fields, in output column order.
+# Counts fit int32; prices and IVs are quoted to 2 decimals, well inside
+# float32 precision (chain_records rounds them back when serializing).
+LEG_FIELDS = (
+    ('OI', 'openInterest', np.int32),
+    ('OI_change', 'changeinOpenInterest', np.int32),
+    ('volume', 'totalTradedVolume', np.int32),
+    ('lastPrice', 'lastPrice', np.float32),
+    ('LTP_change', 'change', np.float32),
+    ('impliedVolatility', 'impliedVolatility', np.float32),
+    ('bidQty', 'bidQty', np.int32),
+    ('bidPrice', 'bidprice', np.float32),
+    ('askQty', 'askQty', np.int32),
+    ('askPrice', 'askPrice', np.float32),
+    ('underlyingPrice', 'underlyingValue', np.float64),
+)
+_LEG_KEYS = tuple(k for _, k, _ in LEG_FIELDS)
+OPTION_TYPES = ('CE', 'PE')
+
+@timed_fn('normalize')
 def normalize_nse_json(j):
-    rows = []
-    underlying = j.get('records', {}).get('underlyingValue', None)
+    """
+    Flatten the NSE option-chain payload into one row per (expiry, strike, leg).
+
+    Numeric leg fields are collected in a single pass into one flat buffer and
+    cast to compact dtypes; each distinct expiry string is parsed once.
+    `optionType` and `expiry` are categoricals. Rows come back sorted by
+    (expiry, strike, optionType) on a fresh RangeIndex, so expiries and
+    strike ranges are contiguous slices.
+    """
     data = j.get('records', {}).get('data', [])
+    keys = _LEG_KEYS
+    pick = operator.itemgetter(*keys)
+    strikes, codes, vals = [], [], []
+    exp_index = {}
     for d in data:
-        strike = float(d.get('strikePrice', 0))
-        expiry = d.get('expiryDate')
-        for t in ('CE', 'PE'):
-            if t in d:
-                o = d[t]
-                rows.append({
-                    'expiry': expiry,
-                    'strike': strike,
-                    'optionType': t,
-                    'OI': int(o.get('openInterest') or 0),
-                    'OI_change': int(o.get('changeinOpenInterest') or 0),
-                    'volume': int(o.get('totalTradedVolume') or 0),
-                    'lastPrice': float(o.get('lastPrice') or 0.0),
-                    "LTP_change": float(o.get('change') or 0.0), 
-                    'impliedVolatility': float(o.get('impliedVolatility') or 0.0),
-                    'bidQty': int(o.get('bidQty') or 0),
-                    'bidPrice': float(o.get('bidprice') or 0.0),
-                    'askQty': int(o.get('askQty') or 0),
-                    'askPrice': float(o.get('askPrice') or 0.0),
-                    'underlyingPrice': float(o.get('underlyingValue') or 0.0)
-                })
-    df = pd.DataFrame(rows)
-    df['expiry'] = pd.to_datetime(df['expiry'], dayfirst=True, errors='coerce')
-    return df
+        strike = d.get('strikePrice', 0)
+        e = exp_index.setdefault(d.get('expiryDate'), len(exp_index)) << 1
+        for code, t in ((0, 'CE'), (1, 'PE')):
+            o = d.get(t)
+            if o is None: continue
+            strikes.append(strike)
+            codes.append(e | code)
+            try:
+                vals.extend(pick(o))
+            except KeyError:
+                vals.extend(map(o.get, keys))
+
+    n = len(strikes)
+    # missing/null fields arrive as None -> NaN -> 0, like the `or 0` defaults before
+    buf = np.nan_to_num(np.array(vals, dtype=np.float64).reshape(n, len(keys)), copy=False)
+    codes = np.array(codes, dtype=np.intp)
+    strike = np.array(strikes, dtype=np.float64)
+    leg = (codes & 1).astype(np.int8)
+    parsed = pd.DatetimeIndex(pd.to_datetime(pd.Series(list(exp_index), dtype=object), dayfirst=True, errors='coerce'))
+    expiry = pd.Categorical(parsed.take(codes >> 1))
+
+    order = np.lexsort((leg, strike, expiry.codes))
+    cols = {
+        'expiry': expiry.take(order) if n else expiry,
+        'strike': strike[order],
+        'optionType': pd.Categorical.from_codes(leg[order], categories=list(OPTION_TYPES)),
+    }
+    for i, (name, _, dtype) in enumerate(LEG_FIELDS):
+        cols[name] = buf[order, i].astype(dtype)
+    return pd.DataFrame(cols)
+
+@timed_fn('chain_records')
+def chain_records(df):
+    """df.to_dict(orient='records') with float32 columns rounded back to their quoted 2 decimals."""
+    f32 = [c for c in df.columns if df[c].dtype == np.float32]
+    if f32:
+        df = df.astype({c: np.float64 for c in f32}).round({c: 2 for c in f32})
+    return df.to_dict(orient='records')
+
+def chain_columns(df):
+    """Column-wise chain_records: {column: [values]} with the same value rounding."""
+    out = {}
+    for c in df.columns:
+        col = df[c]
+        if col.dtype == np.float32:
+            col = col.astype(np.float64).round(2)
+        out[c] = col.tolist()
+    return out
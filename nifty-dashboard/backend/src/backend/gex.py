@@ -0,0 +1,158 @@
+# gex.py
+"""
+Dealer gamma exposure (GEX) of an option chain, by strike and over a grid
+of hypothetical spot levels.
+
+Dealers are assumed long the calls and short the puts that are open, so call
+OI adds gamma and put OI subtracts it. Exposure is the rupee change in
+dealer delta for a 1% move in the underlying, in crore:
+
+    GEX = sign * gamma(S) * OI * lot size * S^2 * 0.01 / 1e7
+
+Each leg keeps its own IV (NSE's, or one solved from the mid price where NSE
+reports zero, greeks.fill_iv) along the grid. The legs x grid gamma matrix is one broadcast
+bs_gamma_batch call, made once per snapshot version when the snapshot
+arrives; requests only slice and sum the cached arrays.
+"""
+import threading
+import numpy as np
+import pandas as pd
+from backend.greeks import bs_gamma_batch, fill_iv, valuation_time, years_to_expiry, RISK_FREE_RATE
+from backend import metrics
+
+# spot grid: +-GRID_PCT around spot in GRID_POINTS steps (0.25% apart by default)
+GRID_PCT = 0.10
+GRID_POINTS = 81
+CRORE = 1e7
+
+
+def zero_gamma(grid, profile, spot):
+    """Spot level where the net GEX profile changes sign, nearest `spot` (linear between grid points); None if it never does."""
+    s = np.sign(profile)
+    i = np.flatnonzero(s[:-1] * s[1:] < 0)
+    if not len(i):
+        return None
+    x0, x1, y0, y1 = grid[i], grid[i + 1], profile[i], profile[i + 1]
+    levels = x0 - y0 * (x1 - x0) / (y1 - y0)
+    return float(levels[np.argmin(np.abs(levels - spot))])
+
+
+class GexProfile:
+    """
+    Per-leg exposure at spot and per-expiry exposure over the spot grid for
+    one snapshot. Legs without OI, IV or time left are dropped.
+    """
+
+    def __init__(self, expiries, grid, by_expiry, legs, spot=None, lot=1, now=None):
+        self.expiries = expiries
+        self.grid = grid
+        self.by_expiry = by_expiry
+        self.legs = legs
+        self.spot = spot
+        self.lot = lot
+        self.now = now
+
+    @classmethod
+    def compute(cls, df, now=None, lot=1, r=RISK_FREE_RATE, grid_pct=GRID_PCT, points=GRID_POINTS):
+        """
+        Exposure of a normalize_nse_json frame; `now` is the valuation time
+        in IST (default: current time).
+        """
+        now = valuation_time() if now is None else pd.Timestamp(now)
+        if df is None or df.empty:
+            empty = np.empty(0)
+            legs = {'expiry': np.empty(0, dtype=int), 'strike': empty, 'call': np.empty(0, dtype=bool), 'gex': empty}
+            return cls([], empty, np.empty((0, 0)), legs, None, lot, now)
+
+        spot = float(np.median(df['underlyingPrice'].to_numpy(dtype=float)))
+        K = df['strike'].to_numpy(dtype=float)
+        call = (df['optionType'] == 'CE').to_numpy()
+        oi = df['OI'].to_numpy(dtype=float)
+        t = years_to_expiry(df['expiry'], now)
+        use = (oi > 0) & (t > 0)
+
+        iv = fill_iv(df, spot, t, r, where=use)
+        use &= np.isfinite(iv) & (iv > 0)
+
+        codes, uniques = pd.factorize(df['expiry'][use], sort=True)
+        expiries = [pd.Timestamp(e).strftime('%Y-%m-%d') for e in uniques]
+        K, call, t, sigma = K[use], call[use], t[use], iv[use] / 100.0
+        weight = np.where(call, 1.0, -1.0) * oi[use] * lot * 0.01 / CRORE
+
+        grid = spot * np.linspace(1 - grid_pct, 1 + grid_pct, points)
+        exposure = weight[:, None] * bs_gamma_batch(grid[None, :], K[:, None], r, sigma[:, None], t[:, None]) * grid ** 2
+        # legs -> expiries as one matrix product instead of a per-expiry loop
+        onehot = (codes[None, :] == np.arange(len(expiries))[:, None]).astype(float)
+        by_expiry = onehot @ exposure
+
+        at_spot = weight * bs_gamma_batch(spot, K, r, sigma, t) * spot ** 2
+        legs = {'expiry': codes, 'strike': K, 'call': call, 'gex': at_spot}
+        return cls(expiries, grid, by_expiry, legs, spot, lot, now)
+
+    def to_dict(self, expiry=None):
+        """JSON-able exposure for all expiries, or only `expiry` ('YYYY-MM-DD')."""
+        legs = self.legs
+        if expiry is None:
+            m = np.ones(len(legs['strike']), dtype=bool)
+            profile = self.by_expiry.sum(axis=0) if len(self.expiries) else np.zeros(len(self.grid))
+        elif expiry in self.expiries:
+            j = self.expiries.index(expiry)
+            m = legs['expiry'] == j
+            profile = self.by_expiry[j]
+        else:
+            m = np.zeros(len(legs['strike']), dtype=bool)
+            profile = np.zeros(len(self.grid))
+
+        strikes, inv = np.unique(legs['strike'][m], return_inverse=True)
+        gex, call = legs['gex'][m], legs['call'][m]
+        calls = np.bincount(inv, weights=np.where(call, gex, 0.0), minlength=len(strikes))
+        puts = np.bincount(inv, weights=np.where(call, 0.0, gex), minlength=len(strikes))
+        return {
+            'spot': self.spot,
+            'lot_size': self.lot,
+            'valuation_time': self.now.isoformat(),
+            'expiry': expiry,
+            'unit': 'crore_per_1pct',
+            'total': round(float(gex.sum()), 4),
+            'zero_gamma': zero_gamma(self.grid, profile, self.spot) if len(self.grid) else None,
+            'by_strike': {
+                'strikes': strikes.tolist(),
+                'call': np.round(calls, 4).tolist(),
+                'put': np.round(puts, 4).tolist(),
+                'net': np.round(calls + puts, 4).tolist(),
+            },
+            'profile': {'spot': np.round(self.grid, 2).tolist(), 'gex': np.round(profile, 4).tolist()},
+        }
+
+
+class GexCache:
+    """
+    The GexProfile of the latest snapshot version. Subscribed to the
+    snapshot service so each version is computed as it arrives; get()
+    computes it only if a request gets there first.
+    """
+
+    def __init__(self, lot=1, r=RISK_FREE_RATE):
+        self.lot = lot
+        self.r = r
+        self._lock = threading.Lock()
+        self._version = None
+        self._profile = None
+
+    def _compute(self, snap):
+        with metrics.timed('gex_profile'):
+            self._profile = GexProfile.compute(snap['df'], valuation_time(snap), self.lot, self.r)
+        self._version = snap['version']
+
+    def publish(self, snap):
+        with self._lock:
+            if self._version != snap['version']:
+                self._compute(snap)
+
+    def get(self, snap):
+        with self._lock:
+            hit = self._version == snap['version']
+            metrics.cache('gex', hit)
+            if not hit:
+                self._compute(snap)
+            return self._profile
@@ -1,5 +1,8 @@
 # greeks.py
 import math
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
 from scipy.stats import norm
 
 def bs_price(S, K, r, sigma, t, option_type='call', q=0.0):
@@ -40,3 +43,212 @@ def bs_theta(S,K,r,sigma,t,option_type='call',q=0.0):
         term2 = - q * S * math.exp(-q*t) * norm.cdf(-d1)
         term3 = r * K * math.exp(-r*t) * norm.cdf(-d2)
         return (term1 + term2 + term3) / 365.0
+
+
+# ---- vectorized versions (whole chain in one pass) ----
+RISK_FREE_RATE = 0.065
+# NSE index options settle at the 15:30 IST close on the expiry date
+EXPIRY_CUTOFF = pd.Timedelta(hours=15, minutes=30)
+IST_OFFSET = pd.Timedelta(minutes=330)
+
+def _is_call(option_type):
+    ot = np.asarray(option_type)
+    if ot.dtype == bool:
+        return ot
+    return (ot == 'call') | (ot == 'CE')
+
+def npdf(x):
+    """Standard normal density, elementwise."""
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+def _prep(S, K, r, sigma, t, q):
+    S, K, r, sigma, t, q = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (S, K, r, sigma, t, q)))
+    live = (t > 0) & (sigma > 0)
+    # dummy values keep the dead entries finite; they are masked out afterwards
+    ts = np.where(live, t, 1.0)
+    vs = np.where(live, sigma, 1.0)
+    sqrt_t = np.sqrt(ts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1 = (np.log(S / K) + (r - q + 0.5 * vs ** 2) * ts) / (vs * sqrt_t)
+    d2 = d1 - vs * sqrt_t
+    return S, K, r, q, ts, vs, sqrt_t, d1, d2, live
+
+def bs_price_batch(S, K, r, sigma, t, option_type='call', q=0.0):
+    """Array version of bs_price; intrinsic value where t<=0 or sigma<=0."""
+    call = _is_call(option_type)
+    S, K, r, q, ts, vs, sqrt_t, d1, d2, live = _prep(S, K, r, sigma, t, q)
+    df_q = np.exp(-q * ts)
+    df_r = np.exp(-r * ts)
+    price = np.where(call, S * df_q * ndtr(d1) - K * df_r * ndtr(d2),
+                     K * df_r * ndtr(-d2) - S * df_q * ndtr(-d1))
+    intrinsic = np.where(call, np.maximum(0, S - K), np.maximum(0, K - S))
+    return np.where(live, price, intrinsic)
+
+def bs_gamma_batch(S, K, r, sigma, t, q=0.0):
+    """Array version of bs_gamma (zero where t<=0 or sigma<=0); inputs broadcast, e.g. legs x spot grid."""
+    S, K, r, q, ts, vs, sqrt_t, d1, d2, live = _prep(S, K, r, sigma, t, q)
+    return np.where(live, np.exp(-q * ts) * npdf(d1) / (S * vs * sqrt_t), 0.0)
+
+def bs_greeks_batch(S, K, r, sigma, t, option_type='call', q=0.0):
+    """
+    Price and greeks for arrays of options, sharing d1/d2 across all of them.
+
+    Returns a dict of arrays: price, delta, gamma, theta (per calendar day,
+    as bs_theta), vega and rho (per 1 percentage point of vol / rate).
+    Expired or zero-vol entries follow the scalar functions: intrinsic price,
+    0/1 delta and zero for the other greeks.
+    """
+    call = _is_call(option_type)
+    S, K, r, q, ts, vs, sqrt_t, d1, d2, live = _prep(S, K, r, sigma, t, q)
+    df_q = np.exp(-q * ts)
+    df_r = np.exp(-r * ts)
+    n1, n2 = ndtr(d1), ndtr(d2)
+    pdf1 = npdf(d1)
+
+    price = np.where(call, S * df_q * n1 - K * df_r * n2, K * df_r * (1 - n2) - S * df_q * (1 - n1))
+    delta = np.where(call, df_q * n1, df_q * (n1 - 1))
+    gamma = df_q * pdf1 / (S * vs * sqrt_t)
+    term1 = -(S * vs * df_q * pdf1) / (2 * sqrt_t)
+    theta = np.where(call, term1 + q * S * df_q * n1 - r * K * df_r * n2,
+                     term1 - q * S * df_q * (1 - n1) + r * K * df_r * (1 - n2)) / 365.0
+    vega = S * df_q * pdf1 * sqrt_t / 100.0
+    rho = np.where(call, K * ts * df_r * n2, -K * ts * df_r * (1 - n2)) / 100.0
+
+    zero = np.zeros_like(price)
+    return {
+        'price': np.where(live, price, np.where(call, np.maximum(0, S - K), np.maximum(0, K - S))),
+        'delta': np.where(live, delta, np.where(call & (S > K), 1.0, 0.0)),
+        'gamma': np.where(live, gamma, zero),
+        'theta': np.where(live, theta, zero),
+        'vega': np.where(live, vega, zero),
+        'rho': np.where(live, rho, zero),
+    }
+
+def implied_vol_batch(price, S, K, r, t, option_type='call', q=0.0, tol=1e-6, max_iter=60, lo=1e-4, hi=5.0):
+    """
+    Implied volatility (decimal) for arrays of option prices.
+
+    Newton steps on vega, kept inside a shrinking [lo, hi] bracket and
+    replaced by bisection whenever a step leaves it or vega vanishes, so
+    every entry converges. NaN where the price is outside the no-arbitrage
+    bounds, t<=0, or the price is not positive.
+    """
+    call = _is_call(option_type)
+    price, S, K, r, t, q = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (price, S, K, r, t, q)))
+    call = np.broadcast_to(call, price.shape)
+    ts = np.where(t > 0, t, 1.0)
+    fwd_s = S * np.exp(-q * ts)
+    pv_k = K * np.exp(-r * ts)
+    lower = np.where(call, np.maximum(0, fwd_s - pv_k), np.maximum(0, pv_k - fwd_s))
+    upper = np.where(call, fwd_s, pv_k)
+    ok = (t > 0) & (price > 0) & (price > lower) & (price < upper)
+
+    a = np.full(price.shape, lo)
+    b = np.full(price.shape, hi)
+    # Brenner-Subrahmanyam starting point
+    sigma = np.clip(np.sqrt(2 * np.pi / ts) * price / S, lo, hi)
+    active = ok.copy()
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        g = bs_greeks_batch(S[active], K[active], r[active], sigma[active], ts[active], call[active], q[active])
+        diff = g['price'] - price[active]
+        done = np.abs(diff) < tol
+        s, lo_a, hi_a = sigma[active], a[active], b[active]
+        # price is increasing in sigma: tighten the bracket around the root
+        hi_a = np.where(diff > 0, s, hi_a)
+        lo_a = np.where(diff < 0, s, lo_a)
+        vega = g['vega'] * 100.0
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            step = s - diff / vega
+        bad = ~np.isfinite(step) | (step <= lo_a) | (step >= hi_a)
+        step = np.where(bad, 0.5 * (lo_a + hi_a), step)
+        a[active], b[active] = lo_a, hi_a
+        sigma[active] = np.where(done, s, step)
+        idx = np.flatnonzero(active)
+        active[idx[done | (hi_a - lo_a < tol)]] = False
+    return np.where(ok, sigma, np.nan)
+
+def valuation_time(snap=None):
+    """
+    Naive IST wall time to value options at: the snapshot's time, or now
+    when `snap` is None. Expiry dates are compared against it.
+    """
+    if snap is None:
+        return pd.Timestamp.now(tz='Asia/Kolkata').tz_localize(None)
+    # snapshot ts is UTC; expiries settle on IST wall time
+    return pd.Timestamp(snap['ts']) + IST_OFFSET
+
+def years_to_expiry(expiry, now=None):
+    """Years from `now` (IST, default valuation_time()) to the 15:30 IST settlement of each `expiry` date."""
+    now = valuation_time() if now is None else pd.Timestamp(now)
+    exp = pd.to_datetime(pd.Series(expiry)).to_numpy(dtype='datetime64[ns]') + EXPIRY_CUTOFF.to_timedelta64()
+    secs = (exp - now.to_datetime64()) / np.timedelta64(1, 's')
+    return np.asarray(secs, dtype=float) / (365.0 * 24 * 3600)
+
+def market_price(df, price='mid'):
+    """Per-row option price of a chain frame: the bid/ask mid ('mid', lastPrice when either side is missing) or lastPrice ('last')."""
+    last = df['lastPrice'].to_numpy(dtype=float)
+    if price != 'mid':
+        return last
+    bid = df['bidPrice'].to_numpy(dtype=float)
+    ask = df['askPrice'].to_numpy(dtype=float)
+    return np.where((bid > 0) & (ask > 0), 0.5 * (bid + ask), last)
+
+def fill_iv(df, spot, t, r=RISK_FREE_RATE, where=None):
+    """
+    NSE's impliedVolatility (percent) per row of `df`, with the rows NSE
+    quotes at zero IV solved from their market_price against `spot` and
+    `t` (years, per row). Only rows in the `where` mask (default all) are
+    solved; NaN where no IV solves.
+    """
+    iv = df['impliedVolatility'].to_numpy(dtype=float)
+    solve = ~(iv > 0) if where is None else where & ~(iv > 0)
+    if solve.any():
+        call = (df['optionType'] == 'CE').to_numpy()
+        K = df['strike'].to_numpy(dtype=float)
+        iv = iv.copy()
+        iv[solve] = implied_vol_batch(market_price(df[solve]), spot, K[solve], r, t[solve], call[solve]) * 100.0
+    return iv
+
+def chain_greeks(df, r=RISK_FREE_RATE, q=0.0, now=None, price='mid'):
+    """
+    Greeks for every row of a normalize_nse_json frame in one vectorized pass.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Normalized chain ('strike', 'optionType', 'expiry', 'underlyingPrice',
+        'impliedVolatility', 'lastPrice', 'bidPrice', 'askPrice').
+    r, q : float
+        Risk-free rate and dividend yield (decimal).
+    now : datetime-like or None
+        Valuation time in IST; defaults to the current time.
+    price : str
+        'mid' solves IV from the bid/ask mid (falling back to lastPrice when
+        either side is missing), 'last' from lastPrice.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Aligned with df.index: 't' (years), 'iv_solved' (percent, NaN when
+        unsolvable), 'iv' (NSE's impliedVolatility, or iv_solved where NSE
+        reports zero), 'delta', 'gamma', 'theta', 'vega', 'rho'.
+    """
+    cols = ['t', 'iv_solved', 'iv', 'delta', 'gamma', 'theta', 'vega', 'rho']
+    if df is None or df.empty:
+        return pd.DataFrame(columns=cols)
+    S = df['underlyingPrice'].to_numpy(dtype=float)
+    K = df['strike'].to_numpy(dtype=float)
+    call = (df['optionType'] == 'CE').to_numpy()
+    t = years_to_expiry(df['expiry'], now)
+
+    # every row is solved for iv_solved; 'iv' then fills NSE's zeros as fill_iv does
+    solved = implied_vol_batch(market_price(df, price), S, K, r, t, call, q) * 100.0
+    nse_iv = df['impliedVolatility'].to_numpy(dtype=float)
+    iv = np.where(nse_iv > 0, nse_iv, solved)
+    g = bs_greeks_batch(S, K, r, np.nan_to_num(iv) / 100.0, t, call, q)
+    return pd.DataFrame({
+        't': t, 'iv_solved': solved, 'iv': iv,
+        'delta': g['delta'], 'gamma': g['gamma'], 'theta': g['theta'], 'vega': g['vega'], 'rho': g['rho'],
+    }, index=df.index)
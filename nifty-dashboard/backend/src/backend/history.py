@@ -0,0 +1,237 @@
+# history.py
+import logging, os, threading
+import numpy as np
+import pandas as pd
+from backend import metrics
+
+log = logging.getLogger(__name__)
+
+HISTORY_DIR = os.environ.get("NSE_HISTORY_DIR", "data/history")
+# a full copy of the chain is written every this many snapshots, deltas in between
+KEYFRAME_EVERY = 100
+# trading days are IST calendar days
+IST_OFFSET = np.timedelta64(330, 'm')
+
+# one option leg; `expiry` is days since 1970-01-01, `leg` 0 = CE / 1 = PE
+ROW_DTYPE = np.dtype([
+    ('expiry', '<i4'), ('strike', '<f4'), ('leg', 'i1'),
+    ('OI', '<i4'), ('OI_change', '<i4'), ('volume', '<i4'),
+    ('lastPrice', '<f4'), ('LTP_change', '<f4'), ('impliedVolatility', '<f4'),
+    ('bidQty', '<i4'), ('bidPrice', '<f4'), ('askQty', '<i4'), ('askPrice', '<f4'),
+])
+# one snapshot; rows[offset:offset+count] of rows.bin belong to it
+INDEX_DTYPE = np.dtype([
+    ('ts', '<i8'), ('offset', '<i8'), ('count', '<i4'), ('keyframe', 'i1'), ('underlying', '<f8'),
+])
+KEY_FIELDS = ('expiry', 'strike', 'leg')
+VALUE_FIELDS = ROW_DTYPE.names[3:]
+
+
+def _to_rows(df):
+    # `df` must not hold NaT expiries: they would encode as a bogus day number
+    rows = np.empty(len(df), dtype=ROW_DTYPE)
+    rows['expiry'] = df['expiry'].astype('datetime64[ns]').to_numpy().astype('datetime64[D]').astype(np.int64)
+    rows['strike'] = df['strike'].to_numpy()
+    rows['leg'] = (df['optionType'] == 'PE').to_numpy()
+    for f in VALUE_FIELDS:
+        rows[f] = df[f].to_numpy()
+    return rows
+
+def _row_keys(rows):
+    # (expiry, strike, leg) packed into one sortable int64
+    strike = np.round(rows['strike'].astype(np.float64) * 100).astype(np.int64)
+    return (rows['expiry'].astype(np.int64) << 33) | (strike << 1) | rows['leg'].astype(np.int64)
+
+def _to_frame(rows, ts=None):
+    out = {}
+    if ts is not None:
+        out['ts'] = pd.to_datetime(ts, unit='ns')
+    out['expiry'] = rows['expiry'].astype('datetime64[D]').astype('datetime64[ns]')
+    out['strike'] = rows['strike'].astype(np.float64)
+    out['optionType'] = pd.Categorical.from_codes(rows['leg'].astype(np.int8), categories=['CE', 'PE'])
+    for f in VALUE_FIELDS:
+        out[f] = rows[f]
+    return pd.DataFrame(out)
+
+
+def history_root(symbol, root=HISTORY_DIR):
+    """Recording directory for `symbol`: NIFTY keeps `root` itself, other underlyings get `root/<symbol>`."""
+    return root if symbol == 'NIFTY' else os.path.join(root, symbol)
+
+
+class HistoryStore:
+    """
+    Append-only on-disk history of full normalized option chains.
+
+    One directory per IST trading day holds two fixed-dtype binary files:
+
+        rows.bin   ROW_DTYPE records
+        index.bin  INDEX_DTYPE record per snapshot (UTC ns timestamp, row
+                   offset/count, keyframe flag, underlying)
+
+    Every KEYFRAME_EVERY-th snapshot (and any whose strike/expiry layout
+    changed) is written in full; the others store only the legs whose
+    values changed since the previous snapshot. Reads memory-map rows.bin
+    and touch only the row range covering the requested time span.
+    """
+
+    def __init__(self, root=HISTORY_DIR, keyframe_every=KEYFRAME_EVERY):
+        self.root = root
+        self.keyframe_every = keyframe_every
+        self._lock = threading.Lock()
+        self._day = None
+        self._prev = None
+        self._since_key = 0
+        self._offset = 0
+
+    def _paths(self, day):
+        d = os.path.join(self.root, day)
+        return os.path.join(d, 'rows.bin'), os.path.join(d, 'index.bin')
+
+    @staticmethod
+    def day_of(ts):
+        return str((np.datetime64(ts, 'ns') + IST_OFFSET).astype('datetime64[D]'))
+
+    def append(self, ts, df):
+        """Record the chain `df` (a normalize_nse_json frame) observed at UTC `ts`."""
+        if df is None or df.empty:
+            return
+        missing = df['expiry'].isna().to_numpy()
+        if missing.any():
+            metrics.error('history_expiry')
+            log.warning("dropping %d legs without a parseable expiry from the history at %s", int(missing.sum()), ts)
+            df = df[~missing]
+            if df.empty:
+                return
+        rows = _to_rows(df)
+        t = np.datetime64(ts, 'ns')
+        day = self.day_of(t)
+        with self._lock:
+            rows_path, index_path = self._paths(day)
+            if day != self._day:
+                os.makedirs(os.path.dirname(rows_path), exist_ok=True)
+                # a fresh process starts each day file (even an existing one) with a keyframe
+                self._day, self._prev, self._since_key = day, None, 0
+                self._offset = os.path.getsize(rows_path) // ROW_DTYPE.itemsize if os.path.exists(rows_path) else 0
+            prev = self._prev
+            keyframe = (prev is None or self._since_key >= self.keyframe_every or len(prev) != len(rows)
+                        or any(not np.array_equal(prev[k], rows[k]) for k in KEY_FIELDS))
+            if keyframe:
+                out = rows
+                self._since_key = 0
+            else:
+                changed = np.zeros(len(rows), dtype=bool)
+                for f in VALUE_FIELDS:
+                    changed |= prev[f] != rows[f]
+                out = rows[changed]
+            self._since_key += 1
+
+            entry = np.zeros(1, dtype=INDEX_DTYPE)
+            entry['ts'] = t.astype(np.int64)
+            entry['offset'] = self._offset
+            entry['count'] = len(out)
+            entry['keyframe'] = keyframe
+            entry['underlying'] = float(df['underlyingPrice'].iloc[0])
+            # rows first: an index entry is only written once its rows are on disk
+            with open(rows_path, 'ab') as f:
+                f.write(out.tobytes())
+            with open(index_path, 'ab') as f:
+                f.write(entry.tobytes())
+            self._offset += len(out)
+            self._prev = rows
+
+    # ---- reads ----
+
+    def days(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(d for d in os.listdir(self.root) if os.path.exists(self._paths(d)[1]))
+
+    def index(self, day):
+        path = self._paths(day)[1]
+        if not os.path.exists(path):
+            return np.empty(0, dtype=INDEX_DTYPE)
+        # whole entries only: another process may be appending to the file
+        return np.fromfile(path, dtype=INDEX_DTYPE, count=os.path.getsize(path) // INDEX_DTYPE.itemsize)
+
+    def _rows(self, day):
+        path = self._paths(day)[0]
+        n = os.path.getsize(path) // ROW_DTYPE.itemsize if os.path.exists(path) else 0
+        if n == 0:
+            return np.empty(0, dtype=ROW_DTYPE)
+        return np.memmap(path, dtype=ROW_DTYPE, mode='r', shape=(n,))
+
+    def _span(self, idx, a, b):
+        # row range [lo, hi) covering snapshots a..b-1
+        if b <= a:
+            return 0, 0
+        return int(idx['offset'][a]), int(idx['offset'][b - 1] + idx['count'][b - 1])
+
+    @staticmethod
+    def _mask(rows, expiry=None, strike_min=None, strike_max=None):
+        m = np.ones(len(rows), dtype=bool)
+        if expiry is not None:
+            m &= rows['expiry'] == np.datetime64(pd.Timestamp(expiry).date(), 'D').astype(np.int64)
+        if strike_min is not None:
+            m &= rows['strike'] >= strike_min
+        if strike_max is not None:
+            m &= rows['strike'] <= strike_max
+        return m
+
+    def read(self, day, start=None, end=None, expiry=None, strike_min=None, strike_max=None):
+        """
+        Stored leg records with snapshot time `ts` in [start, end] (UTC).
+
+        Keyframes contribute every leg and delta snapshots only the legs that
+        changed, so each record holds a leg's values from `ts` until its next
+        record; group by (expiry, strike, optionType) and forward-fill for a
+        per-leg time series.
+        """
+        idx = self.index(day)
+        ts = idx['ts']
+        a = 0 if start is None else int(np.searchsorted(ts, np.datetime64(start, 'ns').astype(np.int64), 'left'))
+        b = len(idx) if end is None else int(np.searchsorted(ts, np.datetime64(end, 'ns').astype(np.int64), 'right'))
+        lo, hi = self._span(idx, a, b)
+        rows = self._rows(day)[lo:hi]
+        row_ts = np.repeat(ts[a:b], idx['count'][a:b])
+        m = self._mask(rows, expiry, strike_min, strike_max)
+        return _to_frame(np.asarray(rows[m]), row_ts[m])
+
+    def iter_snapshots(self, day):
+        """
+        Yield (ts_ns, underlying, rows) for every snapshot of `day` in order,
+        `rows` being the full chain (ROW_DTYPE, sorted by expiry/strike/leg).
+
+        Deltas are applied to one working array in place, so `rows` is only
+        valid until the next iteration; copy it to keep it.
+        """
+        idx = self.index(day)
+        data = self._rows(day)
+        rows = keys = None
+        for i in range(len(idx)):
+            lo, hi = self._span(idx, i, i + 1)
+            chunk = np.asarray(data[lo:hi])
+            if idx['keyframe'][i] or rows is None:
+                rows = chunk.copy()
+                keys = _row_keys(rows)
+            elif len(chunk):
+                rows[np.searchsorted(keys, _row_keys(chunk))] = chunk
+            yield int(idx['ts'][i]), float(idx['underlying'][i]), rows
+
+    def snapshot_at(self, day, at=None, expiry=None, strike_min=None, strike_max=None):
+        """Full chain as of the last snapshot at or before `at` (default: the latest)."""
+        idx = self.index(day)
+        ts = idx['ts']
+        b = len(idx) if at is None else int(np.searchsorted(ts, np.datetime64(at, 'ns').astype(np.int64), 'right'))
+        if b == 0:
+            return _to_frame(np.empty(0, dtype=ROW_DTYPE))
+        keys = np.flatnonzero(idx['keyframe'][:b])
+        a = int(keys[-1]) if len(keys) else 0
+        lo, hi = self._span(idx, a, b)
+        rows = self._rows(day)[lo:hi]
+        rows = np.asarray(rows[self._mask(rows, expiry, strike_min, strike_max)])
+        # keep the latest record per leg: unique over the reversed run finds last occurrences
+        key = np.stack([rows['expiry'].astype(np.float64), rows['strike'].astype(np.float64), rows['leg'].astype(np.float64)], axis=1)
+        _, first = np.unique(key[::-1], axis=0, return_index=True)
+        latest = rows[len(rows) - 1 - first]
+        return _to_frame(latest)
@@ -0,0 +1,105 @@
+# ingest.py
+"""
+Ingest process for the multi-worker serving mode.
+
+    cd backend/src
+    python -m backend.ingest &
+    NSE_SHARED_SNAPSHOTS=1 gunicorn -w 4 -k gthread --threads 16 -b 0.0.0.0:8000 backend.app_api:app
+
+This process alone polls NSE (every underlying in NSE_SYMBOLS), records the
+chain history, appends the snapshot log, updates the candles and publishes
+each snapshot to shared memory (backend.shared). Workers only read.
+Candles are updated in memory as each snapshot arrives; the files are
+written behind it by a background writer (backend.persist).
+
+The recorders below are also what app_api subscribes in its single-process
+mode, so both modes write the same files.
+"""
+import argparse, logging, os, signal, threading
+from functools import partial
+from backend.candles import aggregator, latest_candle
+from backend.persist import PersistWriter
+from backend.history import HistoryStore, history_root
+from backend.snapshot import SnapshotGroup
+from backend.shared import SnapshotWriter, SHM_DIR, KEEP_VERSIONS
+from backend import metrics
+
+log = logging.getLogger(__name__)
+
+# full per-strike chain history on disk (NSE_HISTORY=0 disables recording)
+RECORD_HISTORY = os.environ.get("NSE_HISTORY", "1") != "0"
+
+_histories = {}
+# the disk side of the recorders: history, snapshot log and candles files
+persist_writer = PersistWriter()
+
+
+def record_history(snap):
+    symbol = snap['symbol']
+    store = _histories.get(symbol)
+    if store is None:
+        store = _histories[symbol] = HistoryStore(history_root(symbol))
+    store.append(snap['ts'], snap['df'])
+
+
+def persist_snapshot(snap):
+    # queue the log line, candles file and history for the writer thread, then fold the
+    # snapshot into the in-memory candles: only if it was queued, so candles_1m.json
+    # never holds a snapshot the log dropped (and a rebuild from the log gives the same bars);
+    # a flush landing in between only leaves this row's bar for the next flush
+    symbol = snap['symbol']
+    chain = snap['chain']
+    df = snap['df']
+    row = {'ts': snap['ts'], 'underlyingPrice': chain.spot, 'volume_sum': int(df['volume'].sum()) if (df is not None and not df.empty) else 0}
+    if not persist_writer.submit(symbol, row, partial(record_history, snap) if RECORD_HISTORY else None):
+        return
+    try:
+        with metrics.timed('candle_update'):
+            aggregator(symbol).add(row)
+    except Exception:
+        metrics.error('candle_update')
+        log.exception("candle update failed for %s", symbol)
+
+
+def subscribe_recorders(group):
+    """Subscribe the history and snapshot-log/candle recorders to every service of `group` and start their writer."""
+    for service in group:
+        # recover the candles from disk now rather than on the first snapshot
+        aggregator(service.symbol).load()
+        service.subscribe(persist_snapshot)
+    persist_writer.start()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Poll NSE and publish snapshots to shared memory for WSGI workers.")
+    ap.add_argument('--shm-dir', default=SHM_DIR, help="directory for the shared snapshot files (default: %(default)s)")
+    ap.add_argument('--keep', type=int, default=KEEP_VERSIONS, help="snapshot versions kept per underlying")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    group = SnapshotGroup()
+    if group.interval <= 0:
+        log.error("NSE_POLL_INTERVAL must be > 0 for the ingest process")
+        return 2
+    subscribe_recorders(group)
+    writers = []
+    for service in group:
+        writer = SnapshotWriter(service.symbol, args.shm_dir, args.keep, candle=latest_candle)
+        service.subscribe(writer.publish)
+        writers.append(writer)
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    log.info("ingesting %s every %ss into %s", ", ".join(group.symbols), group.interval, args.shm_dir)
+    group.start()
+    stop.wait()
+    group.stop()
+    for writer in writers:
+        writer.close()
+    persist_writer.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
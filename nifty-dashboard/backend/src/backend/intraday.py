@@ -0,0 +1,149 @@
+# intraday.py
+import os, threading
+import numpy as np
+from backend.analytics import STRIKE_STEP, FIXED_BELOW, FIXED_ABOVE, pain_curve
+from backend.chainframe import CE, PE
+from backend.history import HistoryStore
+
+# samples kept (a full 6h15m session at the default 3 s poll is 7500)
+RING_SAMPLES = int(os.environ.get("NSE_RING_SAMPLES", "7500"))
+# distinct strikes tracked per trading day
+RING_STRIKES = int(os.environ.get("NSE_RING_STRIKES", "256"))
+
+
+class ChainRing:
+    """
+    Fixed-size in-memory history of per-strike open interest, one sample per snapshot.
+
+    All storage is allocated up front, so memory is `nbytes` regardless of
+    how long the process runs:
+
+        ts         (samples,)              int64 UTC ns
+        oi, volume (samples, strikes, 2)   int32, summed across expiries, CE/PE
+        spot, pcr_overall, max_pain        (samples,) float64, max pain over the full chain
+
+    Strikes get a column the first time they are seen (up to `strikes`,
+    later ones are dropped); reads return columns sorted by strike. The
+    ring is cleared when the IST trading day changes.
+    """
+
+    def __init__(self, samples=RING_SAMPLES, strikes=RING_STRIKES):
+        self.samples = samples
+        self.strikes = strikes
+        self.ts = np.zeros(samples, dtype=np.int64)
+        self.oi = np.zeros((samples, strikes, 2), dtype=np.int32)
+        self.volume = np.zeros((samples, strikes, 2), dtype=np.int32)
+        self.spot = np.full(samples, np.nan)
+        self.pcr_overall = np.full(samples, np.nan)
+        self.max_pain = np.full(samples, np.nan)
+        self._strike_values = np.full(strikes, np.nan)
+        self._cols = {}
+        self._count = 0
+        self._day = None
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.ts, self.oi, self.volume, self.spot, self.pcr_overall,
+                                      self.max_pain, self._strike_values))
+
+    def __len__(self):
+        return min(self._count, self.samples)
+
+    def _columns(self, strikes):
+        # ring column per strike, -1 for strikes that no longer fit
+        cols = np.empty(len(strikes), dtype=np.intp)
+        for i, k in enumerate(strikes.tolist()):
+            c = self._cols.get(k)
+            if c is None:
+                if len(self._cols) >= self.strikes:
+                    cols[i] = -1
+                    continue
+                c = self._cols[k] = len(self._cols)
+                self._strike_values[c] = k
+            cols[i] = c
+        return cols
+
+    def append(self, snap):
+        """SnapshotService listener: record one sample from the snapshot's ChainFrame."""
+        chain = snap['chain']
+        t = np.datetime64(snap['ts'], 'ns')
+        day = HistoryStore.day_of(t)
+        pcr = chain.window().pcr('OI')
+        mp = np.nan
+        if len(chain.strikes):
+            mp = chain.strikes[int(np.argmin(pain_curve(chain.strikes, chain.oi[:, CE], chain.oi[:, PE])))]
+        with self._lock:
+            if day != self._day:
+                self._day, self._count = day, 0
+                self._cols.clear()
+                self._strike_values[:] = np.nan
+            cols = self._columns(chain.strikes)
+            keep = cols >= 0
+            i = self._count % self.samples
+            self.ts[i] = t.astype(np.int64)
+            self.oi[i] = 0
+            self.volume[i] = 0
+            self.oi[i, cols[keep]] = chain.oi[keep]
+            self.volume[i, cols[keep]] = chain.volume[keep]
+            self.spot[i] = np.nan if chain.spot is None else chain.spot
+            self.pcr_overall[i] = np.nan if pcr is None else pcr
+            self.max_pain[i] = mp
+            self._count += 1
+
+    def _order(self, start=None, end=None, last=None):
+        # ring positions in time order, restricted to [start, end] and the newest `last`; caller holds the lock
+        n = len(self)
+        pos = (np.arange(self._count - n, self._count) % self.samples) if n else np.empty(0, dtype=np.intp)
+        ts = self.ts[pos]
+        a = 0 if start is None else int(np.searchsorted(ts, np.datetime64(start, 'ns').astype(np.int64), 'left'))
+        b = n if end is None else int(np.searchsorted(ts, np.datetime64(end, 'ns').astype(np.int64), 'right'))
+        if last is not None:
+            a = max(a, b - last)
+        return pos[a:b]
+
+    def _strike_order(self, strikes=None, strike_min=None, strike_max=None):
+        n = len(self._cols)
+        values = self._strike_values[:n]
+        cols = np.argsort(values, kind='stable')
+        values = values[cols]
+        m = np.ones(n, dtype=bool)
+        if strikes is not None:
+            m &= np.isin(values, np.asarray(strikes, dtype=float))
+        if strike_min is not None:
+            m &= values >= strike_min
+        if strike_max is not None:
+            m &= values <= strike_max
+        return cols[m], values[m]
+
+    def pcr(self, fixed=True, atm_window_strikes=3, step=STRIKE_STEP, start=None, end=None, last=None):
+        """
+        Per-sample PCR series; `pcr_window` uses each sample's own spot-based
+        window (compute_window_bounds_from_spot) with the exclude-zero rule.
+        """
+        with self._lock:
+            pos = self._order(start, end, last)
+            cols, strikes = self._strike_order()
+            oi = self.oi[np.ix_(pos, cols)]
+            ts, spot = self.ts[pos], self.spot[pos]
+            overall, mp = self.pcr_overall[pos], self.max_pain[pos]
+        atm = np.round(spot / step) * step
+        low, high = (atm - FIXED_BELOW * step, atm + FIXED_ABOVE * step) if fixed else (atm - atm_window_strikes * step, atm + atm_window_strikes * step)
+        inside = (strikes >= low[:, None]) & (strikes <= high[:, None])
+        kept = inside & (oi[:, :, CE] > 0) & (oi[:, :, PE] > 0)
+        ce = np.where(kept, oi[:, :, CE], 0).sum(axis=1, dtype=np.int64)
+        pe = np.where(kept, oi[:, :, PE], 0).sum(axis=1, dtype=np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            window = np.where(ce > 0, pe / np.where(ce > 0, ce, 1), np.nan)
+        return {'ts': ts, 'spot': spot, 'pcr_window': window, 'pcr_overall': overall, 'max_pain': mp}
+
+    def strike_history(self, strikes=None, strike_min=None, strike_max=None, start=None, end=None, last=None):
+        """
+        (ts, strikes, oi, volume) for the selected samples and strikes, arrays
+        shaped (samples, strikes, 2) with CE/PE on the last axis.
+        """
+        with self._lock:
+            pos = self._order(start, end, last)
+            cols, values = self._strike_order(strikes, strike_min, strike_max)
+            ix = np.ix_(pos, cols)
+            return self.ts[pos], values, self.oi[ix], self.volume[ix]
@@ -0,0 +1,73 @@
+# jsonpath.py
+"""
+Finding fields in NSE JSON payloads whose layout is not documented.
+
+A PathResolver remembers where its target was last found, as a tuple of
+dict keys and list indices, and on the next payload follows that path and
+checks the node it lands on. Only when the path is gone or leads somewhere
+else (NSE changed the layout) does it walk the whole tree again and learn
+the new path.
+"""
+from backend import metrics
+
+_MISSING = object()
+
+
+def walk(obj, path=()):
+    """(path, node) for `obj` and everything under it, depth first, each node before its children."""
+    yield path, obj
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            yield from walk(v, path + (k,))
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            yield from walk(v, path + (i,))
+
+
+def follow(obj, path):
+    """The node at `path` under `obj`, or _MISSING."""
+    for step in path:
+        if isinstance(obj, dict) or (isinstance(obj, list) and isinstance(step, int)):
+            try:
+                obj = obj[step]
+                continue
+            except (KeyError, IndexError):
+                pass
+        return _MISSING
+    return obj
+
+
+class PathResolver:
+    """
+    Locate the node `match(node)` accepts: at the learned path when it still
+    matches there, otherwise by `scan(payload)` (default: the first match
+    in walk() order), which returns the path to learn or None.
+    """
+
+    def __init__(self, name, match, scan=None):
+        self.name = name
+        self.match = match
+        self.scan = scan or self._first_match
+        self.path = None
+
+    def _first_match(self, obj):
+        for path, node in walk(obj):
+            if self.match(node):
+                return path
+        return None
+
+    def resolve(self, obj):
+        """(path, node) for the target in payload `obj`, or (None, None) when it has none."""
+        path = self.path
+        if path is not None:
+            node = follow(obj, path)
+            if node is not _MISSING and self.match(node):
+                metrics.cache('json_path:' + self.name, True)
+                return path, node
+        metrics.cache('json_path:' + self.name, False)
+        with metrics.timed('json_scan:' + self.name):
+            path = self.scan(obj)
+        if path is None:
+            return None, None
+        self.path = path
+        return path, follow(obj, path)
@@ -0,0 +1,143 @@
+# metrics.py
+"""
+In-process counters and latency histograms, rendered in the Prometheus
+text exposition format (no client library needed).
+
+    with timed('normalize'): ...           # observe nifty_stage_seconds{stage="normalize"}
+    @timed_fn('compute_pcr')               # same, as a decorator
+    inc('nse_retry')                       # nifty_events_total{event="nse_retry"}
+    cache('snapshot', hit=True)            # nifty_cache_requests_total{cache="snapshot",result="hit"}
+
+Timings taken on a thread between `start_profile()` and `stop_profile()` are
+also collected into a per-request list, which app_api returns for `?profile=1`.
+"""
+import threading, time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+PREFIX = "nifty_"
+# seconds; NSE round trips sit at the top end, in-memory stages at the bottom
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, n=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + n
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        out = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s counter" % self.name]
+        with self._lock:
+            items = sorted(self._values.items())
+        out += ["%s%s %s" % (self.name, _labels(self.labels, k), v) for k, v in items]
+        return out
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(label_values)
+            if s is None:
+                s = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += value
+
+    def render(self):
+        out = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s histogram" % self.name]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        names = self.labels + ('le',)
+        for k, s in items:
+            cum = 0
+            for b, c in zip(self.buckets + ('+Inf',), s[:-1]):
+                cum += c
+                out.append("%s_bucket%s %d" % (self.name, _labels(names, k + (b,)), cum))
+            out.append("%s_sum%s %.6f" % (self.name, _labels(self.labels, k), s[-1]))
+            out.append("%s_count%s %d" % (self.name, _labels(self.labels, k), cum))
+        return out
+
+
+STAGE_SECONDS = Histogram(PREFIX + "stage_seconds", "Time spent in each pipeline stage.", ('stage',))
+REQUEST_SECONDS = Histogram(PREFIX + "http_request_seconds", "Flask request latency.", ('endpoint', 'status'))
+EVENTS = Counter(PREFIX + "events_total", "Upstream errors, retries and other notable events.", ('event',))
+ERRORS = Counter(PREFIX + "errors_total", "Exceptions caught and logged, by where they were handled.", ('where',))
+CACHE = Counter(PREFIX + "cache_requests_total", "Cache lookups by cache and result (hit/miss).", ('cache', 'result'))
+METRICS = [STAGE_SECONDS, REQUEST_SECONDS, EVENTS, ERRORS, CACHE]
+
+
+def inc(event, n=1):
+    EVENTS.inc(n, event)
+
+def error(where):
+    ERRORS.inc(1, where)
+
+def cache(name, hit):
+    CACHE.inc(1, name, 'hit' if hit else 'miss')
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
+    prof = getattr(_local, 'profile', None)
+    if prof is not None:
+        prof.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t0)
+
+
+def timed_fn(stage):
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - t0)
+        return wrapper
+    return deco
+
+
+def start_profile():
+    """Collect this thread's stage timings until stop_profile()."""
+    _local.profile = []
+
+def stop_profile():
+    """[(stage, seconds)] recorded on this thread since start_profile(), in completion order."""
+    prof, _local.profile = getattr(_local, 'profile', None), None
+    return prof or []
+
+
+def render():
+    return "\n".join(line for m in METRICS for line in m.render()) + "\n"
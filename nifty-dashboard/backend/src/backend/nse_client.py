@@ -0,0 +1,194 @@
+# nse_client.py
+import os, time, random, threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from backend import metrics
+
+NSE_BASE_URL = os.environ.get("NSE_BASE_URL", "https://www.nseindia.com")
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Referer": NSE_BASE_URL + "/option-chain",
+    "Connection": "keep-alive",
+}
+# status codes worth another attempt (throttling / transient upstream errors)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class NSEClient:
+    """
+    Shared HTTP client for the NSE JSON APIs.
+
+    - one `requests.Session` over a pooled keep-alive adapter, safe to use
+      from Flask request threads and the snapshot poller at the same time;
+    - homepage cookies are fetched only when missing, expired (per cookie
+      `expires` or `cookie_ttl` seconds after the last refresh) or after a
+      401/403;
+    - retries with full-jitter exponential backoff on network errors, 429
+      and 5xx;
+    - a circuit breaker: after `failure_threshold` consecutive failed calls
+      requests fail fast with CircuitOpenError for `cooldown` seconds, then
+      a single trial call decides whether to close it again.
+    """
+
+    def __init__(self, base_url=NSE_BASE_URL, pool_size=8, timeout=(3.05, 10), retries=3,
+                 backoff=0.5, max_backoff=8.0, failure_threshold=5, cooldown=30.0, cookie_ttl=300.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.cookie_ttl = cookie_ttl
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(HEADERS)
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="nse-client")
+
+        self._cookie_lock = threading.Lock()
+        self._cookies_at = None
+        self._breaker_lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def url(self, path):
+        return path if path.startswith("http") else self.base_url + path
+
+    # ---- cookies ----
+
+    def _cookies_valid(self):
+        if self._cookies_at is None or not self.session.cookies:
+            return False
+        now = time.time()
+        if now - self._cookies_at > self.cookie_ttl:
+            return False
+        return not any(c.expires is not None and c.expires <= now for c in self.session.cookies)
+
+    def refresh_cookies(self, force=False):
+        if not force and self._cookies_valid():
+            return
+        with self._cookie_lock:
+            if not force and self._cookies_valid():
+                return
+            with metrics.timed('nse_cookie_refresh'):
+                self.session.get(self.base_url, timeout=self.timeout)
+            metrics.inc('nse_cookie_refresh')
+            self._cookies_at = time.time()
+
+    def _invalidate_cookies(self):
+        self._cookies_at = None
+
+    # ---- circuit breaker ----
+
+    def _before_call(self):
+        with self._breaker_lock:
+            if self._opened_at is None:
+                return
+            if time.time() - self._opened_at < self.cooldown or self._trial:
+                metrics.inc('nse_circuit_rejected')
+                raise CircuitOpenError("NSE circuit open after %d consecutive failures" % self._failures)
+            self._trial = True  # half-open: let this one call through
+
+    def _record(self, ok):
+        with self._breaker_lock:
+            self._trial = False
+            if ok:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    metrics.inc('nse_circuit_opened')
+                self._opened_at = time.time()
+
+    @property
+    def circuit_open(self):
+        return self._opened_at is not None
+
+    # ---- requests ----
+
+    def _sleep(self, attempt):
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt))))
+
+    def get_json(self, path, params=None):
+        """GET `path` (relative to base_url, or absolute) and return the decoded JSON."""
+        self._before_call()
+        ok = False
+        try:
+            data = self._get_with_retries(self.url(path), params)
+            ok = True
+            return data
+        finally:
+            # always settles the breaker, so an unexpected exception cannot leave a half-open trial pending
+            self._record(ok)
+            metrics.inc('nse_request_ok' if ok else 'nse_request_failed')
+
+    def _get_with_retries(self, url, params):
+        last = None
+        for attempt in range(self.retries):
+            if attempt:
+                metrics.inc('nse_retry')
+            try:
+                self.refresh_cookies()
+                with metrics.timed('nse_request'):
+                    r = self.session.get(url, params=params, timeout=self.timeout)
+                if r.status_code in (401, 403):
+                    # cookies rejected: fetch fresh ones on the next attempt
+                    metrics.inc('nse_cookie_rejected')
+                    self._invalidate_cookies()
+                r.raise_for_status()
+                return r.json()
+            except requests.HTTPError as e:
+                last = e
+                if e.response is not None and e.response.status_code not in RETRY_STATUS + (401, 403):
+                    break  # other 4xx: retrying will not help
+            except (requests.RequestException, ValueError) as e:
+                last = e
+            if attempt < self.retries - 1:
+                self._sleep(attempt)
+        raise RuntimeError(f"NSE request failed for {url}: {last}")
+
+    def fetch_many(self, jobs):
+        """
+        Run several get_json calls concurrently.
+
+        `jobs` maps a name to `path` or `(path, params)`. Returns {name: json}
+        with the exception instance in place of the JSON for failed calls.
+        """
+        futures = {}
+        for name, job in jobs.items():
+            path, params = job if isinstance(job, tuple) else (job, None)
+            futures[name] = self._pool.submit(self.get_json, path, params)
+        out = {}
+        for name, fut in futures.items():
+            try:
+                out[name] = fut.result()
+            except Exception as e:
+                out[name] = e
+        return out
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Process-wide NSEClient, created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = NSEClient()
+    return _client
@@ -0,0 +1,121 @@
+# payloads.py
+import gzip, json, threading
+from collections import deque
+from backend.fetcher import chain_records, chain_columns
+from backend.snapshot import diff_chain
+from backend import metrics
+
+FORMATS = ('records', 'columnar')
+# bodies smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+# `since` for every version no kept snapshot has (too old, future, made up): they share one full body
+UNKNOWN_SINCE = -1
+
+
+class ChainPayloads:
+    """
+    Serialized /api/nifty/optionchain bodies, built once per snapshot version.
+
+    Subscribed to SnapshotService, it keeps the last `keep` snapshots so
+    `since=<version>` requests can be answered with only the legs that
+    changed. Every (version, since, format, gzip, expiry) body is encoded
+    on first request and reused until the next snapshot arrives; a `since`
+    that cannot be resolved is keyed as UNKNOWN_SINCE (see since_key), so
+    there are at most `keep` + 1 per format and expiry. `expiry` bodies hold
+    only that expiry's legs (the snapshot's `expiries` slice).
+    """
+
+    def __init__(self, encode=json.dumps, keep=20, gzip_min=GZIP_MIN_BYTES):
+        self.encode = encode
+        self.gzip_min = gzip_min
+        self._recent = deque(maxlen=keep)
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def publish(self, snap):
+        with self._lock:
+            self._recent.append(snap)
+            # bodies are only ever served for the newest snapshot
+            self._bodies = {k: v for k, v in self._bodies.items() if k[0] == snap['version']}
+
+    def _find(self, version):
+        for s in reversed(self._recent):
+            if s['version'] == version:
+                return s
+        return None
+
+    def since_key(self, since):
+        """`since` if a kept snapshot has that version, else UNKNOWN_SINCE; None stays None."""
+        if since is None:
+            return None
+        with self._lock:
+            return since if self._find(since) is not None else UNKNOWN_SINCE
+
+    @staticmethod
+    def etag(version, since=None, fmt='records', gzipped=False, expiry=None):
+        # `since` as returned by since_key
+        tag = "v%d" % version
+        if expiry is not None: tag += "-e" + expiry
+        if since is not None: tag += "-s%d" % since
+        if fmt != 'records': tag += "-" + fmt
+        if gzipped: tag += "-gz"
+        return tag
+
+    @staticmethod
+    def _frame(snap, expiry):
+        return snap['df'] if expiry is None else snap['expiries'].get(expiry)
+
+    def _build(self, snap, since, fmt, expiry):
+        df = self._frame(snap, expiry)
+        if since is None:
+            if fmt == 'columnar':
+                return {'version': snap['version'], 'rows': len(df), 'columns': chain_columns(df)}
+            return chain_records(df)
+        with self._lock:
+            base = self._find(since)
+        mask = diff_chain(self._frame(base, expiry), df) if base is not None else None
+        part = df if mask is None else df[mask]
+        out = {'version': snap['version'], 'since': None if since == UNKNOWN_SINCE else since,
+               'full': mask is None, 'rows': len(part)}
+        if fmt == 'columnar':
+            out['columns'] = chain_columns(part)
+        else:
+            out['records'] = chain_records(part)
+        return out
+
+    def body(self, snap, since=None, fmt='records', gzip_ok=False, expiry=None):
+        """
+        (bytes, gzipped) for `snap`.
+
+        Without `since` the records body is the plain list the endpoint has
+        always returned. With it the body is a dict whose `full` flag says
+        whether it holds every leg (`since` unknown, with `since` null, or
+        the strike layout changed) or only the ones changed after that
+        version.
+        """
+        if fmt not in FORMATS:
+            raise ValueError("unknown format %r" % fmt)
+        if expiry is not None and expiry not in snap['expiries']:
+            raise KeyError(expiry)
+        since = self.since_key(since)
+        v = snap['version']
+        key = (v, since, fmt, gzip_ok, expiry)
+        with self._lock:
+            hit = self._bodies.get(key)
+        metrics.cache('optionchain_body', hit is not None)
+        if hit is not None:
+            return hit
+        plain_key = (v, since, fmt, False, expiry)
+        with self._lock:
+            raw = self._bodies.get(plain_key)
+        if raw is None:
+            raw = (self.encode(self._build(snap, since, fmt, expiry)).encode(), False)
+        out = raw
+        if gzip_ok and len(raw[0]) >= self.gzip_min:
+            out = (gzip.compress(raw[0], compresslevel=5), True)
+        with self._lock:
+            # only cache bodies of the current snapshot (a newer one may have landed meanwhile)
+            if self._recent and self._recent[-1]['version'] == v:
+                self._bodies[plain_key] = raw
+                self._bodies[key] = out
+        return out
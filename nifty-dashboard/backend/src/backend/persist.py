@@ -0,0 +1,99 @@
+# persist.py
+"""
+Background writer for the snapshot log, the candles files and the chain
+history.
+
+Snapshot listeners run on the thread that fetched the snapshot, which in
+on-demand mode is a request thread. So ingest.persist_snapshot only queues
+the disk work here and, once it is queued, folds the snapshot into the
+in-memory candles. One writer thread drains the queue every PERSIST_INTERVAL seconds.
+It records the history of each queued snapshot in order, appends each
+underlying's log lines in one write, and replaces each touched candles file
+once, atomically (candles.write_atomic).
+
+The queue holds at most PERSIST_QUEUE snapshots. If the disk falls that
+far behind, new snapshots are left out of the files and the candles and
+counted as persist_dropped; the request path never waits on it.
+"""
+import atexit, logging, os, queue, threading
+from backend.candles import aggregator, append_snapshots, candle_files, write_atomic
+from backend import metrics
+
+log = logging.getLogger(__name__)
+
+PERSIST_QUEUE = int(os.environ.get("NSE_PERSIST_QUEUE", 1024))
+# seconds between flushes
+PERSIST_INTERVAL = float(os.environ.get("NSE_PERSIST_INTERVAL", 1.0))
+
+
+class PersistWriter:
+    def __init__(self, maxsize=PERSIST_QUEUE, interval=PERSIST_INTERVAL):
+        self.interval = interval
+        self._queue = queue.Queue(maxsize)
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="snapshot-persist", daemon=True)
+            self._thread.start()
+            # queued snapshots still reach disk when the process exits normally
+            atexit.register(self.close)
+
+    def submit(self, symbol, row, record=None):
+        """
+        Queue snapshot-log `row` for `symbol`, and `record()` (e.g. the
+        history append) to run on the writer thread. False if the queue is
+        full and the snapshot was dropped.
+        """
+        try:
+            self._queue.put_nowait((symbol, row, record))
+            return True
+        except queue.Full:
+            metrics.inc('persist_dropped')
+            return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """Write everything queued so far; returns the number of snapshots written."""
+        with self._flush_lock:
+            batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return 0
+            with metrics.timed('persist_flush'):
+                rows = {}
+                for symbol, row, record in batch:
+                    rows.setdefault(symbol, []).append(row)
+                    if record is not None:
+                        try:
+                            record()
+                        except Exception:
+                            metrics.error('persist_record')
+                            log.exception("recording a %s snapshot failed", symbol)
+                for symbol, lines in rows.items():
+                    try:
+                        append_snapshots(lines, candle_files(symbol)[0])
+                        agg = aggregator(symbol)
+                        write_atomic(agg.candles_file, agg.dump())
+                    except Exception:
+                        metrics.error('snapshot_append')
+                        log.exception("writing %d %s snapshot(s) failed", len(lines), symbol)
+            metrics.inc('persist_snapshots', len(batch))
+            return len(batch)
+
+    def close(self):
+        """Stop the writer thread after a last flush."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
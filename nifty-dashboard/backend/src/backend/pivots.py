@@ -0,0 +1,191 @@
+# pivots.py
+"""
+The dashboard's strike table and PCR table, built on the server.
+
+For one expiry and strike window of a snapshot there is one row per strike.
+Each row holds both legs' OI, OI change, volume, IV, LTP, LTP change and
+best bid/ask, plus total OI and PCR. It also carries running sums of OI
+and the running PCR from the lowest strike up, and percentile ranks of the
+OI columns for heat shading. PCRs with PE OI but no CE OI are "inf".
+The ITM/ATM/OTM/TOTAL buckets of the PCR
+table and OI totals per expiry (for the expiry chart) come with it, so a
+client no longer needs the whole chain.
+
+PivotTables caches each encoded body per snapshot version: every client
+polling the same window shares one build.
+"""
+import json, threading
+import numpy as np
+from backend.analytics import round_to_nearest_strike, STRIKE_STEP
+from backend.chainframe import ChainFrame, CE, PE
+from backend import metrics
+
+# (frame column, row field): rows carry CE_<field> and PE_<field>
+FIELDS = (
+    ('OI', 'OI'), ('OI_change', 'OI_change'), ('volume', 'vol'), ('impliedVolatility', 'iv'),
+    ('lastPrice', 'last'), ('LTP_change', 'ltp_chng'),
+    ('bidQty', 'bidQty'), ('bidPrice', 'bidPrice'), ('askQty', 'askQty'), ('askPrice', 'askPrice'),
+)
+# summed per strike; the others are one quote per leg (NaN where the leg is missing)
+_COUNTS = {'OI', 'OI_change', 'volume', 'bidQty', 'askQty'}
+# PCR of a window or strike with PE OI but no CE OI
+INF = 'inf'
+
+
+def _ratio(num, den):
+    # PE OI with no CE OI is an infinite PCR (as the old client computed it); neither side -> NaN
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(den > 0, num / den, np.where(num > 0, np.inf, np.nan))
+
+
+def _pct_rank(a):
+    # share of the window's strikes at or below each value (1.0 = the largest)
+    if not len(a):
+        return np.empty(0)
+    return np.searchsorted(np.sort(a), a, 'right') / len(a)
+
+
+def _json_list(a, digits=4):
+    # NaN -> None, inf -> "inf" (JSON has no Infinity); counts stay ints
+    if a.dtype.kind in 'iu':
+        return a.tolist()
+    return [None if v != v else INF if v == np.inf else v for v in np.round(a, digits).tolist()]
+
+
+def _bucket(strikes, ce_oi, pe_oi, ce_vol, pe_vol, ce_mask, pe_mask):
+    def side(oi, vol, m):
+        held = strikes[m & (oi > 0)]
+        return int(oi[m].sum()), int(vol[m].sum()), ([float(held.min()), float(held.max())] if len(held) else None)
+    ce, ce_v, ce_range = side(ce_oi, ce_vol, ce_mask)
+    pe, pe_v, pe_range = side(pe_oi, pe_vol, pe_mask)
+    return {'CE_OI': ce, 'PE_OI': pe, 'CE_vol': ce_v, 'PE_vol': pe_v, 'CE_range': ce_range, 'PE_range': pe_range,
+            'PCR': round(pe / ce, 4) if ce else (INF if pe else None)}
+
+
+def build_tables(df, spot, step=STRIKE_STEP, low=None, high=None):
+    """
+    Strike rows and PCR buckets for the legs of one expiry (`df`, a slice of
+    a normalize_nse_json frame) between strikes `low` and `high`
+    (inclusive; None = unbounded). ATM is `spot` rounded to `step`.
+    """
+    strikes, cell, _, _ = ChainFrame.layout(df['strike'].to_numpy(), (df['optionType'] == 'PE').to_numpy())
+    n = len(strikes)
+    a = 0 if low is None else int(np.searchsorted(strikes, low, 'left'))
+    b = n if high is None else int(np.searchsorted(strikes, high, 'right'))
+
+    cols = {'strike': strikes[a:b]}
+    for column, name in FIELDS:
+        vals = df[column].to_numpy()
+        if column in _COUNTS:
+            grid = np.bincount(cell, weights=vals, minlength=2 * n).astype(np.int64)
+        else:
+            grid = np.full(2 * n, np.nan)
+            grid[cell] = np.round(vals.astype(float), 2)
+        grid = grid.reshape(n, 2)[a:b]
+        cols['CE_' + name], cols['PE_' + name] = grid[:, CE], grid[:, PE]
+
+    ce, pe = cols['CE_OI'], cols['PE_OI']
+    cols['total_OI'] = ce + pe
+    cols['PCR'] = _ratio(pe, ce)
+    cols['CE_OI_cum'], cols['PE_OI_cum'] = np.cumsum(ce), np.cumsum(pe)
+    cols['PCR_cum'] = _ratio(cols['PE_OI_cum'], cols['CE_OI_cum'])
+    for name in ('CE_OI', 'PE_OI', 'total_OI'):
+        cols[name + '_rank'] = _pct_rank(cols[name])
+
+    k = cols['strike']
+    atm = round_to_nearest_strike(spot, step)
+    below, at, above = (k < atm, k == atm, k > atm) if atm is not None else (np.zeros(len(k), bool),) * 3
+    everything = np.ones(len(k), dtype=bool)
+    args = (k, ce, pe, cols['CE_vol'], cols['PE_vol'])
+    buckets = {
+        'ITM': _bucket(*args, below, above),
+        'ATM': _bucket(*args, at, at),
+        'OTM': _bucket(*args, above, below),
+        'TOTAL': _bucket(*args, everything, everything),
+    }
+
+    names = list(cols)
+    values = [_json_list(cols[c]) for c in names]
+    return {
+        'atm': atm,
+        'low': low,
+        'high': high,
+        'max_total_OI': int(cols['total_OI'].max()) if len(k) else 0,
+        'rows': [dict(zip(names, r)) for r in zip(*values)],
+        'buckets': buckets,
+    }
+
+
+def expiry_totals(snap):
+    """[{'expiry', 'CE_OI', 'PE_OI'}] for every expiry of the snapshot, nearest first."""
+    out = []
+    for key, rows in snap['expiries'].items():
+        oi = np.bincount((rows['optionType'] == 'PE').to_numpy().astype(np.intp),
+                         weights=rows['OI'].to_numpy(), minlength=2)
+        out.append({'expiry': key, 'CE_OI': int(oi[CE]), 'PE_OI': int(oi[PE])})
+    return out
+
+
+class PivotTables:
+    """
+    Encoded /api/nifty/pivot_tables bodies, built once per (snapshot
+    version, expiry, window). Subscribed to the snapshot service so bodies
+    of older versions are dropped as soon as a new one arrives.
+    """
+
+    def __init__(self, encode=json.dumps, step=STRIKE_STEP):
+        self.encode = encode
+        self.step = step
+        self._version = None
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(version, expiry, low, high):
+        return "p%d-e%s-%s-%s" % (version, expiry, low, high)
+
+    def window(self, snap, low=None, high=None):
+        """
+        (low, high) moved inward onto the snapshot's listed strikes, None
+        where a bound cuts nothing off. It selects the same strikes, but
+        any client bounds map onto a few cache keys; every empty window
+        maps onto one.
+        """
+        strikes = snap['chain'].strikes
+        n = len(strikes)
+        if not n:
+            return None, None
+        a = 0 if low is None else int(np.searchsorted(strikes, low, 'left'))
+        b = n if high is None else int(np.searchsorted(strikes, high, 'right'))
+        if a >= b:
+            above = float(strikes[-1]) + self.step
+            return above, above
+        return (None if a == 0 else float(strikes[a])), (None if b == n else float(strikes[b - 1]))
+
+    def publish(self, snap):
+        with self._lock:
+            if snap['version'] != self._version:
+                self._version = snap['version']
+                self._bodies = {}
+
+    def body(self, snap, expiry, low=None, high=None):
+        """Encoded body for `expiry` (a key of snap['expiries']) between strikes `low` and `high` (see window())."""
+        v = snap['version']
+        key = (v, expiry, low, high)
+        with self._lock:
+            hit = self._bodies.get(key)
+        metrics.cache('pivot_tables', hit is not None)
+        if hit is not None:
+            return hit
+        with metrics.timed('pivot_tables_build'):
+            out = build_tables(snap['expiries'][expiry], snap['chain'].spot, self.step, low, high)
+            out.update(symbol=snap['symbol'], expiry=expiry, spot=snap['chain'].spot, step=self.step,
+                       version=v, ts=snap['ts'], expiries=expiry_totals(snap))
+            body = self.encode(out).encode()
+        with self._lock:
+            # only keep bodies of the current snapshot (a newer one may have landed meanwhile)
+            if self._version is None or v >= self._version:
+                self._version = v
+                self._bodies = {k: b for k, b in self._bodies.items() if k[0] == v}
+                self._bodies[key] = body
+        return body
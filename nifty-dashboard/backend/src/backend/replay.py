@@ -0,0 +1,240 @@
+# replay.py
+"""
+Replay recorded option chains through the window_stats pipeline.
+
+    python -m backend.replay --out data/replay                      # every recorded day
+    python -m backend.replay --days 2025-09-19 --mode ATM --atm-window 3 --out data/replay
+    python -m backend.replay --raw dumps/*.jsonl --out data/replay  # raw NSE payloads
+    python -m backend.replay --symbol BANKNIFTY --out data/replay/BANKNIFTY
+    python -m backend.replay --compare data/replay_old data/replay  # diff two runs
+
+Each source (a recorded day, or one raw payload file) is replayed in its
+own worker process and written to <out>/<name>.jsonl, one line of
+metrics per snapshot.
+"""
+import argparse, glob, gzip, json, logging, math, os, time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+from backend.analytics import STRIKE_STEP, strike_step
+from backend.chainframe import ChainFrame, compute_chain_stats
+from backend.fetcher import normalize_nse_json
+from backend.history import HistoryStore, HISTORY_DIR, history_root
+
+log = logging.getLogger(__name__)
+
+
+def _layouts(rows):
+    # per-expiry row ranges plus ChainFrame layouts for the whole chain and each expiry
+    exp = rows['expiry']
+    bounds = np.flatnonzero(np.diff(exp)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(rows)]))
+    parts = [(str(np.datetime64(int(exp[a]), 'D')), a, b, ChainFrame.layout(rows['strike'][a:b], rows['leg'][a:b]))
+             for a, b in zip(starts, ends) if b > a]
+    return ChainFrame.layout(rows['strike'], rows['leg']), parts
+
+
+def _chain_from_rows(rows, underlying, layout=None, parts=None):
+    return ChainFrame.from_arrays(rows['strike'], rows['leg'], rows['OI'], rows['volume'],
+                                  rows['lastPrice'], rows['impliedVolatility'],
+                                  spot=underlying, prev_close=underlying, parts=parts, layout=layout)
+
+
+def history_chains(day, root=HISTORY_DIR):
+    """(ts_ns, ChainFrame) for every snapshot HistoryStore recorded on `day`."""
+    keyframe = layouts = None
+    for ts, underlying, rows in HistoryStore(root).iter_snapshots(day):
+        if rows is not keyframe:
+            # iter_snapshots hands out a new array at each keyframe: the only
+            # point where strikes/expiries can change, so layouts are reused until then
+            keyframe, layouts = rows, _layouts(rows)
+        full, parts = layouts
+        parts = {key: partial(_chain_from_rows, rows[a:b], underlying, lay) for key, a, b, lay in parts}
+        yield ts, _chain_from_rows(rows, underlying, full, parts)
+
+
+def _raw_payloads(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as fh:
+        if '.jsonl' in path:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield json.load(fh)
+
+
+def _payload_ts(j):
+    # records.timestamp is IST wall time, e.g. "19-Sep-2025 15:30:00"
+    stamp = (j.get('records') or {}).get('timestamp')
+    if not stamp:
+        return None
+    t = pd.to_datetime(stamp, format='%d-%b-%Y %H:%M:%S', errors='coerce')
+    return None if pd.isna(t) else int((t - pd.Timedelta(minutes=330)).value)
+
+
+def raw_chains(path):
+    """
+    (ts_ns, ChainFrame) for raw NSE option-chain payloads in `path`: one
+    payload per .json file or per line of a .jsonl file (optionally .gz).
+    Each payload goes through normalize_nse_json like a live poll.
+    """
+    for i, j in enumerate(_raw_payloads(path)):
+        if 'optionchain' in j:
+            j = j['optionchain']  # a fetch_nse_bundle dump
+        yield _payload_ts(j), ChainFrame.from_df(normalize_nse_json(j))
+
+
+def _clean(v):
+    return None if isinstance(v, float) and math.isnan(v) else v
+
+
+def metrics_row(seq, ts, chain, stats):
+    """Flatten compute_chain_stats output into one JSON-able line (max pain as strikes only)."""
+    mp = stats['max_pain']
+    vwap = stats['vwap']
+    row = {
+        'seq': seq,
+        'ts': None if ts is None else str(np.datetime64(ts, 'ns').astype('datetime64[ms]')),
+        'spot': chain.spot,
+        'atm': stats['atm'], 'low': stats['low'], 'high': stats['high'],
+        'pcr_window': stats['pcr_window'], 'pcr_overall': stats['pcr_overall'],
+        'vwap_CE': _clean(vwap.get('CE')), 'vwap_PE': _clean(vwap.get('PE')),
+        'max_pain': mp['max_pain_strike'] if mp else None,
+        'max_pain_by_expiry': {k: v['max_pain_strike'] for k, v in stats['max_pain_by_expiry'].items() if v},
+        'skew': _clean(stats['skew']),
+    }
+    row.update(stats['pcr_window_details'])
+    return row
+
+
+def replay(chains, out_path, mode='FIXED', atm_window=3, speed=0, step=STRIKE_STEP):
+    """
+    Run compute_chain_stats over `chains` ((ts_ns or None, ChainFrame)
+    pairs) and write one metrics line per snapshot to `out_path`. `step` is
+    the underlying's strike spacing.
+
+    speed=0 replays as fast as possible; speed=N paces snapshots at N times
+    their recorded spacing. Returns the number of snapshots written.
+    """
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    n = 0
+    t0 = w0 = None
+    with open(out_path, 'w') as fh:
+        for ts, chain in chains:
+            if speed and ts is not None:
+                if t0 is None:
+                    t0, w0 = ts, time.monotonic()
+                delay = (ts - t0) / 1e9 / speed - (time.monotonic() - w0)
+                if delay > 0:
+                    time.sleep(delay)
+            fh.write(json.dumps(metrics_row(n, ts, chain, compute_chain_stats(chain, mode, atm_window, step))))
+            fh.write('\n')
+            n += 1
+    return n
+
+
+def _run_source(source, out_dir, mode, atm_window, speed, root, step):
+    kind, name = source
+    if kind == 'day':
+        chains, stem = history_chains(name, root), name
+    else:
+        chains, stem = raw_chains(name), os.path.basename(name).split('.')[0]
+    out_path = os.path.join(out_dir, stem + '.jsonl')
+    start = time.perf_counter()
+    n = replay(chains, out_path, mode, atm_window, speed, step)
+    return out_path, n, time.perf_counter() - start
+
+
+def run(out_dir, days=None, raw=None, mode='FIXED', atm_window=3, speed=0, workers=None, root=HISTORY_DIR,
+        step=STRIKE_STEP):
+    """
+    Replay recorded days (default: all of them unless `raw` files are given)
+    and/or raw payload files, one process per source.
+    Returns [(out_path, snapshots, seconds)].
+    """
+    sources = [('raw', p) for p in (raw or [])]
+    if days or not raw:
+        sources += [('day', d) for d in (days or HistoryStore(root).days())]
+    if not sources:
+        return []
+    job = partial(_run_source, out_dir=out_dir, mode=mode, atm_window=atm_window, speed=speed, root=root, step=step)
+    if workers == 1 or len(sources) == 1:
+        return [job(s) for s in sources]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(job, sources))
+
+
+def _read_lines(path):
+    with open(path) as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def _diff(a, b, tol, path=''):
+    if isinstance(a, dict) and isinstance(b, dict):
+        out = []
+        for k in sorted(set(a) | set(b)):
+            out += _diff(a.get(k), b.get(k), tol, path + '.' + str(k))
+        return out
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return [] if math.isclose(a, b, rel_tol=tol, abs_tol=tol) else [(path, a, b)]
+    return [] if a == b else [(path, a, b)]
+
+
+def compare(a_dir, b_dir, tol=1e-9):
+    """
+    Differences between two replay outputs: {file: [(line, field, a, b)]}
+    for every metric that differs by more than `tol` (missing lines count).
+    """
+    out = {}
+    for name in sorted(set(os.listdir(a_dir)) | set(os.listdir(b_dir))):
+        pa, pb = os.path.join(a_dir, name), os.path.join(b_dir, name)
+        if not (os.path.exists(pa) and os.path.exists(pb)):
+            out[name] = [(None, 'file', os.path.exists(pa), os.path.exists(pb))]
+            continue
+        la, lb = _read_lines(pa), _read_lines(pb)
+        diffs = []
+        for i in range(max(len(la), len(lb))):
+            ra = la[i] if i < len(la) else None
+            rb = lb[i] if i < len(lb) else None
+            diffs += [(i, f, x, y) for f, x, y in _diff(ra, rb, tol)]
+        if diffs:
+            out[name] = diffs
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Replay recorded option chains through the window_stats metrics.")
+    ap.add_argument('--symbol', default='NIFTY', help="underlying: picks its history directory and strike step")
+    ap.add_argument('--history', help="HistoryStore root (default: the symbol's directory under %s)" % HISTORY_DIR)
+    ap.add_argument('--days', nargs='*', help="recorded days to replay (default: all)")
+    ap.add_argument('--raw', nargs='*', help="raw NSE payload files (.json / .jsonl, optionally .gz); globs allowed")
+    ap.add_argument('--out', default='data/replay')
+    ap.add_argument('--mode', default='FIXED')
+    ap.add_argument('--atm-window', type=int, default=3)
+    ap.add_argument('--speed', type=float, default=0, help="0 = as fast as possible, N = N x recorded pace")
+    ap.add_argument('--workers', type=int, default=None)
+    ap.add_argument('--compare', nargs=2, metavar=('A', 'B'), help="diff two replay output directories")
+    ap.add_argument('--tol', type=float, default=1e-9)
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.compare:
+        diffs = compare(*args.compare, tol=args.tol)
+        for name, rows in diffs.items():
+            log.info("%s: %d differences", name, len(rows))
+            for line, field, a, b in rows[:20]:
+                log.info("  line %s %s: %r != %r", line, field, a, b)
+        return 1 if diffs else 0
+
+    raw = sorted(p for pattern in (args.raw or []) for p in glob.glob(pattern))
+    for out_path, n, secs in run(args.out, args.days, raw, args.mode, args.atm_window, args.speed,
+                                 args.workers, args.history or history_root(args.symbol), strike_step(args.symbol)):
+        log.info("%s: %d snapshots in %.2fs (%.0f/s)", out_path, n, secs, n / secs if secs else 0)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
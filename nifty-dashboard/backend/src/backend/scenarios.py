@@ -0,0 +1,228 @@
+# scenarios.py
+"""
+P&L and greeks of a multi-leg option position over a scenario cube of
+days elapsed x IV shift x spot level.
+
+    legs = [{'strike': 25000, 'type': 'CE', 'expiry': '2025-09-23', 'qty': -1},
+            {'strike': 25000, 'type': 'PE', 'expiry': '2025-09-23', 'qty': -1}]
+    out = scenario_grid(resolve_legs(legs, snap), spot=25327.05, lot=65)
+
+Legs without an entry `price` take the chain's mid (bid/ask, falling back
+to the last price, as greeks.market_price); legs without an `iv` (percent) take the one implied by
+that mid, or NSE's where it cannot be solved, so the unmoved scenario marks
+the position to market. `qty` is in lots, negative for short legs.
+
+Every leg is priced at every cube point in one broadcast pass (Black-Scholes,
+no dividend yield, same formulas as greeks.bs_greeks_batch). Log-moneyness,
+vol and time are kept on their own small axes and only combined into the
+full (days, iv, spot, leg) cube for d1, d2 and their normal cdf/pdf; the
+legs are then summed per scenario by batched matmuls. Where a scenario
+leaves no time (or vol), a leg is worth its intrinsic value as in
+greeks.bs_price, with the 0/1 delta and zero other greeks of the scalar
+functions.
+"""
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+from backend.greeks import implied_vol_batch, market_price, npdf, valuation_time, years_to_expiry, RISK_FREE_RATE
+from backend import metrics
+
+GREEKS = ('delta', 'gamma', 'theta', 'vega')
+# default axes: spot moves as fractions of spot, IV shifts in vol points, calendar days elapsed
+SPOT_MOVES = np.linspace(-0.10, 0.10, 41)
+IV_SHIFTS = np.array([-5.0, -2.5, 0.0, 2.5, 5.0])
+DAYS = np.array([0.0, 1.0, 2.0, 3.0, 5.0])
+# requests are rejected beyond these sizes (cube cells = grid points x legs)
+MAX_LEGS = 20
+MAX_CELLS = 4_000_000
+# shifted IVs are floored here (percent) rather than going to zero or below
+MIN_IV = 0.5
+
+
+def _option_call(kind):
+    kind = str(kind).upper()
+    if kind in ('CE', 'CALL', 'C'):
+        return True
+    if kind in ('PE', 'PUT', 'P'):
+        return False
+    raise ValueError("leg type must be CE or PE, got %r" % kind)
+
+
+def resolve_legs(legs, snap, now=None, r=RISK_FREE_RATE):
+    """
+    Leg specs (see the module docstring) as arrays: strike, call, qty,
+    t (years to expiry at `now`, default the snapshot time), iv (percent)
+    and entry price. IVs are implied with spot as the underlying, as
+    greeks.chain_greeks does. Raises ValueError for malformed legs or legs the
+    snapshot has no quote for.
+    """
+    if not isinstance(legs, list) or not legs:
+        raise ValueError("legs must be a non-empty list")
+    if len(legs) > MAX_LEGS:
+        raise ValueError("at most %d legs" % MAX_LEGS)
+    if now is None:
+        now = valuation_time(snap)
+    spot = snap['chain'].spot
+
+    n = len(legs)
+    strike, qty, iv, price = np.empty(n), np.empty(n), np.full(n, np.nan), np.full(n, np.nan)
+    call = np.empty(n, dtype=bool)
+    expiries, mkt, nse_iv = [], np.full(n, np.nan), np.full(n, np.nan)
+    for i, leg in enumerate(legs):
+        if not isinstance(leg, dict):
+            raise ValueError("leg %d must be an object" % i)
+        try:
+            strike[i] = float(leg['strike'])
+            qty[i] = float(leg.get('qty', 1))
+            if not (strike[i] > 0 and np.isfinite(strike[i]) and np.isfinite(qty[i])):
+                raise ValueError("strike must be positive and qty finite")
+            call[i] = _option_call(leg['type'])
+            expiry = pd.Timestamp(leg['expiry']).strftime('%Y-%m-%d')
+            if leg.get('price') is not None:
+                price[i] = float(leg['price'])
+            if leg.get('iv') is not None:
+                iv[i] = float(leg['iv'])
+        except KeyError as e:
+            raise ValueError("leg %d is missing %s" % (i, e))
+        except (TypeError, ValueError) as e:
+            raise ValueError("leg %d: %s" % (i, e))
+        expiries.append(expiry)
+        if not (np.isfinite(price[i]) and np.isfinite(iv[i])):
+            rows = snap['expiries'].get(expiry)
+            row = None if rows is None else rows[(rows['strike'] == strike[i]) & (rows['optionType'] == ('CE' if call[i] else 'PE'))]
+            if row is None or row.empty:
+                raise ValueError("no %s %s %g quote in the snapshot; give price and iv" % (expiry, 'CE' if call[i] else 'PE', strike[i]))
+            mkt[i] = market_price(row[:1])[0]
+            nse_iv[i] = float(row['impliedVolatility'].iloc[0])
+            if not np.isfinite(price[i]):
+                price[i] = mkt[i]
+
+    t = years_to_expiry(pd.Series(pd.to_datetime(expiries)), now)
+    solve = ~np.isfinite(iv)
+    if solve.any():
+        iv[solve] = implied_vol_batch(mkt[solve], spot, strike[solve], r, t[solve], call[solve]) * 100.0
+        iv = np.where(np.isfinite(iv) | ~(nse_iv > 0), iv, nse_iv)
+    bad = np.flatnonzero(~np.isfinite(iv) & (t > 0))
+    if len(bad):
+        raise ValueError("no IV for leg(s) %s; give iv" % ", ".join(map(str, bad)))
+    return {'strike': strike, 'call': call, 'qty': qty, 'expiry': expiries, 't': t,
+            'iv': np.nan_to_num(iv), 'price': price}
+
+
+@metrics.timed_fn('scenario_cube')
+def position_cube(S, K, call, qty, t, iv, iv_shifts=(0.0,), days=(0.0,), r=RISK_FREE_RATE, greeks=GREEKS):
+    """
+    Value (sum of qty * option price) and `greeks` (units as
+    bs_greeks_batch, summed the same way) of a position at every scenario:
+    arrays of shape (days, iv_shifts, S).
+
+    S: spot levels; K, call, qty, t (years), iv (percent): per leg;
+    iv_shifts in vol points; days in calendar days elapsed.
+    """
+    S1 = np.asarray(S, dtype=float)
+    S = S1[None, None, :, None]
+    K = np.asarray(K, dtype=float)
+    call = np.asarray(call, dtype=bool)
+    sgn = np.where(call, 1.0, -1.0)
+    days = np.asarray(days, dtype=float)[:, None, None, None]
+    t = np.maximum(np.asarray(t, dtype=float) - days / 365.0, 0.0)                        # (d, 1, 1, l)
+    v = np.maximum(np.asarray(iv, dtype=float) + np.asarray(iv_shifts, dtype=float)[None, :, None, None],
+                   MIN_IV) / 100.0                                                       # (1, i, 1, l)
+    live = (t > 0) & (v > 0)                                                             # (d, i, 1, l)
+    ts = np.where(live, t, 1.0)
+    sqrt_t = np.sqrt(ts)
+    vst = v * sqrt_t
+    kdf = K * np.exp(-r * ts)
+    log_sk = np.log(S) - np.log(K)                                                       # (1, 1, s, l)
+
+    def cols(*weights):
+        # per-leg weights of one (days, iv) scenario as the columns of a (d, i, l, n) matrix, so that
+        # cube @ cols(...) sums the legs of every scenario in one batched matmul
+        return np.stack([np.broadcast_to(w, live.shape)[:, :, 0, :] for w in weights], axis=-1)
+
+    # legs past expiry (or without vol) get zero weight here and their intrinsic value below
+    u = np.where(live, np.asarray(qty, dtype=float), 0.0)
+    su = sgn * u
+
+    d1 = log_sk + (r + 0.5 * v * v) * ts
+    d1 /= vst
+    d2 = d1 - vst
+    # puts from the call formulas via N(-d); the pdf below is even, so d1 keeps the flipped sign
+    d1 *= sgn
+    d2 *= sgn
+    delta = (ndtr(d1) @ cols(su))[..., 0]
+    kn2 = (ndtr(d2) @ cols(su * kdf))[..., 0]
+    out = {'value': S1 * delta - kn2}
+    if 'delta' in greeks:
+        out['delta'] = delta
+    if {'gamma', 'theta', 'vega'} & set(greeks):
+        g, vega, th = np.moveaxis(npdf(d1) @ cols(u / vst, u * sqrt_t, u * v / sqrt_t), -1, 0)
+        if 'gamma' in greeks:
+            out['gamma'] = g / S1
+        if 'theta' in greeks:
+            out['theta'] = (-0.5 * S1 * th - r * kn2) / 365.0
+        if 'vega' in greeks:
+            out['vega'] = S1 / 100.0 * vega
+
+    if not live.all():
+        dead = np.where(live, 0.0, np.asarray(qty, dtype=float))
+        intrinsic = np.maximum(sgn * (S - K), 0.0)
+        out['value'] = out['value'] + (intrinsic @ cols(dead))[..., 0]
+        if 'delta' in greeks:
+            out['delta'] = out['delta'] + (np.where(call & (S > K), 1.0, 0.0) @ cols(dead))[..., 0]
+    return out
+
+
+def _axis(spec, default):
+    # a list of values, or {'min', 'max', 'points'} for an evenly spaced axis
+    if spec is None:
+        return np.asarray(default, dtype=float)
+    if isinstance(spec, dict):
+        try:
+            lo, hi, n = float(spec['min']), float(spec['max']), int(spec['points'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("axis must be a list or {min, max, points}")
+        if not 1 <= n <= MAX_CELLS or not (np.isfinite(lo) and np.isfinite(hi)):
+            raise ValueError("axis must have 1 to %d finite points" % MAX_CELLS)
+        return np.linspace(lo, hi, n)
+    try:
+        a = np.asarray(spec, dtype=float).ravel()
+    except (TypeError, ValueError):
+        raise ValueError("axis values must be numbers")
+    if not len(a) or not np.isfinite(a).all():
+        raise ValueError("axis values must be finite numbers")
+    return a
+
+
+def scenario_grid(legs, spot, spot_moves=None, iv_shifts=None, days=None, lot=1, r=RISK_FREE_RATE, greeks=GREEKS):
+    """
+    Position P&L (rupees, vs the legs' entry prices) and aggregate greeks
+    over the scenario cube, for resolve_legs output held `lot` units per
+    lot of qty.
+
+    Axes are lists or {'min', 'max', 'points'}: `spot_moves` as fractions
+    of `spot`, `iv_shifts` in vol points, `days` elapsed. Returns the axes
+    and arrays of shape (days, iv_shifts, spot_moves).
+    """
+    moves = _axis(spot_moves, SPOT_MOVES)
+    shifts = _axis(iv_shifts, IV_SHIFTS)
+    elapsed = _axis(days, DAYS)
+    if (moves <= -1).any() or (elapsed < 0).any():
+        raise ValueError("spot moves must be above -100% and days elapsed non-negative")
+    unknown = set(greeks) - set(GREEKS)
+    if unknown:
+        raise ValueError("unknown greeks %s; choose from %s" % (", ".join(sorted(unknown)), ", ".join(GREEKS)))
+    cells = len(moves) * len(shifts) * len(elapsed) * len(legs['strike'])
+    if cells > MAX_CELLS:
+        raise ValueError("scenario cube too large (%d cells, max %d)" % (cells, MAX_CELLS))
+
+    levels = spot * (1.0 + moves)
+    cube = position_cube(levels, legs['strike'], legs['call'], legs['qty'], legs['t'], legs['iv'], shifts, elapsed, r, greeks)
+    out = {
+        'spot_moves': moves, 'spot': levels, 'iv_shifts': shifts, 'days': elapsed,
+        # P&L vs entry: sum over legs of qty * lot * (scenario price - entry price)
+        'pnl': lot * (cube['value'] - float(legs['qty'] @ legs['price'])),
+    }
+    for name in greeks:
+        out[name] = lot * cube[name]
+    return out
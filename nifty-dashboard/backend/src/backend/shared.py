@@ -0,0 +1,340 @@
+# shared.py
+"""
+Option-chain snapshots shared between processes through memory-mapped files.
+
+The ingest process (`python -m backend.ingest`) is the only one talking to
+NSE; it publishes every new snapshot of every underlying, and the WSGI
+worker processes (app_api with NSE_SHARED_SNAPSHOTS=1) map them read-only:
+
+    <NSE_SHM_DIR>/nifty-<SYMBOL>.hdr             header: seq, version, nbytes, fetched_at
+    <NSE_SHM_DIR>/nifty-<SYMBOL>-<version>.snap  one immutable file per version
+
+A version file is a JSON meta block (ts, fetched_at, extras, latest candle,
+column layout) followed by the normalized chain's columns as raw arrays,
+64-byte aligned. Readers wrap the numeric columns with np.frombuffer and
+build their DataFrame on top of the mapped pages without copying them.
+
+Version files are written completely (and renamed into place) before the
+header points at them, and never change afterwards. The writer unlinks all
+but the newest `keep`; a worker that already mapped one keeps valid pages
+until it drops it. The header itself is a seqlock: `seq` is odd while the
+writer updates it and readers retry until they read the same even `seq`
+before and after the fields.
+
+Only snapshots are shared. State a worker derives from them by itself
+stays per worker. The intraday ChainRing behind /api/nifty/pcr_history and
+/api/nifty/oi_history, for one, starts empty when the worker starts and
+misses versions the worker did not pick up. So two workers can answer
+those endpoints with different samples.
+"""
+import json, logging, mmap, os, struct, tempfile, threading, time
+from collections import deque
+import numpy as np
+import pandas as pd
+from backend.fetcher import SYMBOLS
+from backend.snapshot import POLL_INTERVAL, SNAPSHOT_TTL, chain_views, notify
+from backend import metrics
+
+log = logging.getLogger(__name__)
+
+SHM_DIR = os.environ.get("NSE_SHM_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+# version files kept per underlying for workers that are a few versions behind
+KEEP_VERSIONS = int(os.environ.get("NSE_SHM_KEEP", 4))
+# how often workers look for a new version (seconds); a header check is a few struct reads
+WATCH_INTERVAL = float(os.environ.get("NSE_SHM_WATCH", 0.1))
+
+HEADER = struct.Struct('<QQQd')     # seq, version, nbytes, fetched_at
+HEADER_SIZE = 4096
+ALIGN = 64
+_U64 = struct.Struct('<Q')
+
+
+def _paths(root, symbol, version=None):
+    if version is None:
+        return os.path.join(root, "nifty-%s.hdr" % symbol)
+    return os.path.join(root, "nifty-%s-%d.snap" % (symbol, version))
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _encode_frame(df):
+    # column layout for the meta block plus the arrays to write, in order
+    layout, arrays, offset = [], [], 0
+    for name in df.columns:
+        col = df[name]
+        entry = {'name': name}
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            cats = col.cat.categories
+            a = col.cat.codes.to_numpy()
+            if cats.dtype.kind == 'M':
+                entry['categories'] = {'dtype': str(cats.dtype), 'values': cats.asi8.tolist()}
+            else:
+                entry['categories'] = {'dtype': None, 'values': [str(c) for c in cats]}
+        else:
+            a = np.ascontiguousarray(col.to_numpy())
+        entry.update(dtype=a.dtype.str, offset=offset, count=len(a))
+        layout.append(entry)
+        arrays.append(a)
+        offset = _aligned(offset + a.nbytes)
+    return layout, arrays, offset
+
+
+def _decode_frame(buf, base, layout):
+    cols = {}
+    for entry in layout:
+        a = np.frombuffer(buf, dtype=np.dtype(entry['dtype']), count=entry['count'], offset=base + entry['offset'])
+        cats = entry.get('categories')
+        if cats is not None:
+            values = cats['values'] if cats['dtype'] is None else np.array(cats['values'], dtype='int64').view(cats['dtype'])
+            a = pd.Categorical.from_codes(a, categories=pd.Index(values))
+        cols[entry['name']] = a
+    return pd.DataFrame(cols, copy=False)
+
+
+class SnapshotWriter:
+    """
+    Ingest side: SnapshotService listener publishing each snapshot of one
+    underlying. Versions continue from whatever the header already holds,
+    so workers see them increase across ingest restarts.
+
+    `candle(symbol)`, when given, is stored with the snapshot (the ingest
+    process owns the candles; workers read the latest bar from here).
+    """
+
+    def __init__(self, symbol, root=SHM_DIR, keep=KEEP_VERSIONS, candle=None):
+        self.symbol = symbol
+        self.root = root
+        self.keep = max(1, keep)
+        self.candle = candle
+        os.makedirs(root, exist_ok=True)
+        path = _paths(root, symbol)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < HEADER_SIZE:
+                os.ftruncate(fd, HEADER_SIZE)
+            self._header = mmap.mmap(fd, HEADER_SIZE)
+        finally:
+            os.close(fd)
+        seq, version, _, _ = HEADER.unpack_from(self._header, 0)
+        # odd: a previous writer died mid-update (its version is still a valid base)
+        self._seq = seq + (seq & 1)
+        self._base = version
+        # files left by a previous run are pruned like our own
+        prefix, old = "nifty-%s-" % symbol, []
+        for name in os.listdir(root):
+            if name.startswith(prefix) and name.endswith(".snap") and name[len(prefix):-5].isdigit():
+                old.append((int(name[len(prefix):-5]), os.path.join(root, name)))
+        self._files = deque(path for _, path in sorted(old))
+
+    @metrics.timed_fn('shm_publish')
+    def publish(self, snap):
+        version = self._base + snap['version']
+        layout, arrays, size = _encode_frame(snap['df'])
+        meta = json.dumps({
+            'version': version, 'symbol': self.symbol, 'ts': snap['ts'], 'fetched_at': snap['fetched_at'],
+            'extras': snap['extras'], 'candle': self.candle(self.symbol) if self.candle else None,
+            'columns': layout,
+        }, default=str).encode()
+        base = _aligned(_U64.size + len(meta))
+        path = _paths(self.root, self.symbol, version)
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(_U64.pack(len(meta)) + meta)
+            for entry, a in zip(layout, arrays):
+                f.seek(base + entry['offset'])
+                f.write(a.tobytes())
+            f.truncate(base + size)
+        os.replace(tmp, path)
+
+        self._seq += 1
+        _U64.pack_into(self._header, 0, self._seq)     # odd: update in progress
+        HEADER.pack_into(self._header, 0, self._seq, version, base + size, snap['fetched_at'])
+        self._seq += 1
+        _U64.pack_into(self._header, 0, self._seq)
+
+        self._files.append(path)
+        while len(self._files) > self.keep:
+            try:
+                os.unlink(self._files.popleft())
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        self._header.close()
+
+
+def read_header(header, retries=1000):
+    """(version, nbytes, fetched_at) from a mapped header, consistent under the seqlock."""
+    for _ in range(retries):
+        seq = HEADER.unpack_from(header, 0)[0]
+        if seq & 1:
+            time.sleep(0)
+            continue
+        _, version, nbytes, fetched_at = HEADER.unpack_from(header, 0)
+        if HEADER.unpack_from(header, 0)[0] == seq:
+            return version, nbytes, fetched_at
+    raise RuntimeError("shared snapshot header kept changing while being read")
+
+
+class SnapshotReader:
+    """
+    Worker side: one underlying's published snapshots behind the
+    SnapshotService interface (get/latest/meta/subscribe), so app_api
+    serves them unchanged.
+
+    A worker never fetches: when the ingest process stops publishing,
+    snapshots simply age past the TTL and are reported stale. Listeners run
+    once per version the worker loads, in version order (versions published
+    while the worker was not looking are skipped).
+    """
+
+    def __init__(self, symbol, root=SHM_DIR, interval=POLL_INTERVAL, ttl=SNAPSHOT_TTL, scheduler=None):
+        self.symbol = symbol
+        self.root = root
+        self.interval = interval
+        self.ttl = ttl
+        self.scheduler = scheduler
+        self._header = None
+        self._snapshot = None
+        self._last_error = None
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def subscribe(self, fn):
+        self._listeners.append(fn)
+
+    def _open_header(self):
+        if self._header is None:
+            try:
+                with open(_paths(self.root, self.symbol), 'rb') as f:
+                    self._header = mmap.mmap(f.fileno(), HEADER_SIZE, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                return None
+        return self._header
+
+    def _load(self, version, nbytes):
+        with open(_paths(self.root, self.symbol, version), 'rb') as f:
+            buf = mmap.mmap(f.fileno(), nbytes, access=mmap.ACCESS_READ)
+        n = _U64.unpack_from(buf, 0)[0]
+        meta = json.loads(bytes(buf[_U64.size:_U64.size + n]))
+        df = _decode_frame(buf, _aligned(_U64.size + n), meta['columns'])
+        chain, expiries = chain_views(df)
+        return {
+            'version': version,
+            'symbol': self.symbol,
+            'ts': meta['ts'],
+            'fetched_at': meta['fetched_at'],
+            'raw': None,
+            'extras': meta['extras'],
+            'df': df,
+            'chain': chain,
+            'expiries': expiries,
+            'candle': meta['candle'],
+        }
+
+    def refresh(self):
+        """Load the newest published version if it is not the current one; returns the current snapshot."""
+        with self._lock:
+            header = self._open_header()
+            if header is None:
+                return self._snapshot
+            for _ in range(3):
+                version, nbytes, _ = read_header(header)
+                if version == 0 or (self._snapshot is not None and self._snapshot['version'] == version):
+                    return self._snapshot
+                try:
+                    with metrics.timed('shm_load'):
+                        snap = self._load(version, nbytes)
+                    break
+                except FileNotFoundError:
+                    # unlinked by the writer after newer versions landed: retry with the header's latest
+                    continue
+            else:
+                return self._snapshot
+            self._snapshot = snap
+            self._last_error = None
+            notify(self._listeners, snap)
+            return snap
+
+    def get(self):
+        if self.scheduler is not None:
+            self.scheduler.start()
+        try:
+            snap = self.refresh()
+        except Exception as e:
+            self._last_error = str(e)
+            metrics.error('shm_read')
+            log.exception("reading shared snapshot for %s failed", self.symbol)
+            snap = self._snapshot
+        if snap is None:
+            raise RuntimeError("no snapshot published for %s yet (is backend.ingest running?)" % self.symbol)
+        return snap
+
+    def latest(self):
+        return self._snapshot
+
+    def age(self, snap):
+        return time.time() - snap['fetched_at']
+
+    def meta(self, snap):
+        age = self.age(snap)
+        return {
+            'version': snap['version'],
+            'ts': snap['ts'],
+            'age': round(age, 3),
+            'ttl': self.ttl,
+            'stale': age > self.ttl,
+            'error': self._last_error,
+        }
+
+
+class SharedSnapshots:
+    """
+    SnapshotGroup counterpart for worker processes: a SnapshotReader per
+    underlying plus one watcher thread that loads new versions as they are
+    published, so listeners (intraday ring, streams) see them without a
+    request having to arrive first.
+    """
+
+    def __init__(self, symbols=SYMBOLS, root=SHM_DIR, interval=POLL_INTERVAL, ttl=SNAPSHOT_TTL, watch=WATCH_INTERVAL):
+        self.symbols = tuple(symbols)
+        self.interval = interval
+        self.watch = watch
+        self.services = {s: SnapshotReader(s, root, interval, ttl, scheduler=self) for s in self.symbols}
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._poller = None
+
+    def __getitem__(self, symbol):
+        return self.services[symbol]
+
+    def __iter__(self):
+        return iter(self.services.values())
+
+    def start(self):
+        if self._poller is not None:
+            return
+        with self._start_lock:
+            if self._poller is not None:
+                return
+            self._stop.clear()
+            self._poller = threading.Thread(target=self._poll, name="shm-snapshot-watcher", daemon=True)
+            self._poller.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join(timeout=5)
+        self._poller = None
+
+    def _poll(self):
+        while not self._stop.is_set():
+            for reader in self.services.values():
+                try:
+                    reader.refresh()
+                except Exception:
+                    metrics.error('shm_read')
+                    log.exception("reading shared snapshot for %s failed", reader.symbol)
+            self._stop.wait(self.watch)
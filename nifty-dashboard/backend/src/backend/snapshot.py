@@ -0,0 +1,279 @@
+# snapshot.py
+import os, time, threading, logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
+from datetime import datetime
+from backend.fetcher import fetch_nse_bundle, normalize_nse_json, LEG_FIELDS, SYMBOLS
+from backend.chainframe import ChainFrame
+from backend import metrics
+
+log = logging.getLogger(__name__)
+
+# seconds between background refreshes (0 disables the poller: fetch on demand)
+POLL_INTERVAL = float(os.environ.get("NSE_POLL_INTERVAL", 3))
+# a snapshot older than this is reported as stale (and refetched on demand when not polling)
+SNAPSHOT_TTL = float(os.environ.get("NSE_SNAPSHOT_TTL", 15))
+# refreshes of different underlyings allowed in flight at once
+INGEST_WORKERS = int(os.environ.get("NSE_INGEST_WORKERS", 4))
+
+KEY_COLUMNS = ('expiry', 'strike', 'optionType')
+VALUE_COLUMNS = tuple(name for name, _, _ in LEG_FIELDS)
+
+
+def diff_chain(prev_df, df):
+    """
+    Boolean mask over df's rows whose values differ from prev_df.
+
+    Both frames come from normalize_nse_json and are sorted by key. Returns
+    None when the (expiry, strike, optionType) layout changed, in which case
+    callers should send the whole chain.
+    """
+    if prev_df is None or len(prev_df) != len(df):
+        return None
+    for c in KEY_COLUMNS:
+        if not np.array_equal(prev_df[c].to_numpy(), df[c].to_numpy()):
+            return None
+    changed = np.zeros(len(df), dtype=bool)
+    for c in VALUE_COLUMNS:
+        changed |= prev_df[c].to_numpy() != df[c].to_numpy()
+    return changed
+
+
+def chain_views(df):
+    """(ChainFrame, {'YYYY-MM-DD': rows of df}) for a normalized frame, split per expiry once."""
+    with metrics.timed('chainframe'):
+        chain = ChainFrame.from_df(df)
+    with metrics.timed('expiry_pivot'):
+        chain.by_expiry
+        expiries = {key: df.iloc[a:b] for key, (a, b) in chain.expiry_rows.items()}
+    return chain, expiries
+
+
+def notify(listeners, snap):
+    """Run snapshot listeners in order; a failing one is logged and does not stop the rest."""
+    for fn in listeners:
+        try:
+            with metrics.timed('listener:' + getattr(fn, '__qualname__', repr(fn))):
+                fn(snap)
+        except Exception:
+            metrics.error('snapshot_listener')
+            log.exception("snapshot listener %r failed", fn)
+
+
+class SnapshotService:
+    """
+    Latest normalized option chain, shared by every endpoint.
+
+    A single background poller refreshes the chain every `interval` seconds.
+    Callers that need a fetch while one is already running wait for it and
+    share its result instead of issuing their own NSE request. Each
+    successful refresh produces a new snapshot dict with a bumped `version`:
+
+        {'version', 'symbol', 'ts', 'fetched_at', 'raw', 'extras', 'df', 'chain', 'expiries'}
+
+    `fetch` returns a bundle {'optionchain': json, <name>: json or None, ...}
+    (see fetcher.fetch_nse_bundle); the other entries land in `extras`.
+    `chain` is the snapshot's ChainFrame, built here once so requests only
+    slice it. The chain is also split per expiry here: `expiries` maps
+    'YYYY-MM-DD' to that expiry's rows of `df`, and `chain.by_expiry` to
+    its ChainFrame.
+
+    When `scheduler` is given (a SnapshotGroup) it runs the polling instead
+    of this service's own thread.
+    """
+
+    def __init__(self, fetch=fetch_nse_bundle, normalize=normalize_nse_json,
+                 interval=POLL_INTERVAL, ttl=SNAPSHOT_TTL, symbol=SYMBOLS[0], scheduler=None):
+        self.fetch = fetch
+        self.normalize = normalize
+        self.interval = interval
+        self.ttl = ttl
+        self.symbol = symbol
+        self.scheduler = scheduler
+        self._snapshot = None
+        self._version = 0
+        self._attempts = 0
+        self._last_error = None
+        self._fetch_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._poller = None
+        self._listeners = []
+
+    def subscribe(self, fn):
+        """
+        Call fn(snapshot) once for every new snapshot version.
+
+        Listeners run in version order on the refreshing thread, before the
+        fetch lock is released, so they should be quick.
+        """
+        self._listeners.append(fn)
+
+    def refresh(self):
+        """Fetch a new snapshot, coalescing with any fetch already in flight."""
+        seen = self._attempts
+        with self._fetch_lock:
+            if self._attempts != seen:
+                # someone else fetched while we waited: share their outcome
+                if self._last_error is not None:
+                    raise RuntimeError(self._last_error)
+                return self._snapshot
+            try:
+                bundle = self.fetch()
+                raw = bundle['optionchain']
+                df = self.normalize(raw)
+                chain, expiries = chain_views(df)
+            except Exception as e:
+                self._last_error = str(e)
+                metrics.error('snapshot_refresh')
+                raise
+            finally:
+                # counted on completion so callers that arrived mid-fetch share it
+                self._attempts += 1
+            self._version += 1
+            self._last_error = None
+            self._snapshot = {
+                'version': self._version,
+                'symbol': self.symbol,
+                'ts': datetime.utcnow().isoformat(),
+                'fetched_at': time.time(),
+                'raw': raw,
+                'extras': {k: v for k, v in bundle.items() if k != 'optionchain'},
+                'df': df,
+                'chain': chain,
+                'expiries': expiries,
+            }
+            notify(self._listeners, self._snapshot)
+            return self._snapshot
+
+    def get(self):
+        """
+        Return the current snapshot without waiting on NSE whenever possible.
+
+        Only the very first call (or an on-demand refresh when the poller is
+        disabled and the snapshot has outlived its TTL) blocks on a fetch. If
+        that refresh fails the previous snapshot is served and flagged stale.
+        """
+        if self.interval > 0:
+            (self.scheduler or self).start()
+        snap = self._snapshot
+        if snap is None:
+            metrics.cache('snapshot', False)
+            return self.refresh()
+        if self.interval <= 0 and self.age(snap) > self.ttl:
+            metrics.cache('snapshot', False)
+            try:
+                return self.refresh()
+            except Exception:
+                log.exception("on-demand snapshot refresh failed, serving stale snapshot")
+            return snap
+        metrics.cache('snapshot', True)
+        return snap
+
+    def latest(self):
+        """The current snapshot or None; never fetches."""
+        return self._snapshot
+
+    def age(self, snap):
+        return time.time() - snap['fetched_at']
+
+    def meta(self, snap):
+        age = self.age(snap)
+        return {
+            'version': snap['version'],
+            'ts': snap['ts'],
+            'age': round(age, 3),
+            'ttl': self.ttl,
+            'stale': age > self.ttl,
+            'error': self._last_error,
+        }
+
+    def start(self):
+        if self._poller is not None:
+            return
+        with self._start_lock:
+            if self._poller is not None:
+                return
+            self._stop.clear()
+            self._poller = threading.Thread(target=self._poll, name="nse-snapshot-poller", daemon=True)
+            self._poller.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join(timeout=5)
+        self._poller = None
+
+    def _poll(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                log.exception("background snapshot refresh failed")
+            self._stop.wait(self.interval)
+
+
+class SnapshotGroup:
+    """
+    One SnapshotService per underlying, polled side by side.
+
+    A single scheduler thread hands each service's refresh to a thread pool
+    of `workers` every `interval` seconds. A service whose previous refresh
+    is still running is skipped for that tick, so one slow underlying never
+    holds up the others or piles up requests against NSE.
+
+    `make_fetch(symbol)` returns the fetch function for that underlying.
+    """
+
+    def __init__(self, symbols=SYMBOLS, make_fetch=None, normalize=normalize_nse_json,
+                 interval=POLL_INTERVAL, ttl=SNAPSHOT_TTL, workers=INGEST_WORKERS):
+        make_fetch = make_fetch or (lambda s: partial(fetch_nse_bundle, symbol=s, extras=(s == symbols[0])))
+        self.symbols = tuple(symbols)
+        self.interval = interval
+        self.workers = max(1, min(workers, len(self.symbols)))
+        self.services = {s: SnapshotService(make_fetch(s), normalize, interval, ttl, symbol=s, scheduler=self)
+                         for s in self.symbols}
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._poller = None
+
+    def __getitem__(self, symbol):
+        return self.services[symbol]
+
+    def __iter__(self):
+        return iter(self.services.values())
+
+    def start(self):
+        if self._poller is not None:
+            return
+        with self._start_lock:
+            if self._poller is not None:
+                return
+            self._stop.clear()
+            self._poller = threading.Thread(target=self._poll, name="nse-snapshot-scheduler", daemon=True)
+            self._poller.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join(timeout=5)
+        self._poller = None
+
+    def _refresh(self, service):
+        try:
+            service.refresh()
+        except Exception:
+            log.exception("background snapshot refresh failed for %s", service.symbol)
+
+    def _poll(self):
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="nse-ingest") as pool:
+            while not self._stop.is_set():
+                for symbol, service in self.services.items():
+                    f = running.get(symbol)
+                    if f is None or f.done():
+                        running[symbol] = pool.submit(self._refresh, service)
+                    else:
+                        metrics.inc('snapshot_refresh_skipped')
+                self._stop.wait(self.interval)
@@ -0,0 +1,130 @@
+# stream.py
+import json, threading
+
+KEEPALIVE = b": keep-alive\n\n"
+
+
+def sse_message(version, data, event="snapshot"):
+    return ("id: %s\nevent: %s\ndata: %s\n\n" % (version, event, data)).encode()
+
+
+class Channel:
+    """
+    Server-Sent Events fan-out for one set of stream parameters.
+
+    For every snapshot version the message is built and serialized once and
+    the same bytes are handed to every subscriber. Two forms exist:
+    a delta against the previous version (built on publish) and a full
+    message (built lazily, for new subscribers and ones that missed a
+    version). Both are built outside `_cond`, so a slow build never holds
+    up subscribers waiting for the next version.
+    """
+
+    def __init__(self, build, encode=json.dumps):
+        self.build = build          # build(snap, prev_snap_or_None) -> dict
+        self.encode = encode
+        self.subscribers = 0
+        self._cond = threading.Condition()
+        self._snap = None
+        self._delta = None
+        self._full = None
+        self._build_lock = threading.Lock()
+
+    def publish(self, snap, prev):
+        delta = None
+        if prev is not None and self.subscribers:
+            delta = sse_message(snap['version'], self.encode(self.build(snap, prev)))
+        with self._cond:
+            self._snap, self._delta, self._full = snap, delta, None
+            self._cond.notify_all()
+
+    def _full_message(self, snap):
+        # one build per version: concurrent callers wait on _build_lock, not _cond
+        with self._build_lock:
+            with self._cond:
+                if self._snap is snap and self._full is not None:
+                    return self._full
+            msg = sse_message(snap['version'], self.encode(self.build(snap, None)))
+            with self._cond:
+                if self._snap is snap:
+                    self._full = msg
+            return msg
+
+    def messages(self, timeout=15.0):
+        """Generator of SSE bytes for one subscriber; yields keep-alives while idle."""
+        with self._cond:
+            self.subscribers += 1
+        last = None
+        try:
+            while True:
+                with self._cond:
+                    if self._snap is None or self._snap['version'] == last:
+                        self._cond.wait(timeout)
+                    snap = self._snap
+                    if snap is None or snap['version'] == last:
+                        msg = KEEPALIVE
+                    else:
+                        v = snap['version']
+                        in_step = last is not None and v == last + 1 and self._delta is not None
+                        msg = self._delta if in_step else None
+                        last = v
+                if msg is None:
+                    msg = self._full_message(snap)
+                yield msg
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+
+class StreamHub:
+    """
+    Channels keyed by stream parameters, fed from SnapshotService.subscribe.
+
+    `make_build(key)` returns the payload builder for a channel; payloads
+    are only built for channels that currently have subscribers, and a
+    channel is dropped when its last subscriber leaves.
+    """
+
+    def __init__(self, make_build, encode=json.dumps):
+        self.make_build = make_build
+        self.encode = encode
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._current = None
+        self._refs = {}
+
+    def channel(self, key):
+        with self._lock:
+            return self._channel(key)
+
+    def _channel(self, key):
+        # caller holds self._lock
+        ch = self._channels.get(key)
+        if ch is None:
+            ch = self._channels[key] = Channel(self.make_build(key), self.encode)
+            if self._current is not None:
+                ch.publish(self._current, None)
+        return ch
+
+    def messages(self, key, timeout=15.0):
+        """Channel.messages of the channel for `key`, which is dropped again with its last subscriber."""
+        # counted when the response starts streaming, so a never-started generator holds nothing
+        with self._lock:
+            ch = self._channel(key)
+            self._refs[key] = self._refs.get(key, 0) + 1
+        try:
+            yield from ch.messages(timeout)
+        finally:
+            with self._lock:
+                self._refs[key] -= 1
+                if not self._refs[key]:
+                    del self._refs[key]
+                    if self._channels.get(key) is ch:
+                        del self._channels[key]
+
+    def publish(self, snap):
+        with self._lock:
+            prev, self._current = self._current, snap
+            channels = list(self._channels.values())
+        for ch in channels:
+            ch.publish(snap, prev)
@@ -0,0 +1,131 @@
+# synth.py
+"""
+Synthetic NSE option-chain payloads for benchmarks and offline runs.
+
+The payloads have the same shape as /api/option-chain-indices: weekly
+expiries, strikes every STRIKE_STEP around spot, Black-Scholes prices
+off an IV smile, open interest peaking near the money and a
+configurable share of legs with zero OI.
+"""
+import json, os
+from datetime import datetime, timedelta
+import numpy as np
+from backend.analytics import STRIKE_STEP
+from backend.greeks import bs_price_batch, RISK_FREE_RATE
+
+IST = timedelta(hours=5, minutes=30)
+
+
+def expiry_dates(n, start=None):
+    """`n` weekly Tuesday expiries from `start` (default: today), NSE formatted ('23-Sep-2025')."""
+    d = (start or datetime.now()).date()
+    d += timedelta(days=(1 - d.weekday()) % 7)
+    return [(d + timedelta(weeks=i)).strftime('%d-%b-%Y') for i in range(n)]
+
+
+class ChainGenerator:
+    """
+    Random-walk option chain. `payload()` returns the current chain as an
+    NSE payload; `step()` moves spot, OI, volume and prices forward one poll.
+
+    strikes    : strikes per expiry, centred on the initial spot
+    expiries   : number of weekly expiries
+    zero_oi    : share of legs reporting zero open interest
+    missing    : share of strikes quoting only one side (CE or PE)
+    """
+
+    def __init__(self, strikes=120, expiries=4, zero_oi=0.2, missing=0.05, spot=25327.05,
+                 step=STRIKE_STEP, seed=1, now=None):
+        self.rng = np.random.default_rng(seed)
+        self.now = now or datetime(2025, 9, 19, 9, 15)
+        self.spot = float(spot)
+        self.expiries = expiry_dates(expiries, self.now)
+        atm = round(spot / step) * step
+        ks = atm + step * (np.arange(strikes) - strikes // 2)
+        ne = len(self.expiries)
+        # legs laid out as (expiry, strike, CE/PE)
+        self.strike = np.tile(np.repeat(ks.astype(float), 2), ne)
+        self.is_put = np.tile([False, True], ne * strikes)
+        self.expiry_idx = np.repeat(np.arange(ne), 2 * strikes)
+        n = len(self.strike)
+        one_sided = np.repeat(self.rng.random(ne * strikes) < missing, 2)
+        kept_side = np.repeat(self.rng.random(ne * strikes) < 0.5, 2)
+        self.present = ~one_sided | (self.is_put == kept_side)
+        self.zero = self.rng.random(n) < zero_oi
+        moneyness = (self.strike - self.spot) / (step * 10)
+        base = self.rng.lognormal(11, 0.6, n) * np.exp(-0.5 * moneyness ** 2)
+        self.oi = np.where(self.zero, 0, np.maximum(base, 1)).astype(np.int64)
+        # previous session's OI, for changeinOpenInterest
+        self.prev_oi = (self.oi * self.rng.uniform(0.8, 1.1, n)).astype(np.int64)
+        self.volume = (self.oi * self.rng.uniform(1, 6, n)).astype(np.int64)
+        self.t_exp = np.array([(datetime.strptime(e, '%d-%b-%Y') + timedelta(hours=15, minutes=30) - self.now)
+                               .total_seconds() for e in self.expiries]) / (365 * 24 * 3600)
+        self._price()
+        self.prev_price = self.price.copy()
+
+    def _price(self):
+        m = np.log(self.strike / self.spot)
+        self.iv = np.round(13 + 40 * m ** 2 - 6 * m + self.rng.normal(0, 0.2, len(m)), 2)
+        t = np.maximum(self.t_exp[self.expiry_idx], 1e-4)
+        px = bs_price_batch(self.spot, self.strike, RISK_FREE_RATE, self.iv / 100, t,
+                            np.where(self.is_put, 'put', 'call'))
+        self.price = np.maximum(np.round(px, 2), 0.05)
+
+    def step(self, seconds=3):
+        """Advance one poll: spot random walk, OI/volume growth on a few legs, repriced premiums."""
+        self.now += timedelta(seconds=seconds)
+        self.spot = round(self.spot * float(np.exp(self.rng.normal(0, 0.0002))), 2)
+        n = len(self.strike)
+        hit = (self.rng.random(n) < 0.05) & ~self.zero
+        self.oi[hit] = np.maximum(self.oi[hit] + self.rng.integers(-500, 1500, hit.sum()), 0)
+        self.volume[hit] += self.rng.integers(0, 5000, hit.sum())
+        self.t_exp -= seconds / (365 * 24 * 3600)
+        self._price()
+
+    def payload(self):
+        rows = {}
+        change = np.round(self.price - self.prev_price, 2)
+        spread = np.maximum(np.round(self.price * 0.002, 2), 0.05)
+        qty = self.rng.integers(0, 5000, (2, len(self.strike)))
+        for i in np.flatnonzero(self.present).tolist():
+            e = self.expiries[self.expiry_idx[i]]
+            k = self.strike[i]
+            d = rows.get((e, k))
+            if d is None:
+                d = rows[(e, k)] = {'strikePrice': int(k), 'expiryDate': e}
+            d['PE' if self.is_put[i] else 'CE'] = {
+                'strikePrice': int(k), 'expiryDate': e,
+                'openInterest': int(self.oi[i]), 'changeinOpenInterest': int(self.oi[i] - self.prev_oi[i]),
+                'totalTradedVolume': int(self.volume[i]), 'impliedVolatility': float(self.iv[i]),
+                'lastPrice': float(self.price[i]), 'change': float(change[i]),
+                'bidQty': int(qty[0, i]), 'bidprice': float(max(self.price[i] - spread[i], 0.05)),
+                'askQty': int(qty[1, i]), 'askPrice': float(self.price[i] + spread[i]),
+                'underlyingValue': self.spot,
+            }
+        return {'records': {
+            'underlyingValue': self.spot,
+            'timestamp': (self.now).strftime('%d-%b-%Y %H:%M:%S'),
+            'expiryDates': list(self.expiries),
+            'data': list(rows.values()),
+        }}
+
+
+def payload(strikes=120, expiries=4, zero_oi=0.2, seed=1, **kw):
+    """One synthetic option-chain payload."""
+    return ChainGenerator(strikes, expiries, zero_oi, seed=seed, **kw).payload()
+
+
+def write_snapshot_log(path, n, start=None, seconds=3, spot=25327.05, seed=1):
+    """
+    Write `n` candles.append_snapshot-style lines ({ts, underlyingPrice,
+    volume_sum}, UTC ts every `seconds`) to `path`.
+    """
+    rng = np.random.default_rng(seed)
+    t = start or datetime(2025, 9, 19, 9, 15) - IST
+    prices = np.round(spot * np.exp(np.cumsum(rng.normal(0, 0.0002, n))), 2)
+    vols = np.cumsum(rng.integers(0, 50000, n)) + 10 ** 8
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        for i in range(n):
+            ts = (t + timedelta(seconds=seconds * i)).isoformat()
+            f.write(json.dumps({'ts': ts, 'underlyingPrice': float(prices[i]), 'volume_sum': int(vols[i])}) + "\n")
@@ -0,0 +1,94 @@
+# ttlcache.py
+"""
+A small TTL cache with stale-while-revalidate, shared by every request
+thread in a process.
+
+    cache = TTLCache('stats', ttl=3, stale=30)
+    body = cache.get(key, compute)
+
+A value younger than `ttl` is served as is. Until `ttl + stale` the old
+value is still served, and one background thread recomputes it. After
+that, or for a new key, the caller computes it; concurrent callers for the
+same key wait for that one computation instead of repeating it.
+
+Values `cacheable(value)` rejects (e.g. an upstream "no data" answer) are
+returned to the caller but not stored, so the next request tries again; a
+stale value they would have replaced keeps being served.
+"""
+import logging, os, threading, time
+from backend import metrics
+
+log = logging.getLogger(__name__)
+
+# seconds a response is fresh / may still be served while it is recomputed
+STATS_TTL = float(os.environ.get("NSE_STATS_TTL", 3))
+STATS_STALE = float(os.environ.get("NSE_STATS_STALE", 30))
+
+
+class TTLCache:
+    def __init__(self, name, ttl=STATS_TTL, stale=STATS_STALE, cacheable=None):
+        self.name = name
+        self.ttl = ttl
+        self.stale = stale
+        self.cacheable = cacheable
+        self._entries = {}      # key -> (value, stored_at)
+        self._locks = {}        # key -> lock held while computing it
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _compute(self, key, compute):
+        value = compute()
+        if self.cacheable is not None and not self.cacheable(value):
+            metrics.inc(self.name + '_uncached')
+            return value
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+        return value
+
+    def _revalidate(self, key, compute):
+        try:
+            with self._key_lock(key):
+                self._compute(key, compute)
+        except Exception:
+            metrics.error('ttl_revalidate')
+            log.exception("%s: background refresh of %r failed, serving the stale value", self.name, key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, key, compute):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, stored = entry
+            age = time.monotonic() - stored
+            if age <= self.ttl:
+                metrics.cache(self.name, True)
+                return value
+            if age <= self.ttl + self.stale:
+                metrics.cache(self.name, True)
+                with self._lock:
+                    start = key not in self._refreshing
+                    self._refreshing.add(key)
+                if start:
+                    metrics.inc(self.name + '_revalidations')
+                    threading.Thread(target=self._revalidate, args=(key, compute),
+                                     name="%s-revalidate" % self.name, daemon=True).start()
+                return value
+        metrics.cache(self.name, False)
+        with self._key_lock(key):
+            # someone else may have computed it while we waited
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+                return entry[0]
+            return self._compute(key, compute)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,243 @@
+# volsurface.py
+"""
+Implied-volatility smiles per expiry and a total-variance surface across them.
+
+Each expiry's smile is a weighted least-squares polynomial in log-moneyness
+k = ln(K / F) fitted to total variance w = iv^2 * t, over the
+out-of-the-money legs (puts below the forward, calls above). NSE's
+`impliedVolatility` is used where it is reported; legs quoted with zero IV
+get one solved from their price (greeks.fill_iv). All expiries
+are fitted in one pass: the normal equations are accumulated with
+bincount and solved as one stacked pseudo-inverse.
+
+Between expiries the surface interpolates total variance linearly in time
+at fixed moneyness; before the first and after the last fitted expiry the
+volatility of that smile is held flat.
+"""
+import threading
+import numpy as np
+import pandas as pd
+from scipy.special import ndtri
+from backend.greeks import fill_iv, valuation_time, years_to_expiry, RISK_FREE_RATE
+from backend import metrics
+
+# polynomial degree of each smile in k
+SMILE_DEGREE = 2
+# only legs with |k| <= FIT_BAND * sqrt(t) (roughly +-4 sd at 50% vol) enter the fit
+FIT_BAND = 2.0
+# IVs outside this range (percent) are treated as bad quotes
+MIN_IV, MAX_IV = 1.0, 300.0
+# |d1| of a 25-delta option
+D25 = float(ndtri(0.75))
+# surface grid returned by to_dict: K/F and constant maturities in days
+MONEYNESS = tuple(np.round(np.arange(0.90, 1.1001, 0.01), 2).tolist())
+TENOR_DAYS = (7, 14, 30, 60, 90)
+
+
+def _horner(coef, k):
+    # sum_j coef[..., j] * k ** j, coef rows broadcast against k
+    out = np.zeros(np.broadcast_shapes(coef.shape[:-1], np.shape(k)))
+    for j in range(coef.shape[-1] - 1, -1, -1):
+        out = out * k + coef[..., j]
+    return out
+
+
+class VolSurface:
+    """
+    Fitted smiles for one snapshot (see the module docstring).
+
+    Per expiry (sorted by date): `expiries` ('YYYY-MM-DD'), `t` (years),
+    `forward`, `coef` (polynomial in k for total variance, NaN when there
+    were too few legs to fit) and the legs that went into the fit.
+    """
+
+    def __init__(self, expiries, t, forward, coef, points, spot=None, now=None):
+        self.expiries = expiries
+        self.t = t
+        self.forward = forward
+        self.coef = coef
+        self.points = points
+        self.spot = spot
+        self.now = now
+        self.fitted = np.isfinite(coef).all(axis=1) & (t > 0)
+
+    @classmethod
+    def fit(cls, df, now=None, r=RISK_FREE_RATE, degree=SMILE_DEGREE):
+        """
+        Fit every expiry of a normalize_nse_json frame.
+
+        `now` is the valuation time in IST (default: current time); forwards
+        are spot * exp(r * t).
+        """
+        now = valuation_time() if now is None else pd.Timestamp(now)
+        n_coef = degree + 1
+        if df is None or df.empty:
+            empty = np.empty(0)
+            return cls([], empty, empty, np.empty((0, n_coef)), {}, None, now)
+
+        codes, uniques = pd.factorize(df['expiry'], sort=True)
+        expiries = [pd.Timestamp(e).strftime('%Y-%m-%d') for e in uniques]
+        t_exp = years_to_expiry(pd.Series(np.asarray(uniques)), now)
+        spot = float(np.median(df['underlyingPrice'].to_numpy(dtype=float)))
+        fwd_exp = spot * np.exp(r * np.maximum(t_exp, 0.0))
+
+        K = df['strike'].to_numpy(dtype=float)
+        call = (df['optionType'] == 'CE').to_numpy()
+        t = t_exp[codes]
+        fwd = fwd_exp[codes]
+        k = np.log(K / fwd)
+        otm = np.where(call, K >= fwd, K < fwd) & (t > 0) & (codes >= 0)
+
+        solved = otm & ~(df['impliedVolatility'].to_numpy(dtype=float) > 0)
+        iv = fill_iv(df, spot, t, r, where=otm)
+
+        use = otm & np.isfinite(iv) & (iv > MIN_IV) & (iv < MAX_IV) & (np.abs(k) <= FIT_BAND * np.sqrt(np.maximum(t, 0)))
+        e, k_u, t_u = codes[use], k[use], t[use]
+        w = (iv[use] / 100.0) ** 2 * t_u
+        weight = np.sqrt(df['OI'].to_numpy(dtype=float)[use] + df['volume'].to_numpy(dtype=float)[use] + 1.0)
+
+        # weighted normal equations per expiry: A[e, j, l] = sum(weight * k^(j+l)), b[e, j] = sum(weight * k^j * w)
+        n_exp = len(expiries)
+        kp = np.ones_like(k_u)
+        moments, rhs = [], []
+        for p in range(2 * degree + 1):
+            moments.append(np.bincount(e, weights=weight * kp, minlength=n_exp))
+            if p < n_coef:
+                rhs.append(np.bincount(e, weights=weight * kp * w, minlength=n_exp))
+            kp = kp * k_u
+        moments = np.stack(moments, axis=1)
+        idx = np.add.outer(np.arange(n_coef), np.arange(n_coef))
+        A = moments[:, idx]
+        b = np.stack(rhs, axis=1)
+        coef = (np.linalg.pinv(A) @ b[:, :, None])[:, :, 0]
+        counts = np.bincount(e, minlength=n_exp)
+        coef[counts < n_coef] = np.nan
+
+        points = {'expiry': e, 'strike': K[use], 'k': k_u, 'iv': iv[use], 'solved': solved[use]}
+        return cls(expiries, t_exp, fwd_exp, coef, points, spot, now)
+
+    def total_variance(self, k, i):
+        """Fitted total variance at log-moneyness `k` on expiry index/indices `i` (floored at zero)."""
+        return np.maximum(_horner(self.coef[i], k), 0.0)
+
+    def smile_iv(self, k, i):
+        """Fitted IV in percent at log-moneyness `k` on expiry index/indices `i`."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(self.total_variance(k, i) / self.t[i]) * 100.0
+
+    def _delta_strikes(self):
+        # log-moneyness of the 25-delta call and put per expiry: fixed-point on k = w(k)/2 -+ d1 * sqrt(w(k))
+        i = np.arange(len(self.expiries))
+        w0 = self.total_variance(0.0, i)
+        kc = w0 / 2 + D25 * np.sqrt(w0)
+        kp = w0 / 2 - D25 * np.sqrt(w0)
+        for _ in range(30):
+            wc, wp = self.total_variance(kc, i), self.total_variance(kp, i)
+            kc = wc / 2 + D25 * np.sqrt(wc)
+            kp = wp / 2 - D25 * np.sqrt(wp)
+        return kc, kp
+
+    def term_structure(self):
+        """Per expiry: ATM IV (at the forward), 25-delta risk reversal and butterfly, all in vol points."""
+        if not len(self.expiries):
+            return []
+        i = np.arange(len(self.expiries))
+        atm = self.smile_iv(0.0, i)
+        kc, kp = self._delta_strikes()
+        call25, put25 = self.smile_iv(kc, i), self.smile_iv(kp, i)
+        rr = call25 - put25
+        bf = (call25 + put25) / 2 - atm
+        n_points = np.bincount(self.points['expiry'], minlength=len(i))
+        n_solved = np.bincount(self.points['expiry'], weights=self.points['solved'], minlength=len(i))
+        out = []
+        for j, key in enumerate(self.expiries):
+            ok = bool(self.fitted[j])
+            out.append({
+                'expiry': key, 'days': round(float(self.t[j]) * 365.0, 3), 'forward': round(float(self.forward[j]), 2),
+                'atm_iv': _num(atm[j]) if ok else None, 'rr25': _num(rr[j]) if ok else None,
+                'bf25': _num(bf[j]) if ok else None, 'points': int(n_points[j]), 'solved': int(n_solved[j]),
+            })
+        return out
+
+    def iv(self, moneyness, t):
+        """
+        Surface IV in percent at K/F `moneyness` and maturity `t` (years),
+        broadcast against each other: total variance interpolated linearly
+        in t between the fitted expiries, flat volatility outside them.
+        """
+        i_fit = np.flatnonzero(self.fitted)
+        k, t = np.broadcast_arrays(np.log(np.asarray(moneyness, dtype=float)), np.asarray(t, dtype=float))
+        if not len(i_fit):
+            return np.full(k.shape, np.nan)
+        ts = self.t[i_fit]
+        pos = np.searchsorted(ts, t)
+        lo = i_fit[np.clip(pos - 1, 0, len(i_fit) - 1)]
+        hi = i_fit[np.clip(pos, 0, len(i_fit) - 1)]
+        w_lo, w_hi = self.total_variance(k, lo), self.total_variance(k, hi)
+        t_lo, t_hi = self.t[lo], self.t[hi]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = np.where(t_hi > t_lo, (t - t_lo) / (t_hi - t_lo), 0.0)
+            w = w_lo + (w_hi - w_lo) * frac
+            # outside the fitted range: the nearest smile's volatility, i.e. total variance scaled with t
+            w = np.where(pos == 0, w_hi * t / t_hi, w)
+            w = np.where(pos >= len(i_fit), w_lo * t / t_lo, w)
+            return np.sqrt(np.maximum(w, 0.0) / t) * 100.0
+
+    def smile(self, expiry):
+        """Market legs and fitted IVs for one expiry, by strike."""
+        j = self.expiries.index(expiry)
+        m = self.points['expiry'] == j
+        order = np.argsort(self.points['strike'][m], kind='stable')
+        k = self.points['k'][m][order]
+        return {
+            'expiry': expiry,
+            'strikes': self.points['strike'][m][order].tolist(),
+            'iv_market': np.round(self.points['iv'][m][order], 2).tolist(),
+            'iv_fit': [_num(v) for v in self.smile_iv(k, j)] if self.fitted[j] else None,
+            'solved': self.points['solved'][m][order].tolist(),
+        }
+
+    def to_dict(self, expiry=None, moneyness=MONEYNESS, tenor_days=TENOR_DAYS):
+        """JSON-able summary: term structure, one expiry's smile (default: nearest fitted) and a surface grid."""
+        if expiry is None:
+            fitted = np.flatnonzero(self.fitted)
+            expiry = self.expiries[fitted[0]] if len(fitted) else None
+        days = np.asarray(tenor_days, dtype=float)
+        grid = self.iv(np.asarray(moneyness)[None, :], days[:, None] / 365.0)
+        return {
+            'spot': self.spot,
+            'valuation_time': self.now.isoformat(),
+            'term_structure': self.term_structure(),
+            'smile': self.smile(expiry) if expiry is not None else None,
+            'surface': {'moneyness': list(moneyness), 'days': list(tenor_days),
+                        'iv': [[_num(v) for v in row] for row in grid]},
+        }
+
+
+def _num(v, digits=4):
+    v = float(v)
+    return round(v, digits) if np.isfinite(v) else None
+
+
+class SurfaceCache:
+    """
+    The VolSurface of the latest snapshot version, fitted once: concurrent
+    requests for a new version wait for the one fit in progress.
+    """
+
+    def __init__(self, r=RISK_FREE_RATE, degree=SMILE_DEGREE):
+        self.r = r
+        self.degree = degree
+        self._lock = threading.Lock()
+        self._version = None
+        self._surface = None
+
+    def get(self, snap):
+        with self._lock:
+            hit = self._version == snap['version']
+            metrics.cache('vol_surface', hit)
+            if not hit:
+                with metrics.timed('vol_surface_fit'):
+                    self._surface = VolSurface.fit(snap['df'], valuation_time(snap), self.r, self.degree)
+                self._version = snap['version']
+            return self._surface
@@ -0,0 +1,5 @@
+# conftest.py
+# the package lives in backend/src (PYTHONPATH=/app/src in the Dockerfile)
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,118 @@
+# test_analytics.py
+"""compute_max_pain's prefix-sum curve against the strikes x strikes loop it replaced."""
+import numpy as np
+import pandas as pd
+import pytest
+from backend.analytics import compute_max_pain
+
+
+def reference_max_pain(df):
+    # the original implementation, kept verbatim as the reference
+    strikes = sorted(df['strike'].unique())
+    if not strikes: return None
+    pivot = df.pivot_table(index='strike', columns='optionType', values='OI', aggfunc='sum').fillna(0)
+    pain_map = {}
+    for s0 in strikes:
+        total = 0
+        for s in strikes:
+            ce = pivot.loc[s,'CE'] if 'CE' in pivot.columns else 0
+            pe = pivot.loc[s,'PE'] if 'PE' in pivot.columns else 0
+            total += max(0, s0 - s) * ce + max(0, s - s0) * pe
+        pain_map[s0] = total
+    mp = min(pain_map, key=pain_map.get)
+    return {'max_pain_strike': int(mp), 'pain_map': pain_map}
+
+
+def chain(strikes, ce_oi, pe_oi, expiry='2025-09-23'):
+    rows = [(k, 'CE', oi) for k, oi in zip(strikes, ce_oi) if oi is not None]
+    rows += [(k, 'PE', oi) for k, oi in zip(strikes, pe_oi) if oi is not None]
+    df = pd.DataFrame(rows, columns=['strike', 'optionType', 'OI'])
+    df['expiry'] = pd.Timestamp(expiry)
+    return df
+
+
+def random_chain(rng, n=60, expiries=('2025-09-23',)):
+    parts = []
+    for e in expiries:
+        strikes = 24000.0 + 50.0 * np.sort(rng.choice(200, n, replace=False))
+        ce = rng.integers(0, 200_000, n).astype(float)
+        pe = rng.integers(0, 200_000, n).astype(float)
+        # some strikes quote only one side
+        ce_side = [None if m else v for v, m in zip(ce, rng.random(n) < 0.1)]
+        pe_side = [None if m else v for v, m in zip(pe, rng.random(n) < 0.1)]
+        parts.append(chain(strikes, ce_side, pe_side, e))
+    return pd.concat(parts, ignore_index=True)
+
+
+def assert_same(got, want):
+    assert got['max_pain_strike'] == want['max_pain_strike']
+    assert list(got['pain_map']) == [float(k) for k in want['pain_map']]
+    np.testing.assert_allclose(list(got['pain_map'].values()), list(want['pain_map'].values()), rtol=1e-12)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_chains(seed):
+    df = random_chain(np.random.default_rng(seed))
+    assert_same(compute_max_pain(df), reference_max_pain(df))
+
+
+def test_categorical_option_type():
+    df = random_chain(np.random.default_rng(99))
+    df['optionType'] = df['optionType'].astype('category')
+    assert_same(compute_max_pain(df), reference_max_pain(df))
+
+
+def test_duplicate_legs_are_summed():
+    df = random_chain(np.random.default_rng(5))
+    df = pd.concat([df, df.iloc[::3]], ignore_index=True)
+    assert_same(compute_max_pain(df), reference_max_pain(df))
+
+
+def test_only_calls():
+    df = chain([100.0, 200.0, 300.0], [10, 20, 30], [None, None, None])
+    assert_same(compute_max_pain(df), reference_max_pain(df))
+    assert compute_max_pain(df)['max_pain_strike'] == 100
+
+
+def test_only_puts():
+    df = chain([100.0, 200.0, 300.0], [None, None, None], [10, 20, 30])
+    assert_same(compute_max_pain(df), reference_max_pain(df))
+    assert compute_max_pain(df)['max_pain_strike'] == 300
+
+
+def test_one_sided_strikes():
+    df = chain([100.0, 200.0, 300.0, 400.0], [50, None, 5, None], [None, 40, None, 70])
+    assert_same(compute_max_pain(df), reference_max_pain(df))
+
+
+def test_tie_takes_lowest_strike():
+    # symmetric chain: pain(200) == pain(300)
+    df = chain([100.0, 200.0, 300.0, 400.0], [10, 10, 10, 10], [10, 10, 10, 10])
+    want = reference_max_pain(df)
+    assert want['pain_map'][200.0] == want['pain_map'][300.0]
+    assert_same(compute_max_pain(df), want)
+    assert compute_max_pain(df)['max_pain_strike'] == 200
+
+
+def test_zero_oi():
+    df = chain([100.0, 200.0], [0, 0], [0, 0])
+    assert_same(compute_max_pain(df), reference_max_pain(df))
+
+
+def test_empty_chain():
+    df = chain([], [], [])
+    assert reference_max_pain(df) is None
+    assert compute_max_pain(df) is None
+    assert compute_max_pain(df, by_expiry=True) is None
+    assert compute_max_pain(None) is None
+
+
+def test_by_expiry():
+    expiries = ('2025-09-23', '2025-09-30', '2025-10-28')
+    df = random_chain(np.random.default_rng(7), n=40, expiries=expiries)
+    got = compute_max_pain(df, by_expiry=True)
+    assert list(got) == list(expiries)
+    for e in expiries:
+        assert_same(got[e], reference_max_pain(df[df['expiry'] == pd.Timestamp(e)]))
+    # without by_expiry OI is summed across expiries
+    assert_same(compute_max_pain(df), reference_max_pain(df))
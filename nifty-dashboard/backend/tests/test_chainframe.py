@@ -0,0 +1,110 @@
+# test_chainframe.py
+"""compute_chain_stats on a ChainFrame against the pandas window_stats pipeline it replaced."""
+import numpy as np
+import pandas as pd
+import pytest
+from backend.analytics import compute_max_pain, compute_pcr, compute_skew, compute_vwap, compute_window_bounds_from_spot
+from backend.chainframe import ChainFrame, compute_chain_stats
+from backend.fetcher import normalize_nse_json
+from backend.synth import payload
+
+
+def reference_stats(df, mode='FIXED', atm_window=3):
+    # the original /api/nifty/window_stats body, kept verbatim as the reference
+    spot = float(df['underlyingPrice'].median()) if (df is not None and not df.empty) else None
+    atm, low, high = compute_window_bounds_from_spot(spot, fixed=(mode == 'FIXED'), atm_window_strikes=atm_window)
+
+    if low is None or high is None:
+        window_df = df.copy() if (df is not None) else pd.DataFrame()
+    else:
+        window_df = df[(df['strike'] >= low) & (df['strike'] <= high)].copy()
+
+    pcr_window = compute_pcr(window_df, mode='OI', exclude_zero=True, strike_min=low, strike_max=high)
+
+    def _compute_window_totals(df_window):
+        if df_window is None or df_window.empty:
+            return {"CE_OI": 0, "PE_OI": 0, "CE_vol": 0, "PE_vol": 0}
+        pivot_oi = df_window.pivot_table(index='strike', columns='optionType', values='OI', aggfunc='sum', observed=True).fillna(0)
+        pivot_vol = df_window.pivot_table(index='strike', columns='optionType', values='volume', aggfunc='sum', observed=True).fillna(0)
+        if 'CE' not in pivot_oi.columns:
+            pivot_oi['CE'] = 0
+        if 'PE' not in pivot_oi.columns:
+            pivot_oi['PE'] = 0
+        if 'CE' not in pivot_vol.columns:
+            pivot_vol['CE'] = 0
+        if 'PE' not in pivot_vol.columns:
+            pivot_vol['PE'] = 0
+        keep = (pivot_oi['CE'] > 0) & (pivot_oi['PE'] > 0)
+        pivot_oi_kept = pivot_oi[keep]
+        pivot_vol_kept = pivot_vol[keep]
+        return {
+            "CE_OI": int(pivot_oi_kept['CE'].sum()),
+            "PE_OI": int(pivot_oi_kept['PE'].sum()),
+            "CE_vol": int(pivot_vol_kept['CE'].sum()),
+            "PE_vol": int(pivot_vol_kept['PE'].sum())
+        }
+
+    pcr_window_details = _compute_window_totals(window_df)
+    pcr_overall = compute_pcr(df, mode='OI', exclude_zero=False)
+
+    vwap = compute_vwap(window_df)
+    mp = compute_max_pain(window_df)
+    mp_by_expiry = compute_max_pain(window_df, by_expiry=True)
+    skew = compute_skew(window_df)
+    prev_close = float(df['underlyingPrice'].iloc[0]) if (df is not None and not df.empty) else None
+    return {
+        'atm': atm, 'low': low, 'high': high,
+        'pcr_window': pcr_window, 'pcr_window_details': pcr_window_details, 'pcr_overall': pcr_overall,
+        'vwap': vwap, 'max_pain': mp, 'max_pain_by_expiry': mp_by_expiry, 'skew': skew, 'prev_close': prev_close,
+    }
+
+
+def assert_close(got, want):
+    if want is None:
+        assert got is None
+    else:
+        # ChainFrame rounds the float32 price/IV columns back to 2 decimals; pandas medians them raw
+        assert got == pytest.approx(want, rel=1e-6, nan_ok=True)
+
+
+def assert_same_pain(got, want):
+    if want is None:
+        assert got is None
+        return
+    assert got['max_pain_strike'] == want['max_pain_strike']
+    assert list(got['pain_map']) == [float(k) for k in want['pain_map']]
+    np.testing.assert_allclose(list(got['pain_map'].values()), list(want['pain_map'].values()), rtol=1e-12)
+
+
+def assert_same(got, want):
+    assert (got['atm'], got['low'], got['high']) == (want['atm'], want['low'], want['high'])
+    assert got['pcr_window_details'] == want['pcr_window_details']
+    for key in ('pcr_window', 'pcr_overall', 'skew', 'prev_close'):
+        assert_close(got[key], want[key])
+    assert set(got['vwap']) == set(want['vwap'])
+    for side, v in want['vwap'].items():
+        assert_close(got['vwap'][side], v)
+    assert_same_pain(got['max_pain'], want['max_pain'])
+    want_by_expiry = want['max_pain_by_expiry'] or {}
+    assert list(got['max_pain_by_expiry']) == list(want_by_expiry)
+    for exp, mp in want_by_expiry.items():
+        assert_same_pain(got['max_pain_by_expiry'][exp], mp)
+
+
+@pytest.mark.parametrize('zero_oi', [0.0, 0.2, 0.6])
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('mode,atm_window', [('FIXED', 3), ('ATM', 3), ('ATM', 8)])
+def test_matches_pandas_pipeline(seed, zero_oi, mode, atm_window):
+    df = normalize_nse_json(payload(strikes=80, expiries=3, zero_oi=zero_oi, seed=seed))
+    got = compute_chain_stats(ChainFrame.from_df(df), mode=mode, atm_window=atm_window)
+    assert_same(got, reference_stats(df, mode=mode, atm_window=atm_window))
+
+
+def test_window_without_usable_strikes():
+    # every leg in the window has zero OI on at least one side
+    df = normalize_nse_json(payload(strikes=60, expiries=2, zero_oi=1.0, seed=5))
+    got = compute_chain_stats(ChainFrame.from_df(df), mode='ATM', atm_window=2)
+    want = reference_stats(df, mode='ATM', atm_window=2)
+    assert got['pcr_window'] is None and got['pcr_overall'] is None
+    assert got['pcr_window_details'] == {"CE_OI": 0, "PE_OI": 0, "CE_vol": 0, "PE_vol": 0}
+    assert_same(got, want)
@@ -0,0 +1,160 @@
+# test_greeks.py
+"""Vectorized Black-Scholes and the batched IV solver against the scalar functions they replace."""
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+from backend.greeks import (bs_price, bs_delta, bs_gamma, bs_theta, bs_price_batch, bs_gamma_batch,
+                            bs_greeks_batch, implied_vol_batch, chain_greeks, fill_iv, years_to_expiry)
+
+S = 25000.0
+R = 0.065
+HOUR = 1 / (365 * 24)
+# deep ITM .. deep OTM for calls (the reverse for puts); a week-long expiry down to the last hour
+STRIKES = [21000.0, 24000.0, 24900.0, 25000.0, 25100.0, 26000.0, 29000.0]
+TIMES = [HOUR, 6 * HOUR, 2 / 365, 7 / 365, 30 / 365, 1.0]
+SIGMAS = [0.08, 0.15, 0.4, 1.2]
+Q = [0.0, 0.012]
+
+
+def grid():
+    rows = list(itertools.product(STRIKES, TIMES, SIGMAS, Q, (True, False)))
+    K, t, sigma, q, call = (np.array(c) for c in zip(*rows))
+    return K, t, sigma, q, call
+
+
+def scalar(fn, K, t, sigma, q, call, with_type=True):
+    out = []
+    for k, tt, v, qq, c in zip(K, t, sigma, q, call):
+        args = (S, k, R, v, tt) + (('call' if c else 'put'),) if with_type else (S, k, R, v, tt)
+        out.append(fn(*args, q=qq))
+    return np.array(out)
+
+
+def test_batch_matches_scalar_functions():
+    K, t, sigma, q, call = grid()
+    g = bs_greeks_batch(S, K, R, sigma, t, call, q)
+    np.testing.assert_allclose(g['price'], scalar(bs_price, K, t, sigma, q, call), rtol=1e-9, atol=1e-8)
+    np.testing.assert_allclose(g['delta'], scalar(bs_delta, K, t, sigma, q, call), rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(g['gamma'], scalar(bs_gamma, K, t, sigma, q, call, with_type=False), rtol=1e-9, atol=1e-15)
+    np.testing.assert_allclose(g['theta'], scalar(bs_theta, K, t, sigma, q, call), rtol=1e-9, atol=1e-8)
+    np.testing.assert_allclose(bs_price_batch(S, K, R, sigma, t, call, q), g['price'], rtol=1e-12, atol=1e-10)
+    np.testing.assert_allclose(bs_gamma_batch(S, K, R, sigma, t, q), g['gamma'], rtol=1e-12, atol=1e-18)
+
+
+def test_option_type_spellings():
+    K = np.array(STRIKES)
+    for call, put in ((True, False), ('call', 'put'), ('CE', 'PE')):
+        np.testing.assert_array_equal(bs_price_batch(S, K, R, 0.2, 0.1, call), bs_price_batch(S, K, R, 0.2, 0.1, np.ones(len(K), bool)))
+        np.testing.assert_array_equal(bs_price_batch(S, K, R, 0.2, 0.1, put), bs_price_batch(S, K, R, 0.2, 0.1, np.zeros(len(K), bool)))
+
+
+def test_vega_and_rho_match_finite_differences():
+    K, t, sigma, q, call = grid()
+    g = bs_greeks_batch(S, K, R, sigma, t, call, q)
+    h = 1e-5
+    vega = (bs_price_batch(S, K, R, sigma + h, t, call, q) - bs_price_batch(S, K, R, sigma - h, t, call, q)) / (2 * h) / 100
+    rho = (bs_price_batch(S, K, R + h, sigma, t, call, q) - bs_price_batch(S, K, R - h, sigma, t, call, q)) / (2 * h) / 100
+    np.testing.assert_allclose(g['vega'], vega, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(g['rho'], rho, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize('t,sigma', [(0.0, 0.2), (-0.01, 0.2), (0.1, 0.0)])
+def test_expired_or_zero_vol_follow_scalar_fallbacks(t, sigma):
+    K = np.array(STRIKES)
+    for c in (True, False):
+        call = np.full(len(K), c)
+        g = bs_greeks_batch(S, K, R, sigma, t, call)
+        kind = 'call' if c else 'put'
+        np.testing.assert_array_equal(g['price'], [bs_price(S, k, R, sigma, t, kind) for k in K])
+        np.testing.assert_array_equal(g['delta'], [bs_delta(S, k, R, sigma, t, kind) for k in K])
+        np.testing.assert_array_equal(g['gamma'], [bs_gamma(S, k, R, sigma, t) for k in K])
+        for name in ('theta', 'vega', 'rho'):
+            assert not g[name].any()
+        assert np.isfinite(g['price']).all()
+
+
+def test_implied_vol_round_trip():
+    K, t, sigma, q, call = grid()
+    price = bs_price_batch(S, K, R, sigma, t, call, q)
+    iv = implied_vol_batch(price, S, K, R, t, call, q)
+    intrinsic = np.where(call, np.maximum(0, S * np.exp(-q * t) - K * np.exp(-R * t)),
+                         np.maximum(0, K * np.exp(-R * t) - S * np.exp(-q * t)))
+    # solvable: a price measurably above its no-arbitrage floor
+    ok = price - intrinsic > 1e-6
+    assert ok.sum() > len(ok) // 2
+    assert np.isfinite(iv[ok]).all()
+    np.testing.assert_allclose(bs_price_batch(S, K[ok], R, iv[ok], t[ok], call[ok], q[ok]), price[ok], atol=1e-5)
+    # where the price carries enough vega, the vol itself comes back
+    vega = bs_greeks_batch(S, K, R, sigma, t, call, q)['vega']
+    sharp = ok & (vega > 0.5)
+    np.testing.assert_allclose(iv[sharp], sigma[sharp], rtol=1e-5)
+
+
+def test_implied_vol_nan_outside_bounds():
+    K = np.array([24000.0, 25000.0, 26000.0])
+    t = 7 / 365
+    call = np.array([True, True, False])
+    fair = bs_price_batch(S, K, R, 0.2, t, call)
+    intrinsic = np.where(call, S - K * np.exp(-R * t), K * np.exp(-R * t) - S)
+    intrinsic = np.maximum(intrinsic, 0)
+    assert np.isnan(implied_vol_batch(intrinsic - 1.0, S, K, R, t, call)).all()     # below intrinsic
+    assert np.isnan(implied_vol_batch(np.zeros(3), S, K, R, t, call)).all()         # nothing to solve
+    assert np.isnan(implied_vol_batch(-fair, S, K, R, t, call)).all()
+    upper = np.where(call, S, K * np.exp(-R * t))
+    assert np.isnan(implied_vol_batch(upper + 1.0, S, K, R, t, call)).all()         # above the no-arbitrage cap
+    assert np.isnan(implied_vol_batch(fair, S, K, R, 0.0, call)).all()              # expired
+    assert np.isnan(implied_vol_batch(fair, S, K, R, -HOUR, call)).all()
+    # in-range prices are clamped into the solver's bracket
+    iv = implied_vol_batch(fair, S, K, R, t, call, lo=1e-4, hi=5.0)
+    assert ((iv >= 1e-4) & (iv <= 5.0)).all()
+
+
+def chain():
+    now = pd.Timestamp('2025-09-19 12:00')
+    expiries = [pd.Timestamp('2025-09-19'), pd.Timestamp('2025-09-23'), pd.Timestamp('2025-10-28')]
+    rows = []
+    for e, k, c in itertools.product(expiries, STRIKES, ('CE', 'PE')):
+        rows.append({'strike': k, 'optionType': c, 'expiry': e, 'underlyingPrice': S, 'impliedVolatility': 14.0})
+    df = pd.DataFrame(rows)
+    t = years_to_expiry(df['expiry'], now)
+    call = (df['optionType'] == 'CE').to_numpy()
+    sigma = 0.12 + 0.2 * np.abs(np.log(df['strike'] / S))
+    fair = bs_price_batch(S, df['strike'], R, sigma, t, call)
+    df['lastPrice'] = np.round(fair, 2)
+    df['bidPrice'] = fair - 0.05
+    df['askPrice'] = fair + 0.05
+    # NSE leaves some IVs at zero
+    df.loc[df.index % 3 == 0, 'impliedVolatility'] = 0.0
+    return df, now, t, call, sigma
+
+
+def test_chain_greeks_matches_scalar_greeks():
+    df, now, t, call, sigma = chain()
+    out = chain_greeks(df, r=R, now=now)
+    np.testing.assert_allclose(out['t'], t)
+    nse = df['impliedVolatility'].to_numpy()
+    zero = nse == 0
+    # solved from the mid, which is the fair price here
+    solvable = zero & np.isfinite(out['iv_solved'])
+    np.testing.assert_allclose(out['iv_solved'][solvable], sigma[solvable] * 100, rtol=1e-4)
+    np.testing.assert_array_equal(out['iv'][~zero], nse[~zero])
+    np.testing.assert_array_equal(out['iv'][zero], out['iv_solved'][zero])
+    for i in np.flatnonzero(np.isfinite(out['iv'].to_numpy())):
+        v, kind, k = out['iv'].iat[i] / 100, 'call' if call[i] else 'put', df['strike'].iat[i]
+        assert out['delta'].iat[i] == pytest.approx(bs_delta(S, k, R, v, t[i], kind), abs=1e-9)
+        assert out['gamma'].iat[i] == pytest.approx(bs_gamma(S, k, R, v, t[i]), rel=1e-9, abs=1e-15)
+        assert out['theta'].iat[i] == pytest.approx(bs_theta(S, k, R, v, t[i], kind), rel=1e-9, abs=1e-8)
+
+
+def test_fill_iv_only_solves_zero_iv_rows_in_mask():
+    df, now, t, call, sigma = chain()
+    nse = df['impliedVolatility'].to_numpy()
+    where = df['strike'].to_numpy() >= S
+    iv = fill_iv(df, S, t, R, where=where)
+    solved = where & (nse == 0)
+    np.testing.assert_array_equal(iv[~solved], nse[~solved])
+    ok = solved & np.isfinite(iv)
+    assert ok.any()
+    np.testing.assert_allclose(iv[ok], sigma[ok] * 100, rtol=1e-4)
+    assert chain_greeks(df.iloc[:0]).empty
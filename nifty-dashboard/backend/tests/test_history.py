@@ -0,0 +1,40 @@
+# test_history.py
+"""HistoryStore: legs whose expiry did not parse are dropped before the day-number encoding."""
+import numpy as np
+from backend import metrics
+from backend.fetcher import normalize_nse_json
+from backend.history import HistoryStore
+from backend.synth import payload
+
+TS = np.datetime64('2025-09-19T04:00:00', 'ns')
+
+
+def chain(bad=0):
+    p = payload(strikes=20, expiries=2, seed=3)
+    for d in p['records']['data'][:bad]:
+        d['expiryDate'] = 'not-a-date'
+        for leg in ('CE', 'PE'):
+            if leg in d:
+                d[leg]['expiryDate'] = 'not-a-date'
+    return normalize_nse_json(p)
+
+
+def test_nat_expiry_legs_are_dropped(tmp_path):
+    df = chain(bad=3)
+    missing = df['expiry'].isna()
+    assert missing.any()
+    store = HistoryStore(str(tmp_path))
+    before = metrics.ERRORS.value('history_expiry')
+    store.append(TS, df)
+    assert metrics.ERRORS.value('history_expiry') == before + 1
+    out = store.read(store.day_of(TS))
+    assert len(out) == (~missing).sum()
+    assert set(out['expiry']) == set(df.loc[~missing, 'expiry'])
+
+
+def test_all_nat_expiries_write_nothing(tmp_path):
+    df = chain()
+    df['expiry'] = df['expiry'].cat.set_categories([])
+    store = HistoryStore(str(tmp_path))
+    store.append(TS, df)
+    assert store.days() == []
@@ -0,0 +1,242 @@
+# test_nse_client.py
+"""NSEClient against a local stub of the NSE site: cookies, latency, throttling and the circuit breaker."""
+import importlib, json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+# classes are looked up on the module: test_nse_base_url_env reloads it
+from backend import nse_client
+
+
+class Stub:
+    """
+    Homepage `/` hands out a fresh cookie per visit. `/api/...` answers 401
+    without the latest cookie, otherwise pops its next status from
+    `statuses` (200 once empty) after sleeping `delay` seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.homepage_hits = 0
+        self.cookie = None
+        self.statuses = []
+        self.delay = 0.0
+        self.api_hits = []
+        self.active = 0
+        self.max_active = 0
+
+    def next_status(self):
+        with self.lock:
+            return self.statuses.pop(0) if self.statuses else 200
+
+
+@pytest.fixture
+def stub():
+    state = Stub()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=b'', headers=()):
+            self.send_response(status)
+            for k, v in headers:
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/':
+                with state.lock:
+                    state.homepage_hits += 1
+                    state.cookie = 'c%d' % state.homepage_hits
+                return self._send(200, b'<html></html>', [('Set-Cookie', 'nsit=%s; Path=/' % state.cookie)])
+            with state.lock:
+                state.api_hits.append((self.path, time.monotonic()))
+                state.active += 1
+                state.max_active = max(state.max_active, state.active)
+            try:
+                if state.delay:
+                    time.sleep(state.delay)
+                if 'nsit=%s' % state.cookie not in (self.headers.get('Cookie') or ''):
+                    return self._send(401)
+                status = state.next_status()
+                body = json.dumps({'path': self.path, 'cookie': state.cookie}).encode() if status == 200 else b''
+                self._send(status, body, [('Content-Type', 'application/json')])
+            finally:
+                with state.lock:
+                    state.active -= 1
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    state.url = 'http://127.0.0.1:%d' % server.server_address[1]
+    t = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    t.start()
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def client(stub, **kw):
+    kw = dict(dict(retries=3, backoff=0.01, max_backoff=0.05, timeout=(1, 2)), **kw)
+    return nse_client.NSEClient(base_url=stub.url, **kw)
+
+
+def test_nse_base_url_env(stub, monkeypatch):
+    monkeypatch.setenv('NSE_BASE_URL', stub.url)
+    try:
+        mod = importlib.reload(nse_client)
+        c = mod.NSEClient(backoff=0.01)
+        assert c.base_url == stub.url
+        assert c.get_json('/api/option-chain-indices')['path'] == '/api/option-chain-indices'
+    finally:
+        monkeypatch.delenv('NSE_BASE_URL')
+        importlib.reload(nse_client)
+
+
+def test_cookies_are_reused(stub):
+    c = client(stub)
+    for _ in range(5):
+        assert c.get_json('/api/a')['cookie'] == 'c1'
+    assert stub.homepage_hits == 1
+
+
+def test_cookies_refreshed_after_ttl(stub):
+    c = client(stub, cookie_ttl=0.1)
+    c.get_json('/api/a')
+    c.get_json('/api/a')
+    assert stub.homepage_hits == 1
+    time.sleep(0.15)
+    assert c.get_json('/api/a')['cookie'] == 'c2'
+    assert stub.homepage_hits == 2
+
+
+@pytest.mark.parametrize('status', [401, 403])
+def test_cookies_refreshed_after_rejection(stub, status):
+    c = client(stub)
+    c.get_json('/api/a')
+    stub.statuses = [status]
+    assert c.get_json('/api/a')['cookie'] == 'c2'
+    assert stub.homepage_hits == 2
+    assert len(stub.api_hits) == 3
+
+
+def test_cookies_refreshed_when_server_rotates_them(stub):
+    c = client(stub)
+    c.get_json('/api/a')
+    stub.cookie = 'rotated'  # the stub now answers 401 until the homepage is visited again
+    assert c.get_json('/api/a')['cookie'] == 'c2'
+
+
+def test_retries_throttling_with_backoff(stub, monkeypatch):
+    bounds = []
+    monkeypatch.setattr(nse_client.random, 'uniform', lambda a, b: bounds.append(b) or 0.0)
+    c = client(stub, retries=4, backoff=0.01, max_backoff=0.03)
+    stub.statuses = [429, 503, 500]
+    assert c.get_json('/api/a')['path'] == '/api/a'
+    assert len(stub.api_hits) == 4
+    # full-jitter exponential: upper bounds backoff * 2**attempt, capped at max_backoff
+    assert bounds == [0.01, 0.02, 0.03]
+
+
+def test_gives_up_after_retries(stub):
+    c = client(stub, retries=3)
+    stub.statuses = [502, 502, 502]
+    with pytest.raises(RuntimeError, match='502'):
+        c.get_json('/api/a')
+    assert len(stub.api_hits) == 3
+
+
+def test_other_4xx_not_retried(stub):
+    c = client(stub, retries=3)
+    stub.statuses = [404]
+    with pytest.raises(RuntimeError, match='404'):
+        c.get_json('/api/a')
+    assert len(stub.api_hits) == 1
+
+
+def open_circuit(stub, c):
+    stub.statuses = [500] * c.failure_threshold
+    for _ in range(c.failure_threshold):
+        with pytest.raises(RuntimeError):
+            c.get_json('/api/a')
+    assert c.circuit_open
+
+
+def test_circuit_opens_and_fails_fast(stub):
+    c = client(stub, retries=1, failure_threshold=2, cooldown=60)
+    open_circuit(stub, c)
+    hits = len(stub.api_hits)
+    with pytest.raises(nse_client.CircuitOpenError):
+        c.get_json('/api/a')
+    assert len(stub.api_hits) == hits
+
+
+def test_circuit_half_open_lets_one_trial_through_then_closes(stub):
+    c = client(stub, retries=1, failure_threshold=2, cooldown=0.1)
+    open_circuit(stub, c)
+    time.sleep(0.15)
+    stub.delay = 0.3
+    result = {}
+    trial = threading.Thread(target=lambda: result.update(c.get_json('/api/trial')))
+    trial.start()
+    time.sleep(0.1)
+    # the trial is in flight: everyone else still fails fast
+    with pytest.raises(nse_client.CircuitOpenError):
+        c.get_json('/api/other')
+    trial.join()
+    assert result['path'] == '/api/trial'
+    assert not c.circuit_open
+    stub.delay = 0.0
+    assert c.get_json('/api/a')['path'] == '/api/a'
+
+
+def test_circuit_failed_trial_reopens(stub):
+    c = client(stub, retries=1, failure_threshold=2, cooldown=0.1)
+    open_circuit(stub, c)
+    time.sleep(0.15)
+    stub.statuses = [503]
+    with pytest.raises(RuntimeError):
+        c.get_json('/api/a')
+    assert c.circuit_open
+    with pytest.raises(nse_client.CircuitOpenError):
+        c.get_json('/api/a')
+
+
+def test_unexpected_error_in_trial_does_not_wedge_circuit(stub, monkeypatch):
+    c = client(stub, retries=1, failure_threshold=2, cooldown=0.1)
+    open_circuit(stub, c)
+    time.sleep(0.15)
+
+    def boom(force=False):
+        raise KeyError('unexpected')
+    monkeypatch.setattr(c, 'refresh_cookies', boom)
+    with pytest.raises(KeyError):
+        c.get_json('/api/a')
+    monkeypatch.undo()
+    time.sleep(0.15)
+    # a new trial is allowed after the cooldown and closes the circuit
+    assert c.get_json('/api/a')['path'] == '/api/a'
+    assert not c.circuit_open
+
+
+def test_fetch_many_runs_concurrently(stub):
+    c = client(stub, pool_size=4)
+    c.refresh_cookies()
+    stub.delay = 0.3
+    t0 = time.monotonic()
+    out = c.fetch_many({'a': '/api/a', 'b': ('/api/b', {'x': 1}), 'c': '/api/c', 'd': '/api/d'})
+    elapsed = time.monotonic() - t0
+    assert out['a']['path'] == '/api/a'
+    assert out['b']['path'] == '/api/b?x=1'
+    assert elapsed < 0.9
+    assert stub.max_active >= 2
+
+
+def test_fetch_many_returns_exceptions(stub):
+    c = client(stub, retries=1, pool_size=2)
+    c.refresh_cookies()
+    stub.statuses = [404]
+    out = c.fetch_many({'bad': '/api/bad'})
+    assert isinstance(out['bad'], RuntimeError)
+    assert c.fetch_many({'good': '/api/good'})['good']['path'] == '/api/good'
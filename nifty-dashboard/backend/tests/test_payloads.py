@@ -0,0 +1,44 @@
+# test_payloads.py
+"""ChainPayloads: unresolvable `since` versions share one cached full body and ETag."""
+import json
+from backend.fetcher import normalize_nse_json
+from backend.payloads import UNKNOWN_SINCE, ChainPayloads
+from backend.snapshot import chain_views
+from backend.synth import payload
+
+
+def encode(o):
+    return json.dumps(o, default=str)
+
+
+def snapshot(version, seed):
+    df = normalize_nse_json(payload(strikes=30, expiries=2, seed=seed))
+    _, expiries = chain_views(df)
+    return {'version': version, 'df': df, 'expiries': expiries}
+
+
+def test_unknown_since_is_one_cache_entry():
+    payloads = ChainPayloads(encode, keep=3)
+    for v in range(1, 6):
+        payloads.publish(snapshot(v, seed=v))
+    snap = payloads._recent[-1]
+    for since in list(range(-5, 3)) + [99, 10 ** 9]:
+        body, _ = payloads.body(snap, since)
+        out = json.loads(body)
+        assert out['full'] and out['since'] is None and out['rows'] == len(snap['df'])
+    assert {k[1] for k in payloads._bodies} == {UNKNOWN_SINCE}
+    assert payloads.since_key(1) == payloads.since_key(99) == UNKNOWN_SINCE
+    assert ChainPayloads.etag(5, payloads.since_key(1)) == ChainPayloads.etag(5, payloads.since_key(10 ** 9))
+
+
+def test_known_since_keeps_its_own_body():
+    payloads = ChainPayloads(encode, keep=3)
+    for v in range(1, 4):
+        payloads.publish(snapshot(v, seed=1 if v < 3 else 2))
+    snap = payloads._recent[-1]
+    assert payloads.since_key(2) == 2
+    out = json.loads(payloads.body(snap, 2)[0])
+    assert out['since'] == 2
+    assert json.loads(payloads.body(snap, 3)[0])['rows'] == 0
+    assert payloads.since_key(None) is None
+    assert isinstance(json.loads(payloads.body(snap)[0]), list)
@@ -0,0 +1,38 @@
+# test_persist.py
+"""Snapshots dropped by a full persist queue reach neither the snapshot log nor the candles."""
+import json
+from types import SimpleNamespace
+import pandas as pd
+from backend import candles, ingest
+from backend.candles import CandleAggregator, candle_files
+from backend.persist import PersistWriter
+
+
+def snap(ts, spot, volume=10):
+    return {'symbol': 'NIFTY', 'ts': ts, 'chain': SimpleNamespace(spot=spot), 'df': pd.DataFrame({'volume': [volume]})}
+
+
+def test_dropped_snapshot_stays_out_of_candles(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(candles, '_aggregators', {})
+    monkeypatch.setattr(ingest, 'RECORD_HISTORY', False)
+    writer = PersistWriter(maxsize=2)
+    monkeypatch.setattr(ingest, 'persist_writer', writer)
+
+    ingest.persist_snapshot(snap('2025-09-19T09:15:03', 25000.0))
+    ingest.persist_snapshot(snap('2025-09-19T09:15:06', 25010.0))
+    # queue full: dropped from the log, so it must not move the bar either
+    ingest.persist_snapshot(snap('2025-09-19T09:15:09', 26000.0))
+    bar = candles.aggregator('NIFTY').last()
+    assert (bar['high'], bar['close'], bar['volume']) == (25010.0, 25010.0, 20)
+
+    assert writer.flush() == 2
+    log_file, candles_file = candle_files('NIFTY')
+    with open(log_file) as f:
+        assert len(f.readlines()) == 2
+    with open(candles_file) as f:
+        written = json.load(f)
+    # the candles file matches a rebuild from the log alone
+    rebuilt = CandleAggregator(log_file, str(tmp_path / 'rebuilt.json'))
+    rebuilt.load()
+    assert written == rebuilt.candles()
@@ -0,0 +1,72 @@
+# test_pivots.py
+"""Pivot/PCR tables: PE-only PCRs stay "inf", and client windows snap onto listed strikes."""
+import json
+import numpy as np
+import pandas as pd
+from backend.fetcher import normalize_nse_json
+from backend.pivots import INF, PivotTables, build_tables
+from backend.snapshot import chain_views
+from backend.synth import payload
+
+
+def legs(rows):
+    df = pd.DataFrame(rows, columns=['strike', 'optionType', 'OI'])
+    for c in ('OI_change', 'volume', 'bidQty', 'askQty'):
+        df[c] = 0
+    for c in ('impliedVolatility', 'lastPrice', 'LTP_change', 'bidPrice', 'askPrice'):
+        df[c] = 0.0
+    return df
+
+
+def test_pe_only_pcr_is_inf():
+    df = legs([(100.0, 'CE', 0), (100.0, 'PE', 40), (150.0, 'CE', 10), (150.0, 'PE', 20), (200.0, 'PE', 0)])
+    out = build_tables(df, spot=150.0, step=50)
+    rows = {r['strike']: r for r in out['rows']}
+    assert rows[100.0]['PCR'] == INF
+    assert rows[100.0]['PCR_cum'] == INF
+    assert rows[150.0]['PCR'] == 2.0
+    assert rows[150.0]['PCR_cum'] == 6.0
+    # neither side: no ratio
+    assert rows[200.0]['PCR'] is None
+    # OTM: calls above ATM (200, no OI), puts below (100, 40 OI)
+    assert out['buckets']['OTM']['PCR'] == INF
+    assert out['buckets']['ITM']['PCR'] is None
+    assert out['buckets']['TOTAL']['PCR'] == 6.0
+    json.dumps(out, allow_nan=False)
+
+
+def snapshot():
+    df = normalize_nse_json(payload(strikes=40, expiries=2, seed=2))
+    chain, expiries = chain_views(df)
+    return {'version': 1, 'ts': '2025-09-19T06:30:00', 'symbol': 'NIFTY', 'df': df,
+            'chain': chain, 'expiries': expiries}
+
+
+def test_window_snaps_onto_listed_strikes():
+    snap = snapshot()
+    pivots = PivotTables(step=50)
+    strikes = snap['chain'].strikes
+    lo, hi = float(strikes[5]), float(strikes[20])
+    assert pivots.window(snap, lo - 10, hi + 10) == (lo, hi)
+    assert pivots.window(snap, lo - 0.5, hi + 49.5) == (lo, hi)
+    assert pivots.window(snap, None, hi) == (None, hi)
+    assert pivots.window(snap, strikes[0] - 1000, strikes[-1] + 1000) == (None, None)
+    # every empty window shares one key
+    assert pivots.window(snap, lo + 1, lo + 2) == pivots.window(snap, 1e9, 2e9)
+
+
+def test_snapped_window_serves_same_rows():
+    snap = snapshot()
+    pivots = PivotTables(step=50)
+    expiry = next(iter(snap['expiries']))
+    strikes = snap['chain'].strikes
+    raw = (float(strikes[5]) - 13.7, float(strikes[20]) + 21.1)
+    low, high = pivots.window(snap, *raw)
+    df = snap['expiries'][expiry]
+    a = build_tables(df, snap['chain'].spot, 50, *raw)['rows']
+    b = json.loads(pivots.body(snap, expiry, low, high))['rows']
+    assert [r['strike'] for r in a] == [r['strike'] for r in b]
+    assert np.isclose([r['total_OI'] for r in a], [r['total_OI'] for r in b]).all()
+    # a second client with other raw bounds in the same gap hits the same body
+    assert pivots.window(snap, raw[0] + 5, raw[1] - 5) == (low, high)
+    assert len(pivots._bodies) == 1
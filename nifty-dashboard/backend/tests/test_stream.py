@@ -0,0 +1,81 @@
+# test_stream.py
+"""StreamHub / Channel fan-out: shared messages, channel lifetime, builds outside the channel lock."""
+import threading
+from backend.stream import KEEPALIVE, StreamHub
+
+
+def snap(version):
+    return {'version': version}
+
+
+def recording_hub(builds):
+    def make_build(key):
+        def build(s, prev):
+            builds.append((key, s['version'], prev is not None))
+            return {'key': key, 'v': s['version'], 'delta': prev is not None}
+        return build
+    return StreamHub(make_build)
+
+
+def test_full_then_delta_messages():
+    builds = []
+    hub = recording_hub(builds)
+    hub.publish(snap(1))
+    gen = hub.messages('k', timeout=0.01)
+    assert b'"delta": false' in next(gen)
+    assert next(gen) == KEEPALIVE
+    hub.publish(snap(2))
+    assert b'"delta": true' in next(gen)
+    gen.close()
+
+
+def test_one_full_build_per_version_for_all_subscribers():
+    builds = []
+    hub = recording_hub(builds)
+    hub.publish(snap(1))
+    gens = [hub.messages('k', timeout=0.01) for _ in range(3)]
+    assert len({next(g) for g in gens}) == 1
+    assert builds == [('k', 1, False)]
+    for g in gens:
+        g.close()
+
+
+def test_channel_dropped_with_last_subscriber():
+    hub = recording_hub([])
+    a, b = hub.messages('k', timeout=0.01), hub.messages('k', timeout=0.01)
+    next(a), next(b)
+    assert list(hub._channels) == ['k']
+    a.close()
+    assert list(hub._channels) == ['k']
+    b.close()
+    assert hub._channels == {} and hub._refs == {}
+    # a generator that never started streaming holds no channel
+    hub.messages('other')
+    assert hub._channels == {}
+
+
+def test_slow_full_build_does_not_block_waiting_subscribers():
+    release, started = threading.Event(), threading.Event()
+
+    def make_build(key):
+        def build(s, prev):
+            if prev is None and s['version'] == 2:
+                started.set()
+                release.wait(2)
+            return {'v': s['version']}
+        return build
+    hub = StreamHub(make_build)
+    hub.publish(snap(1))
+    waiting = hub.messages('k', timeout=0.01)
+    next(waiting)
+    hub.publish(snap(2))
+    late = hub.messages('k', timeout=0.01)
+    t = threading.Thread(target=lambda: next(late))
+    t.start()
+    assert started.wait(2)
+    # the late subscriber is building the full message; the in-step one still gets its delta
+    assert b'"v": 2' in next(waiting)
+    release.set()
+    t.join()
+    waiting.close()
+    late.close()
@@ -0,0 +1,31 @@
+# test_ttlcache.py
+"""TTLCache: uncacheable values are recomputed on every request and never replace a cached one."""
+import time
+from backend.ttlcache import TTLCache
+
+
+def test_uncacheable_values_are_not_stored():
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'error': 'no_data'} if len(calls) < 3 else {'value': len(calls)}
+    cache = TTLCache('t', ttl=60, stale=0, cacheable=lambda v: 'error' not in v)
+    assert cache.get('k', compute) == {'error': 'no_data'}
+    assert cache.get('k', compute) == {'error': 'no_data'}
+    assert cache.get('k', compute) == {'value': 3}
+    assert cache.get('k', compute) == {'value': 3}
+    assert len(calls) == 3
+
+
+def test_uncacheable_revalidation_keeps_stale_value():
+    answers = iter([{'value': 1}, {'error': 'no_data'}])
+    cache = TTLCache('t', ttl=0.05, stale=60, cacheable=lambda v: 'error' not in v)
+    assert cache.get('k', lambda: next(answers)) == {'value': 1}
+    time.sleep(0.1)
+    # stale: served while one background recompute runs (and yields an uncacheable value)
+    assert cache.get('k', lambda: next(answers)) == {'value': 1}
+    deadline = time.monotonic() + 2
+    while cache._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache._entries['k'][0] == {'value': 1}
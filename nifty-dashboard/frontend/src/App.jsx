@@ -27,8 +27,13 @@ const prevIndexOhlc = {
   previousClose: 25327.05
 };
 
+// underlyings served by the backend (NSE_SYMBOLS) and their strike spacing
+const SYMBOLS = ["NIFTY", "BANKNIFTY", "FINNIFTY", "MIDCPNIFTY"];
+const STRIKE_STEPS = { NIFTY: 50, BANKNIFTY: 100, FINNIFTY: 50, MIDCPNIFTY: 25 };
+
 const POLL_OPTIONS = [
   { label: "Manual", value: 0 },
+  { label: "Live", value: -1 },   // server push (/api/nifty/stream)
   { label: "30s", value: 30000 },
   { label: "1m", value: 60000 },
   { label: "5m", value: 300000 },
@@ -70,12 +75,15 @@ function heatColor(value, max) {
 }
 
 export default function App() {
-  const [rows, setRows] = useState([]);
+  const [pivots, setPivots] = useState(null);
   const [stats, setStats] = useState(null);
   const [candles, setCandles] = useState([]);
   const [loading, setLoading] = useState(false);
   const [errorMsg, setErrorMsg] = useState(null);
 
+  const [symbol, setSymbol] = useState(SYMBOLS[0]);
+  const step = STRIKE_STEPS[symbol] || 50;
+
   const [pollMs, setPollMs] = useState(0);
   const pollRef = useRef(null);
 
@@ -98,54 +106,45 @@ export default function App() {
 
   const [suggestion, setSuggestion] = useState(null);
 
-  async function fetchOptionChain() {
+  // strike rows, PCR buckets and OI per expiry, built (and cached) by the server for the window
+  async function fetchPivotTables() {
     try {
-      const res = await axios.get("/api/nifty/optionchain");
-      if (!Array.isArray(res.data)) throw new Error("optionchain response not array");
-      const normalized = res.data.map((r) => ({
-        ...r,
-        strike: Number(r.strike),
-        OI: Number(r.OI || 0),
-        OI_change: Number(r.OI_change || r.OI_change || 0),
-        volume: Number(r.volume || 0),
-        lastPrice: Number(r.lastPrice || 0),
-        impliedVolatility: Number(r.impliedVolatility || 0),
-        bidQty: Number(r.bidQty || 0),
-        bidPrice: Number(r.bidPrice || r.bidprice || 0),
-        askQty: Number(r.askQty || 0),
-        askPrice: Number(r.askPrice || r.askprice || 0),
-        expiry: r.expiry || r.expiryDate || r.expiry_date,
-      }));
-      setRows(normalized);
-      // when building expiry options
-      const exps = Array.from(new Set(normalized.map((r) => r.expiry))).filter(Boolean)
-        .map(e => ({ raw: e, ts: new Date(e).getTime() }))
-        .sort((a,b) => a.ts - b.ts)
-        .map(x => x.raw);
-      setExpiryOptions(exps);
-      if (!selectedExpiry && exps.length) {
-        // pick nearest (first element after sort)
-        setSelectedExpiry(exps[0]);
-      }
-      setExpiryOptions(exps);
-      if (!selectedExpiry && exps.length) setSelectedExpiry(exps[0]);
-
-      const underlyingVal = normalized.length ? normalized[0].underlyingPrice || normalized[0].underlying : null;
-      setUnderlying(underlyingVal);
-      if (underlyingVal) {
-        const atm = roundToNearestStrike(underlyingVal, 50);
-        setAtmStrike(atm);
+      const params = { symbol, expiry: selectedExpiry || undefined };
+      if (strikeMin != null || strikeMax != null) {
+        params.strike_min = strikeMin ?? undefined;
+        params.strike_max = strikeMax ?? undefined;
+      } else {
+        params.mode = windowMode;
+        params.atm_window = atmWindow;
       }
+      const res = await axios.get("/api/nifty/pivot_tables", { params });
+      applyPivots(res.data);
     } catch (e) {
       console.error(e);
       setErrorMsg(String(e));
     }
   }
 
+  function applyPivots(data) {
+    // the server sends PCRs with PE OI but no CE OI as "inf" (JSON has no Infinity)
+    const pcr = (v) => (v === "inf" ? Infinity : v);
+    for (const r of data.rows || []) {
+      r.PCR = pcr(r.PCR);
+      r.PCR_cum = pcr(r.PCR_cum);
+    }
+    for (const b of Object.values(data.buckets || {})) b.PCR = pcr(b.PCR);
+    setPivots(data);
+    const exps = (data.expiries || []).map((x) => x.expiry);
+    setExpiryOptions(exps);
+    if (!selectedExpiry && data.expiry) setSelectedExpiry(data.expiry);
+    setUnderlying(data.spot);
+    setAtmStrike(data.atm);
+  }
+
   async function fetchWindowStats() {
     try {
       const mode = windowMode;
-      const res = await axios.get("/api/nifty/window_stats", { params: { mode: mode, atm_window: atmWindow } });
+      const res = await axios.get("/api/nifty/window_stats", { params: { symbol, mode: mode, atm_window: atmWindow, expiry: selectedExpiry || undefined } });
       setStats(res.data);
     } catch (e) {
       console.error("window_stats", e);
@@ -154,7 +153,7 @@ export default function App() {
 
   async function fetchCandles() {
     try {
-      const res = await axios.get("/api/nifty/candles");
+      const res = await axios.get("/api/nifty/candles", { params: { symbol } });
       const arr = Array.isArray(res.data) ? res.data : [];
       setCandles(arr);
     } catch (e) {
@@ -168,7 +167,7 @@ export default function App() {
   // fetch index ohlc
   async function fetchIndexOhlc() {
     try {
-      const res = await axios.get("/api/nifty/index_ohlc");
+      const res = await axios.get("/api/nifty/index_ohlc", { params: { symbol } });
       if (res.data) {
         setIndexOhlc(res.data);
         // compute close - avg if available
@@ -185,7 +184,7 @@ export default function App() {
   const [marketStats, setMarketStats] = useState(null);
   async function fetchMarketStats() {
     try {
-      const r = await axios.get("/api/nifty/market_stats");
+      const r = await axios.get("/api/nifty/market_stats", { params: { symbol } });
       setMarketStats(r.data);
     } catch (e) {
       console.error("market_stats", e);
@@ -196,7 +195,7 @@ export default function App() {
     setLoading(true);
     setErrorMsg(null);
     try {
-      await Promise.all([fetchOptionChain(), fetchWindowStats(), fetchCandles(), fetchIndexOhlc(), fetchMarketStats()]);
+      await Promise.all([fetchPivotTables(), fetchWindowStats(), fetchCandles(), fetchIndexOhlc(), fetchMarketStats()]);
     } catch (e) {
       console.error(e);
     } finally {
@@ -206,7 +205,7 @@ export default function App() {
 
   useEffect(() => {
     fetchAll();
-  }, []);
+  }, [symbol, selectedExpiry]);
 
   useEffect(() => {
     if (pollRef.current) {
@@ -220,75 +219,58 @@ export default function App() {
       if (pollRef.current) clearInterval(pollRef.current);
       pollRef.current = null;
     };
-  }, [pollMs, windowMode, atmWindow]);
-
-  const filtered = useMemo(() => {
-    let d = rows.slice();
-    if (selectedExpiry) d = d.filter((r) => String(r.expiry) === String(selectedExpiry));
-    if (strikeMin != null) d = d.filter((r) => r.strike >= Number(strikeMin));
-    if (strikeMax != null) d = d.filter((r) => r.strike <= Number(strikeMax));
-    return d;
-  }, [rows, selectedExpiry, strikeMin, strikeMax]);
-
-  const strikeAgg = useMemo(() => {
-    const map = {};
-    for (const r of filtered) {
-      const s = r.strike;
-      if (!map[s]) map[s] = { strike: s, CE_OI: 0, PE_OI: 0, CE_vol: 0, PE_vol: 0, CE_OI_change: 0, PE_OI_change: 0, CE_last: 0, PE_last: 0, CE_count:0, PE_count:0 };
-      if (r.optionType === "CE") {
-        map[s].CE_OI += r.OI;
-        map[s].CE_OI_change += r.OI_change; 
-        map[s].CE_vol += r.volume;
-        map[s].CE_last = r.lastPrice;
-        map[s].CE_ltp_chng = r.LTP_change;
-        map[s].CE_bidQty = r.bidQty;
-        map[s].CE_bidPrice = r.bidPrice;
-        map[s].CE_askQty = r.askQty;
-        map[s].CE_askPrice = r.askPrice;
-        map[s].CE_count++;
-      } else if (r.optionType === "PE") {
-        map[s].PE_OI += r.OI;
-        map[s].PE_OI_change += r.OI_change;
-        map[s].PE_vol += r.volume;
-        map[s].PE_last = r.lastPrice;
-        map[s].PE_ltp_chng = r.LTP_change;
-        map[s].PE_bidQty = r.bidQty;
-        map[s].PE_bidPrice = r.bidPrice;
-        map[s].PE_askQty = r.askQty;
-        map[s].PE_askPrice = r.askPrice;
-        map[s].PE_count++;
+  }, [pollMs, windowMode, atmWindow, symbol, selectedExpiry, strikeMin, strikeMax]);
+
+  // Live: one server-push stream instead of polling the five endpoints;
+  // each new snapshot version also refreshes the (server-cached) pivot tables
+  useEffect(() => {
+    if (pollMs !== -1) return;
+    const params = new URLSearchParams({ symbol, mode: windowMode, atm_window: atmWindow });
+    if (selectedExpiry) params.set("expiry", selectedExpiry);
+    const es = new EventSource(`/api/nifty/stream?${params}`);
+    es.addEventListener("snapshot", (ev) => {
+      const msg = JSON.parse(ev.data);
+      setErrorMsg(null);
+      if (msg.window_stats) setStats(msg.window_stats);
+      if (msg.index_ohlc) setIndexOhlc(msg.index_ohlc);
+      if (msg.market_stats) setMarketStats(msg.market_stats);
+      if (msg.candle) {
+        setCandles((cs) => (cs.length && cs[cs.length - 1].ts === msg.candle.ts)
+          ? [...cs.slice(0, -1), msg.candle]
+          : [...cs, msg.candle]);
       }
-    }
-    const arr = Object.values(map).sort((a, b) => a.strike - b.strike);
-    arr.forEach((row) => {
-      row.total_OI = (row.CE_OI || 0) + (row.PE_OI || 0);
-      row.PCR = row.CE_OI ? (row.PE_OI / row.CE_OI) : (row.PE_OI ? Infinity : null);
+      fetchPivotTables();
     });
-    return arr;
-  }, [filtered]);
+    es.onerror = () => setErrorMsg("stream disconnected, reconnecting…");
+    return () => es.close();
+  }, [pollMs, windowMode, atmWindow, symbol, selectedExpiry, strikeMin, strikeMax]);
+
+  const strikeAgg = pivots?.rows ?? [];
+  const maxOI = pivots?.max_total_OI ?? 0;
 
-  const maxOI = useMemo(() => {
-    if (!strikeAgg.length) return 0;
-    return Math.max(...strikeAgg.map((r) => r.total_OI || 0));
-  }, [strikeAgg]);
+  // the window is applied on the server: refetch when it moves
+  useEffect(() => {
+    if (strikeMin == null && strikeMax == null) return;
+    fetchPivotTables();
+  }, [strikeMin, strikeMax]);
 
   useEffect(() => {
     if (manualOverride || lockMinMax) return;
     if (!underlying && !atmStrike) return;
-    const atm = atmStrike ?? roundToNearestStrike(underlying, 50);
+    const atm = atmStrike ?? roundToNearestStrike(underlying, step);
     if (!atm) return;
     if (windowMode === "FIXED") {
-      const low = atm - 500;
-      const high = atm + 550;
+      const low = atm - 10 * step;
+      const high = atm + 11 * step;
       setStrikeMin(low);
       setStrikeMax(high);
     } else {
-      const low = atm - atmWindow * 50;
-      const high = atm + atmWindow * 50;
+      const low = atm - atmWindow * step;
+      const high = atm + atmWindow * step;
       setStrikeMin(low);
       setStrikeMax(high);
     }
-  }, [windowMode, atmWindow, underlying, atmStrike, manualOverride, lockMinMax]);
+  }, [windowMode, atmWindow, underlying, atmStrike, manualOverride, lockMinMax, step]);
 
   useEffect(() => {
     const pcrWindow = stats?.pcr_window ?? null;
@@ -321,16 +303,7 @@ export default function App() {
 
   const oiProfileData = strikeAgg.map((r) => ({ strike: r.strike, CE_OI: r.CE_OI || 0, PE_OI: r.PE_OI || 0, total_OI: r.total_OI || 0 }));
 
-  const expiryAreaData = useMemo(() => {
-    const map = {};
-    for (const r of rows) {
-      const e = r.expiry || "unknown";
-      map[e] = map[e] || { expiry: e, CE_OI: 0, PE_OI: 0 };
-      if (r.optionType === "CE") map[e].CE_OI += r.OI || 0;
-      if (r.optionType === "PE") map[e].PE_OI += r.OI || 0;
-    }
-    return Object.values(map).sort((a,b)=> new Date(a.expiry) - new Date(b.expiry));
-  }, [rows]);
+  const expiryAreaData = pivots?.expiries ?? [];
 
 
 
@@ -339,7 +312,7 @@ export default function App() {
     let cancelled = false;
     async function fetchOhlc() {
       try {
-        const res = await axios.get("/api/nifty/index_ohlc");
+        const res = await axios.get("/api/nifty/index_ohlc", { params: { symbol } });
         if (!cancelled && res?.data && !res.data.error) {
           setIndexOhlc(res.data);
         }
@@ -352,7 +325,7 @@ export default function App() {
     // const id = setInterval(fetchOhlc, 30 * 1000); // every 30s
     // return () => { cancelled = true; clearInterval(id); };
     return () => { cancelled = true; };
-  }, []);
+  }, [symbol]);
 
   // helper to parse timeVal or fallback to now
   function parseTimeVal(t) {
@@ -476,8 +449,12 @@ export default function App() {
     <div style={{ padding: 18, background: "#f3f4f6", minHeight: "100vh" }}>
       <div style={{ maxWidth: 1200, margin: "0 auto", background: "#fff", padding: 18, borderRadius: 8 }}>
         <div style={{ display: "flex", justifyContent: "space-between", alignItems: "center" }}>
-          <h1 style={{ margin: 0 }}>NIFTY OI Dashboard</h1>
+          <h1 style={{ margin: 0 }}>{symbol} OI Dashboard</h1>
           <div style={{ display: "flex", gap: 12, alignItems: "center" }}>
+            <select style={{ padding: "6px 10px" }} value={symbol}
+              onChange={(e) => { setSymbol(e.target.value); setSelectedExpiry(null); setPivots(null); setCandles([]); }}>
+              {SYMBOLS.map((s) => <option key={s} value={s}>{s}</option>)}
+            </select>
             <select style={{ padding: "6px 10px" }} value={pollMs} onChange={(e)=>setPollMs(Number(e.target.value))}>
               {POLL_OPTIONS.map(o=> <option key={o.value} value={o.value}>Poll: {o.label}</option>)}
             </select>
@@ -669,8 +646,7 @@ export default function App() {
         { indexOhlc ? (
           <PivotPcrTables
             indexOhlc={indexOhlc}
-            strikeAgg={strikeAgg}
-            atmStrike={atmStrike}
+            buckets={pivots?.buckets}
             windowStats={stats}
           />
         ) : (
@@ -770,7 +746,7 @@ export default function App() {
       </div>
 
       <div style={{ marginTop: 12, color: "#6b7280" }}>
-        Rows: {rows.length} • Filtered: {filtered.length}
+        Strikes: {strikeAgg.length}
         {errorMsg && <div style={{ color: "crimson" }}>Error: {errorMsg}</div>}
       </div>
     </div>
@@ -5,14 +5,13 @@ import React, { useMemo } from "react";
  *
  * Props:
  *  - indexOhlc: object { open, high, low, last, prev_close, avg_val, ... }
- *  - strikeAgg: array of strike aggregated rows (must contain: strike, CE_OI, PE_OI)
- *  - atmStrike: number (ATM strike)
+ *  - buckets: { ATM, ITM, OTM, TOTAL } from /api/nifty/pivot_tables (CE/PE OI and volume, strike ranges, PCR)
  *  - windowStats: optional object returned from /api/nifty/window_stats (contains max_pain etc.)
  *
  * Usage:
- *  <PivotPcrTables indexOhlc={indexOhlc} strikeAgg={strikeAgg} atmStrike={atm} windowStats={windowStats} />
+ *  <PivotPcrTables indexOhlc={indexOhlc} buckets={pivots.buckets} windowStats={windowStats} />
  */
-export default function PivotPcrTables({ indexOhlc = {}, prevIndexOhlc = null, strikeAgg = [], atmStrike = null, windowStats = {} }) {
+export default function PivotPcrTables({ indexOhlc = {}, prevIndexOhlc = null, buckets = null, windowStats = {} }) {
     // ---- helpers ----
     const fmtNum = (v, dp = 0) => {
         if (v === null || v === undefined || Number.isNaN(v)) return "—";
@@ -80,100 +79,18 @@ export default function PivotPcrTables({ indexOhlc = {}, prevIndexOhlc = null, s
 
 
     // ---- PCR breakdown (OTM / ATM / ITM / TOTAL / Max Pain) ----
+    // buckets are summed on the server over the strike window; only the display strings are built here
     const pcrData = useMemo(() => {
-        if (!Array.isArray(strikeAgg)) return null;
+        if (!buckets) return null;
 
-        const atm = Number(atmStrike);
-        if (!Number.isFinite(atm)) return null;
-
-        const makeBucket = () => ({
-            CE_OI: 0, PE_OI: 0,
-            CE_vol: 0, PE_vol: 0,
-            CE_strikes: [], PE_strikes: [] // arrays of strike values that contributed
+        const range = (r) => (r ? `${r[0]} — ${r[1]}` : "—");
+        const finalize = (obj = {}) => ({
+            ...obj,
+            CE_range: range(obj.CE_range),
+            PE_range: range(obj.PE_range)
         });
 
-        const buckets = {
-            ATM: makeBucket(),
-            ITM: makeBucket(),
-            OTM: makeBucket(),
-            TOTAL: makeBucket()
-        };
-
-        for (const srow of strikeAgg) {
-            const st = Number(srow.strike);
-            if (!Number.isFinite(st)) continue;
-
-            const ceOI = Number(srow.CE_OI || 0);
-            const peOI = Number(srow.PE_OI || 0);
-            const ceVol = Number(srow.CE_vol || 0);
-            const peVol = Number(srow.PE_vol || 0);
-
-            // always to total
-            buckets.TOTAL.CE_OI += ceOI;
-            buckets.TOTAL.PE_OI += peOI;
-            buckets.TOTAL.CE_vol += ceVol;
-            buckets.TOTAL.PE_vol += peVol;
-            if (ceOI > 0) buckets.TOTAL.CE_strikes.push(st);
-            if (peOI > 0) buckets.TOTAL.PE_strikes.push(st);
-
-            if (st === atm) {
-                buckets.ATM.CE_OI += ceOI;
-                buckets.ATM.PE_OI += peOI;
-                buckets.ATM.CE_vol += ceVol;
-                buckets.ATM.PE_vol += peVol;
-                if (ceOI > 0) buckets.ATM.CE_strikes.push(st);
-                if (peOI > 0) buckets.ATM.PE_strikes.push(st);
-            } else if (st < atm) {
-                // lower strikes: CE ITM, PE OTM
-                buckets.ITM.CE_OI += ceOI;
-                buckets.ITM.CE_vol += ceVol;
-                if (ceOI > 0) buckets.ITM.CE_strikes.push(st);
-
-                buckets.OTM.PE_OI += peOI;
-                buckets.OTM.PE_vol += peVol;
-                if (peOI > 0) buckets.OTM.PE_strikes.push(st);
-            } else { // st > atm
-                // higher strikes: PE ITM, CE OTM
-                buckets.ITM.PE_OI += peOI;
-                buckets.ITM.PE_vol += peVol;
-                if (peOI > 0) buckets.ITM.PE_strikes.push(st);
-
-                buckets.OTM.CE_OI += ceOI;
-                buckets.OTM.CE_vol += ceVol;
-                if (ceOI > 0) buckets.OTM.CE_strikes.push(st);
-            }
-        }
-
-        const finalize = (obj) => {
-            const ce = obj.CE_OI || 0;
-            const pe = obj.PE_OI || 0;
-            const ceVol = obj.CE_vol || 0;
-            const peVol = obj.PE_vol || 0;
-
-            const ceRange = (obj.CE_strikes && obj.CE_strikes.length)
-                ? `${Math.min(...obj.CE_strikes)} — ${Math.max(...obj.CE_strikes)}`
-                : "—";
-            const peRange = (obj.PE_strikes && obj.PE_strikes.length)
-                ? `${Math.min(...obj.PE_strikes)} — ${Math.max(...obj.PE_strikes)}`
-                : "—";
-
-            return {
-                CE_OI: ce,
-                PE_OI: pe,
-                CE_vol: ceVol,
-                PE_vol: peVol,
-                CE_range: ceRange,
-                PE_range: peRange,
-                PCR: ce ? (pe / ce) : (pe ? Infinity : null)
-            };
-        };
-
-        const ATM = finalize(buckets.ATM);
-        const ITM = finalize(buckets.ITM);
-        const OTM = finalize(buckets.OTM);
-        const TOTAL = finalize(buckets.TOTAL);
-
-        // Max pain selection (prefer windowStats if available)
+        // Max pain from windowStats (strike of least writer payout)
         let maxPain = null;
         if (windowStats && windowStats.max_pain && windowStats.max_pain.max_pain_strike) {
             maxPain = windowStats.max_pain.max_pain_strike;
@@ -185,18 +102,16 @@ export default function PivotPcrTables({ indexOhlc = {}, prevIndexOhlc = null, s
             if (Number.isFinite(v) && v < minVal) { minVal = v; minStrike = Number(k); }
         }
         maxPain = minStrike;
-        } else {
-        // fallback: pick strike with max total OI
-        let best = null, bestVal = -1;
-        for (const r of strikeAgg) {
-            const total = (Number(r.CE_OI || 0) + Number(r.PE_OI || 0));
-            if (total > bestVal) { bestVal = total; best = r.strike; }
-        }
-        maxPain = best;
         }
 
-        return { ATM, ITM, OTM, TOTAL, maxPain };
-    }, [strikeAgg, atmStrike, windowStats]);
+        return {
+            ATM: finalize(buckets.ATM),
+            ITM: finalize(buckets.ITM),
+            OTM: finalize(buckets.OTM),
+            TOTAL: finalize(buckets.TOTAL),
+            maxPain
+        };
+    }, [buckets, windowStats]);
 
 
   // ---- render ----